@@ -0,0 +1,351 @@
+import asyncio
+import itertools
+import os
+import queue
+import threading
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import paramiko
+from paramiko.message import Message
+from paramiko.sftp import (
+    CMD_ATTRS, CMD_CLOSE, CMD_DATA, CMD_HANDLE, CMD_NAME, CMD_OPEN, CMD_OPENDIR, CMD_READ, CMD_READDIR,
+    CMD_STAT, CMD_STATUS, CMD_WRITE, SFTP_FLAG_CREATE, SFTP_FLAG_READ, SFTP_FLAG_TRUNC, SFTP_FLAG_WRITE,
+    SFTPError, int64,
+)
+
+from integrity import StreamHasher, TransferResult
+from remote_sftp import RemoteSFTP
+from transfer import DEFAULT_QUEUE_DEPTH, DEFAULT_REQUEST_SIZE, ProgressCallback
+
+DEFAULT_ASYNC_CHANNELS = 4
+
+
+class _AsyncChannel:
+    """One SFTP channel whose responses resolve asyncio futures.
+
+    Sending blocks whenever the SSH window is full, so requests are queued
+    to a writer thread rather than sent from the event loop. A reader
+    thread pulls responses off the wire and hands each one to the loop.
+    Two threads per channel carry any number of operations in flight.
+    """
+
+    def __init__(self, sftp: paramiko.SFTPClient, loop: asyncio.AbstractEventLoop):
+        self.sftp = sftp
+        self.loop = loop
+        self._futures: Dict[int, asyncio.Future] = {}
+        # Responses that beat the registration of their future.
+        self._early: Dict[int, Tuple[int, Message]] = {}
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._outbox: "queue.Queue[Optional[Tuple[asyncio.Future, int, tuple]]]" = queue.Queue()
+        self._reader = threading.Thread(target=self._read_loop, name="sftp-async-reader", daemon=True)
+        self._reader.start()
+        self._writer = threading.Thread(target=self._write_loop, name="sftp-async-writer", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        """Stop the writer thread; the reader ends when the channel is closed."""
+        self._outbox.put(None)
+
+    async def request(self, t: int, *args) -> Tuple[int, Message]:
+        """Send one request and wait for its response; SFTP errors are raised as IOError."""
+        future = self.loop.create_future()
+        self._outbox.put((future, t, args))
+        t, msg = await future
+        if t == CMD_STATUS:
+            # Raises for anything but SFTP_OK, including EOFError for end of file.
+            self.sftp._convert_status(msg)
+        return t, msg
+
+    def _async_response(self, t: int, msg: Message, num: int):
+        """Called by paramiko on the reader thread for every response to this channel."""
+        with self._lock:
+            future = self._futures.pop(num, None)
+            if future is None:
+                self._early[num] = (t, msg)
+                return
+        self.loop.call_soon_threadsafe(self._resolve, future, (t, msg))
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, value):
+        if not future.done():
+            future.set_result(value)
+
+    def _write_loop(self):
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                return
+            future, t, args = item
+            try:
+                num = self.sftp._async_request(self, t, *args)
+            except BaseException as e:
+                self.loop.call_soon_threadsafe(self._fail, future, e)
+                continue
+            with self._lock:
+                error = self._error
+                early = self._early.pop(num, None)
+                if early is None and error is None:
+                    self._futures[num] = future
+            if error is not None:
+                self.loop.call_soon_threadsafe(self._fail, future, error)
+            elif early is not None:
+                self.loop.call_soon_threadsafe(self._resolve, future, early)
+
+    def _read_loop(self):
+        try:
+            while True:
+                self.sftp._read_response()
+        except BaseException as e:
+            with self._lock:
+                self._error = e
+                futures, self._futures = self._futures, {}
+            for future in futures.values():
+                self.loop.call_soon_threadsafe(self._fail, future, e)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, error: BaseException):
+        if not future.done():
+            future.set_exception(paramiko.SSHException(f"SFTP channel closed: {error}"))
+
+
+class AsyncRemoteSFTP:
+    """Asyncio front end for ``RemoteSFTP``.
+
+    Connecting, host key checks and authentication reuse ``RemoteSFTP``
+    and run once in the default executor. After that, ``channels`` pooled
+    SFTP channels are driven directly from the event loop, and operations
+    are spread over them round-robin. Transfers keep up to
+    ``queue_depth`` requests of ``request_size`` bytes in flight on one
+    channel, so a single loop can run thousands of concurrent operations.
+    """
+
+    def __init__(
+        self,
+        remote: Optional[RemoteSFTP] = None,
+        channels: int = DEFAULT_ASYNC_CHANNELS,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        request_size: int = DEFAULT_REQUEST_SIZE,
+    ):
+        self.remote = remote or RemoteSFTP()
+        self.channels = max(1, channels)
+        self.queue_depth = max(1, queue_depth)
+        self.request_size = max(1, request_size)
+        self._channels: List[_AsyncChannel] = []
+        self._next = itertools.count()
+
+    async def connect(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: Optional[str] = None,
+        key_filename: Optional[str] = None,
+    ) -> bool:
+        loop = asyncio.get_running_loop()
+        connected = await loop.run_in_executor(
+            None, self.remote.connect, host, port, username, password, key_filename
+        )
+        if connected:
+            await loop.run_in_executor(None, self._open_channels, loop)
+        return connected
+
+    def _open_channels(self, loop: asyncio.AbstractEventLoop):
+        # Channels stay checked out of the pool for the life of the connection; one is
+        # left behind for the digest checks that verify transfers.
+        for _ in range(min(self.channels, max(1, self.remote.pool.size - 1))):
+            self._channels.append(_AsyncChannel(self.remote.pool.checkout(), loop))
+
+    async def close(self):
+        channels, self._channels = self._channels, []
+        for channel in channels:
+            channel.close()
+            # Discarding closes the channel, which also ends its reader thread.
+            self.remote.pool.checkin(channel.sftp, broken=True)
+        await asyncio.get_running_loop().run_in_executor(None, self.remote.disconnect)
+
+    def is_connected(self) -> bool:
+        return bool(self._channels) and self.remote.is_connected()
+
+    def _channel(self) -> _AsyncChannel:
+        if not self._channels:
+            raise paramiko.SSHException("Not connected")
+        return self._channels[next(self._next) % len(self._channels)]
+
+    async def stat(self, path: str) -> paramiko.SFTPAttributes:
+        t, msg = await self._channel().request(CMD_STAT, path)
+        if t != CMD_ATTRS:
+            raise SFTPError("Expected attributes")
+        return paramiko.SFTPAttributes._from_msg(msg)
+
+    async def iter_dir(self, path: str) -> AsyncIterator[paramiko.SFTPAttributes]:
+        """Yield the entries of a remote directory page by page, as the server returns them."""
+        channel = self._channel()
+        handle = await self._open_handle(channel, CMD_OPENDIR, path)
+        try:
+            while True:
+                try:
+                    t, msg = await channel.request(CMD_READDIR, handle)
+                except EOFError:
+                    return
+                if t != CMD_NAME:
+                    raise SFTPError("Expected name response")
+                for _ in range(msg.get_int()):
+                    filename = msg.get_text()
+                    longname = msg.get_text()
+                    attr = paramiko.SFTPAttributes._from_msg(msg, filename, longname)
+                    if filename not in (".", ".."):
+                        yield attr
+        finally:
+            await self._close_handle(channel, handle)
+
+    async def listdir_attr(self, path: str) -> List[paramiko.SFTPAttributes]:
+        return [attr async for attr in self.iter_dir(path)]
+
+    async def upload(
+        self, local_path: str, remote_path: str, progress: Optional[ProgressCallback] = None
+    ) -> TransferResult:
+        """Upload a file, then verify it by digest the way ``RemoteSFTP`` does.
+
+        Reading and hashing the local file run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        channel = self._channel()
+        total = os.path.getsize(local_path)
+        hasher = StreamHasher(self.remote.digest_algorithm)
+        flags = SFTP_FLAG_WRITE | SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
+        handle = await self._open_handle(channel, CMD_OPEN, remote_path, flags, paramiko.SFTPAttributes())
+        pending: Deque[Tuple[asyncio.Task, int]] = deque()
+        done = 0
+        try:
+            with open(local_path, "rb") as src:
+                for offset in range(0, total, self.request_size):
+                    data = await loop.run_in_executor(None, self._read_block, src, hasher, offset, self.request_size)
+                    pending.append((asyncio.ensure_future(
+                        channel.request(CMD_WRITE, handle, int64(offset), data)), len(data)))
+                    if len(pending) >= self.queue_depth:
+                        done += await self._finish(pending)
+                        if progress:
+                            progress(done, total)
+                while pending:
+                    done += await self._finish(pending)
+                    if progress:
+                        progress(done, total)
+        finally:
+            for task, _ in pending:
+                task.cancel()
+            await self._close_handle(channel, handle)
+        return await loop.run_in_executor(None, self.remote._verify, remote_path, total, hasher.hexdigest(total))
+
+    async def download(
+        self, remote_path: str, local_path: str, progress: Optional[ProgressCallback] = None
+    ) -> TransferResult:
+        """Download a file, then verify it by digest the way ``RemoteSFTP`` does.
+
+        Hashing and writing the local file run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        channel = self._channel()
+        total = (await self.stat(remote_path)).st_size
+        hasher = StreamHasher(self.remote.digest_algorithm)
+        handle = await self._open_handle(channel, CMD_OPEN, remote_path, SFTP_FLAG_READ, paramiko.SFTPAttributes())
+        pending: Deque[Tuple[asyncio.Task, int]] = deque()
+        done = 0
+        try:
+            with open(local_path, "wb") as dst:
+                for offset in range(0, total, self.request_size):
+                    size = min(self.request_size, total - offset)
+                    pending.append((asyncio.ensure_future(
+                        self._read(channel, handle, offset, size)), offset))
+                    if len(pending) >= self.queue_depth:
+                        done += await self._store(pending, dst, hasher)
+                        if progress:
+                            progress(done, total)
+                while pending:
+                    done += await self._store(pending, dst, hasher)
+                    if progress:
+                        progress(done, total)
+        finally:
+            for task, _ in pending:
+                task.cancel()
+            await self._close_handle(channel, handle)
+        if os.path.getsize(local_path) != total:
+            return TransferResult(False, total, hasher.algorithm, error="file sizes differ")
+        return await loop.run_in_executor(None, self.remote._verify, remote_path, total, hasher.hexdigest(total))
+
+    async def iter_upload(self, local_path: str, remote_path: str) -> AsyncIterator[Tuple[int, int]]:
+        """Run an upload, yielding ``(bytes_done, total)`` as it progresses."""
+        async for update in self._progress_of(self.upload, local_path, remote_path):
+            yield update
+
+    async def iter_download(self, remote_path: str, local_path: str) -> AsyncIterator[Tuple[int, int]]:
+        """Run a download, yielding ``(bytes_done, total)`` as it progresses."""
+        async for update in self._progress_of(self.download, remote_path, local_path):
+            yield update
+
+    async def _progress_of(self, transfer, src: str, dst: str) -> AsyncIterator[Tuple[int, int]]:
+        updates: asyncio.Queue = asyncio.Queue()
+        task = asyncio.ensure_future(transfer(src, dst, progress=lambda d, t: updates.put_nowait((d, t))))
+        task.add_done_callback(lambda _: updates.put_nowait(None))
+        try:
+            while True:
+                update = await updates.get()
+                if update is None:
+                    break
+                yield update
+            result = task.result()
+            if not result:
+                raise IOError(f"Transfer of {src} failed: {result.error}")
+        finally:
+            task.cancel()
+
+    async def _read(self, channel: _AsyncChannel, handle: bytes, offset: int, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            # Servers may return less than asked for; ask again for the rest.
+            t, msg = await channel.request(CMD_READ, handle, int64(offset + len(data)), size - len(data))
+            if t != CMD_DATA:
+                raise SFTPError("Expected data")
+            data += msg.get_string()
+        return data
+
+    @staticmethod
+    async def _finish(pending: Deque[Tuple[asyncio.Task, int]]) -> int:
+        task, size = pending.popleft()
+        await task
+        return size
+
+    @staticmethod
+    async def _store(pending: Deque[Tuple[asyncio.Task, int]], dst, hasher: StreamHasher) -> int:
+        task, offset = pending.popleft()
+        data = await task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, AsyncRemoteSFTP._write_block, dst, hasher, offset, data)
+        return len(data)
+
+    @staticmethod
+    def _read_block(src, hasher: StreamHasher, offset: int, size: int) -> bytes:
+        data = src.read(size)
+        hasher.update(offset, data)
+        return data
+
+    @staticmethod
+    def _write_block(dst, hasher: StreamHasher, offset: int, data: bytes):
+        hasher.update(offset, data)
+        dst.seek(offset)
+        dst.write(data)
+
+    @staticmethod
+    async def _open_handle(channel: _AsyncChannel, t: int, *args) -> bytes:
+        kind, msg = await channel.request(t, *args)
+        if kind != CMD_HANDLE:
+            raise SFTPError("Expected handle")
+        return msg.get_binary()
+
+    @staticmethod
+    async def _close_handle(channel: _AsyncChannel, handle: bytes):
+        try:
+            await channel.request(CMD_CLOSE, handle)
+        except (IOError, paramiko.SSHException):
+            pass
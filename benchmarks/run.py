@@ -0,0 +1,309 @@
+"""Transfer benchmarks for RemoteSFTP against a local stand-in SFTP server.
+
+Run from the repository root::
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --latency-ms 0 20 80 --concurrency 1 4 8 --output tuned.json
+    python -m benchmarks.run --output new.json --compare results.json --threshold 0.15
+
+Every combination of latency, concurrency and chunk size runs these
+scenarios: upload and download of one file per ``--sizes`` entry, a sync
+push of ``--file-counts`` small files, and a listing of a folder of that
+many entries. Each point is repeated ``--repeat`` times and the median is
+reported. With ``--compare`` the exit status is 1 when any point got
+slower by more than ``--threshold``.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import paramiko
+
+from benchmarks.server import StandInServer
+from local_fs import LocalFileSystem
+from remote_sftp import RemoteSFTP
+from sftp_pool import DEFAULT_POOL_SIZE
+from sync import SyncEngine, PUSH
+from transfer import DEFAULT_CHANNELS, DEFAULT_REQUEST_SIZE
+
+FORMAT_VERSION = 1
+DEFAULT_SIZES = ["64K", "4M", "64M"]
+DEFAULT_FILE_COUNTS = [100, 1000]
+DEFAULT_LATENCIES_MS = [0.0, 20.0]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+SMALL_FILE_SIZE = 4 * 1024
+# Fields that identify a measurement; everything else in a result is a metric.
+KEY_FIELDS = ("scenario", "latency_ms", "concurrency", "chunk_size", "size", "files")
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the library's progress prints, showing them only if the block fails."""
+    buffer = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(buffer):
+            yield
+    except BaseException:
+        sys.stderr.write(buffer.getvalue())
+        raise
+
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def write_random(path: str, size: int):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, 1024 * 1024)
+            f.write(os.urandom(n))
+            remaining -= n
+
+
+class Bench:
+    """Holds the scratch tree and collects results for one run of the matrix."""
+
+    def __init__(self, args: argparse.Namespace, workdir: str):
+        self.args = args
+        self.workdir = workdir
+        self.local_dir = os.path.join(workdir, "local")
+        self.remote_dir = os.path.join(workdir, "remote")
+        self.results: List[Dict] = []
+        os.makedirs(self.local_dir)
+        os.makedirs(self.remote_dir)
+        self.sources = {}
+        for size in args.sizes:
+            path = os.path.join(self.local_dir, f"file-{size}.bin")
+            write_random(path, size)
+            self.sources[size] = path
+        self.trees = {}
+        for count in args.file_counts:
+            root = os.path.join(self.local_dir, f"tree-{count}")
+            os.makedirs(root)
+            for i in range(count):
+                write_random(os.path.join(root, f"f{i:06d}.dat"), SMALL_FILE_SIZE)
+            self.trees[count] = root
+            # Listings are measured on a folder the server already has.
+            shutil.copytree(root, os.path.join(self.remote_dir, f"listing-{count}"))
+
+    def run(self):
+        for latency_ms in self.args.latency_ms:
+            server = StandInServer(latency=latency_ms / 1000, allow_exec=self.args.exec)
+            try:
+                for concurrency, chunk_size in itertools.product(self.args.concurrency, self.args.chunk_sizes):
+                    self.run_point(server, latency_ms, concurrency, chunk_size)
+            finally:
+                server.close()
+
+    def run_point(self, server: StandInServer, latency_ms: float, concurrency: int, chunk_size: int):
+        base = {"latency_ms": latency_ms, "concurrency": concurrency, "chunk_size": chunk_size}
+        with self.connect(server, concurrency, chunk_size) as remote:
+            for size, source in self.sources.items():
+                remote_path = os.path.join(self.remote_dir, os.path.basename(source))
+                local_copy = source + ".down"
+                self.measure(dict(base, scenario="upload", size=size),
+                             lambda: self.check(remote.upload_file(source, remote_path, resume=False)))
+                self.measure(dict(base, scenario="download", size=size),
+                             lambda: self.check(remote.download_file(remote_path, local_copy, resume=False)))
+                os.remove(local_copy)
+
+            for count, root in self.trees.items():
+                engine = SyncEngine(LocalFileSystem(), remote, workers=concurrency)
+                target = os.path.join(self.remote_dir, f"sync-{count}")
+
+                def push():
+                    shutil.rmtree(target, ignore_errors=True)
+                    report = engine.run(root, target, PUSH)
+                    if report.errors:
+                        raise RuntimeError(f"sync failed: {report.errors[0][1]}")
+
+                self.measure(dict(base, scenario="sync_push", files=count, size=count * SMALL_FILE_SIZE), push)
+                shutil.rmtree(target, ignore_errors=True)
+
+                listing = os.path.join(self.remote_dir, f"listing-{count}")
+                self.measure_listing(dict(base, scenario="listing", files=count), remote, listing)
+
+    def measure(self, key: Dict, fn: Callable[[], None]):
+        runs = []
+        for _ in range(self.args.repeat):
+            with quiet():
+                runs.append(timed(fn))
+        seconds = statistics.median(runs)
+        result = dict(key, seconds=round(seconds, 6), runs=[round(r, 6) for r in runs])
+        if key.get("size"):
+            result["mb_per_s"] = round(key["size"] / seconds / 1e6, 3)
+        if key.get("files"):
+            result["files_per_s"] = round(key["files"] / seconds, 1)
+        self.record(result)
+
+    def measure_listing(self, key: Dict, remote: RemoteSFTP, path: str):
+        runs, first_pages = [], []
+        for _ in range(self.args.repeat):
+            start = time.perf_counter()
+            first_page = None
+            entries = 0
+            for page in remote.iter_dir(path, refresh=True):
+                if first_page is None:
+                    first_page = time.perf_counter() - start
+                entries += len(page)
+            runs.append(time.perf_counter() - start)
+            first_pages.append(first_page or 0.0)
+            if entries != key["files"]:
+                raise RuntimeError(f"listing returned {entries} of {key['files']} entries")
+        seconds = statistics.median(runs)
+        self.record(dict(
+            key, seconds=round(seconds, 6), runs=[round(r, 6) for r in runs],
+            first_page_s=round(statistics.median(first_pages), 6), files_per_s=round(key["files"] / seconds, 1),
+        ))
+
+    def record(self, result: Dict):
+        # Identifying fields first, in a fixed order, so result files diff cleanly.
+        result = dict({field: result[field] for field in KEY_FIELDS if field in result}, **result)
+        self.results.append(result)
+        print(describe(result), file=sys.stderr)
+
+    @contextlib.contextmanager
+    def connect(self, server: StandInServer, concurrency: int, chunk_size: int) -> Iterator[RemoteSFTP]:
+        known_hosts = os.path.join(self.workdir, "known_hosts")
+        with open(known_hosts, "w") as f:
+            f.write(server.known_hosts_line())
+        remote = RemoteSFTP(
+            known_hosts_path=known_hosts,
+            request_size=chunk_size,
+            transfer_channels=concurrency,
+            pool_size=max(DEFAULT_POOL_SIZE, concurrency),
+        )
+        with quiet():
+            if not remote.connect("127.0.0.1", server.port, server.username, server.password):
+                raise RuntimeError("could not connect to the stand-in server")
+        try:
+            yield remote
+        finally:
+            with quiet():
+                remote.disconnect()
+
+    @staticmethod
+    def check(result):
+        if not result:
+            raise RuntimeError(result.error or "transfer failed")
+
+
+def describe(result: Dict) -> str:
+    point = ", ".join(f"{field}={result[field]}" for field in KEY_FIELDS[1:] if field in result)
+    rate = f"{result['mb_per_s']} MB/s" if "mb_per_s" in result else f"{result.get('files_per_s')} files/s"
+    return f"{result['scenario']:<10} {point}: {result['seconds']:.3f}s ({rate})"
+
+
+def result_key(result: Dict) -> Tuple:
+    return tuple(result.get(field) for field in KEY_FIELDS)
+
+
+def compare(old: Dict, new: Dict, threshold: float) -> List[str]:
+    """Return a line for every point that got slower than the baseline by more than ``threshold``."""
+    baseline = {result_key(r): r for r in old.get("results", [])}
+    regressions = []
+    for result in new["results"]:
+        before = baseline.get(result_key(result))
+        if not before or not before["seconds"]:
+            continue
+        change = result["seconds"] / before["seconds"] - 1
+        if change > threshold:
+            regressions.append(f"{describe(result)} was {before['seconds']:.3f}s (+{change:.0%})")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run", description="Benchmark RemoteSFTP against a local stand-in server."
+    )
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[parse_size(s) for s in DEFAULT_SIZES],
+                        help="file sizes for upload/download, e.g. 64K 4M 1G (default: %(default)s)")
+    parser.add_argument("--file-counts", nargs="+", type=int, default=DEFAULT_FILE_COUNTS,
+                        help="small files per sync push and entries per listing (default: %(default)s)")
+    parser.add_argument("--latency-ms", nargs="+", type=float, default=DEFAULT_LATENCIES_MS,
+                        help="injected round-trip latency in milliseconds (default: %(default)s)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, DEFAULT_CHANNELS],
+                        help="parallel transfer channels and sync workers (default: %(default)s)")
+    parser.add_argument("--chunk-sizes", nargs="+", type=parse_size, default=[DEFAULT_REQUEST_SIZE],
+                        help="SFTP request sizes, e.g. 32K 64K (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per point; the median is kept")
+    parser.add_argument("--exec", action="store_true",
+                        help="let the server run commands (server-side digests and tar batching)")
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown counted as a regression (default: %(default)s)")
+    parser.add_argument("--workdir", help="scratch directory (default: a temporary one)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.repeat = max(1, args.repeat)
+    # Connection resets from the stand-in server at teardown are expected, not worth a traceback.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    workdir = tempfile.mkdtemp(prefix="sftp-bench-", dir=args.workdir)
+    started = time.time()
+    try:
+        bench = Bench(args, workdir)
+        bench.run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "format": FORMAT_VERSION,
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+            "duration_s": round(time.time() - started, 3),
+            "python": platform.python_version(),
+            "paramiko": paramiko.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "exec": args.exec,
+            "repeat": args.repeat,
+        },
+        "results": bench.results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), output, args.threshold)
+        for line in regressions:
+            print(f"[!] Regression: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"[+] No regressions beyond {args.threshold:.0%} against {args.compare}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
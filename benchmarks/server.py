@@ -0,0 +1,309 @@
+"""Stand-in SFTP server for benchmarks: paramiko on localhost, no outside services.
+
+Paths are served straight from the local filesystem, so benchmarks work in
+a temporary directory and pass absolute paths. Latency is injected by a TCP
+proxy that holds every chunk for half the round trip in each direction,
+which keeps pipelined requests overlapping as they would on a real link.
+"""
+import heapq
+import itertools
+import os
+import secrets
+import socket
+import subprocess
+import threading
+import time
+from typing import List
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+from paramiko.sftp import SFTP_OK
+
+
+def _errors_to_status(method):
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+    return wrapper
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return _apply_attrs(self.filename, attr)
+
+
+def _apply_attrs(path: str, attr: SFTPAttributes):
+    try:
+        if attr._flags & attr.FLAG_SIZE:
+            os.truncate(path, attr.st_size)
+        if attr._flags & attr.FLAG_AMTIME:
+            os.utime(path, (attr.st_atime, attr.st_mtime))
+        if attr._flags & attr.FLAG_PERMISSIONS:
+            os.chmod(path, attr.st_mode & 0o7777)
+    except OSError as e:
+        return SFTPServer.convert_errno(e.errno)
+    return SFTP_OK
+
+
+class _FileSystem(SFTPServerInterface):
+    def canonicalize(self, path):
+        return os.path.normpath(path if os.path.isabs(path) else os.path.join(os.getcwd(), path))
+
+    @_errors_to_status
+    def list_folder(self, path):
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                attr = SFTPAttributes.from_stat(entry.stat(follow_symlinks=False), entry.name)
+                entries.append(attr)
+        return entries
+
+    @_errors_to_status
+    def stat(self, path):
+        return SFTPAttributes.from_stat(os.stat(path))
+
+    @_errors_to_status
+    def lstat(self, path):
+        return SFTPAttributes.from_stat(os.lstat(path))
+
+    @_errors_to_status
+    def open(self, path, flags, attr):
+        fd = os.open(path, flags, 0o644)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = f
+        return handle
+
+    @_errors_to_status
+    def remove(self, path):
+        os.remove(path)
+        return SFTP_OK
+
+    @_errors_to_status
+    def rename(self, old, new):
+        os.rename(old, new)
+        return SFTP_OK
+
+    @_errors_to_status
+    def posix_rename(self, old, new):
+        os.replace(old, new)
+        return SFTP_OK
+
+    @_errors_to_status
+    def mkdir(self, path, attr):
+        os.mkdir(path)
+        return SFTP_OK
+
+    @_errors_to_status
+    def rmdir(self, path):
+        os.rmdir(path)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return _apply_attrs(path, attr)
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, username: str, password: str, allow_exec: bool):
+        self.username = username
+        self.password = password
+        self.allow_exec = allow_exec
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == self.username and secrets.compare_digest(password, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        if not self.allow_exec:
+            return False
+        threading.Thread(target=_run_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+def _run_exec(channel: paramiko.Channel, command: str):
+    proc = subprocess.Popen(
+        ["/bin/sh", "-c", command], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    def feed():
+        for data in iter(lambda: channel.recv(65536), b""):
+            proc.stdin.write(data)
+        proc.stdin.close()
+
+    def errors():
+        for data in iter(lambda: proc.stderr.read(65536), b""):
+            channel.sendall_stderr(data)
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=errors, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for data in iter(lambda: proc.stdout.read(65536), b""):
+        channel.sendall(data)
+    threads[1].join()
+    channel.send_exit_status(proc.wait())
+    channel.close()
+
+
+class StandInServer:
+    """Threaded paramiko SSH/SFTP server on 127.0.0.1 with a throwaway host key and password.
+
+    ``allow_exec`` lets clients run shell commands, which the tar batching
+    and server-side digests need; it is off by default. ``port`` is where
+    clients should connect: the server itself, or the latency proxy in
+    front of it when ``latency`` (round trip, seconds) is set.
+    """
+
+    def __init__(self, latency: float = 0.0, allow_exec: bool = False, username: str = "bench"):
+        self.username = username
+        self.password = secrets.token_urlsafe(16)
+        self.allow_exec = allow_exec
+        self.host_key = paramiko.ECDSAKey.generate()
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(64)
+        self._transports: List[paramiko.Transport] = []
+        self._closed = threading.Event()
+        self._proxy = LatencyProxy(self._sock.getsockname()[1], latency) if latency > 0 else None
+        threading.Thread(target=self._accept, name="bench-sftp-accept", daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self._proxy.port if self._proxy else self._sock.getsockname()[1]
+
+    def known_hosts_line(self) -> str:
+        return f"[127.0.0.1]:{self.port} {self.host_key.get_name()} {self.host_key.get_base64()}\n"
+
+    def close(self):
+        self._closed.set()
+        self._sock.close()
+        if self._proxy:
+            self._proxy.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", SFTPServer, _FileSystem)
+        self._transports.append(transport)
+        try:
+            transport.start_server(server=_Server(self.username, self.password, self.allow_exec))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+
+class LatencyProxy:
+    """TCP relay that delays every chunk by half of ``latency`` in each direction."""
+
+    def __init__(self, target_port: int, latency: float):
+        self.target_port = target_port
+        self.delay = latency / 2
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(64)
+        self._closed = threading.Event()
+        threading.Thread(target=self._accept, name="bench-latency-proxy", daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self._sock.getsockname()[1]
+
+    def close(self):
+        self._closed.set()
+        self._sock.close()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _DelayedPipe(client, server, self.delay)
+            _DelayedPipe(server, client, self.delay)
+
+
+class _DelayedPipe:
+    """One direction of the proxy: a reader stamps chunks, a writer sends them once due."""
+
+    def __init__(self, src: socket.socket, dst: socket.socket, delay: float):
+        self.src = src
+        self.dst = dst
+        self.delay = delay
+        self._queue: list = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._eof = False
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _read(self):
+        try:
+            for data in iter(lambda: self.src.recv(262144), b""):
+                with self._cond:
+                    heapq.heappush(self._queue, (time.monotonic() + self.delay, next(self._order), data))
+                    self._cond.notify()
+        except OSError:
+            pass
+        with self._cond:
+            self._eof = True
+            self._cond.notify()
+
+    def _write(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._eof:
+                        self._cond.wait()
+                    if not self._queue:
+                        break
+                    due, _, data = self._queue[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    heapq.heappop(self._queue)
+                self.dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                self.dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import time
+from typing import Iterable, List, Optional, Tuple
+
+CHECKPOINT_SUFFIX = ".sftp-part"
+# Bytes hashed at each end of the transferred prefix. Hashing the whole
+# prefix of a 40 GB file on every checkpoint would cost more than the resume saves.
+HASH_WINDOW = 1024 * 1024
+SAVE_INTERVAL = 2.0
+
+
+def sidecar_path(local_path: str) -> str:
+    """Hidden checkpoint file next to the local side of a transfer."""
+    folder, name = os.path.split(local_path)
+    return os.path.join(folder, f".{name}{CHECKPOINT_SUFFIX}")
+
+
+def hash_ranges(length: int) -> List[Tuple[int, int]]:
+    """``(offset, size)`` ranges of a ``length`` byte prefix that go into its hash."""
+    ranges = [(0, min(length, HASH_WINDOW))]
+    if length > HASH_WINDOW:
+        start = max(HASH_WINDOW, length - HASH_WINDOW)
+        ranges.append((start, length - start))
+    return [r for r in ranges if r[1] > 0]
+
+
+def digest_prefix(length: int, blocks: Iterable[bytes]) -> str:
+    """Hash the blocks read from ``hash_ranges(length)``, in order."""
+    digest = hashlib.sha256(str(length).encode())
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def prefix_hash(path: str, length: int) -> str:
+    """SHA-256 of the first and last ``HASH_WINDOW`` bytes of ``path[:length]``."""
+    with open(path, "rb") as f:
+        blocks = []
+        for offset, size in hash_ranges(length):
+            f.seek(offset)
+            blocks.append(f.read(size))
+    return digest_prefix(length, blocks)
+
+
+class TransferCheckpoint:
+    """Resume state of one partially transferred file, kept in a JSON sidecar.
+
+    ``source_size`` and ``source_mtime`` describe the file being read (remote
+    for downloads, local for uploads) so a resume is refused once it changes.
+    ``offset`` is the committed prefix and ``prefix_hash`` is the hash of that
+    prefix of the local file. For downloads it guards the partial local data;
+    for uploads it is compared against the same prefix of the remote file.
+    """
+
+    def __init__(
+        self,
+        local_path: str,
+        direction: str,
+        remote_path: str,
+        source_size: int,
+        source_mtime: int,
+        offset: int = 0,
+        prefix_hash: str = "",
+    ):
+        self.local_path = local_path
+        self.direction = direction
+        self.remote_path = remote_path
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self.offset = offset
+        self.prefix_hash = prefix_hash
+        self.committed = offset
+        self._saved_at = 0.0
+
+    @property
+    def path(self) -> str:
+        return sidecar_path(self.local_path)
+
+    @classmethod
+    def load(cls, local_path: str) -> Optional["TransferCheckpoint"]:
+        try:
+            with open(sidecar_path(local_path), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(
+                local_path,
+                data["direction"],
+                data["remote_path"],
+                int(data["source_size"]),
+                int(data["source_mtime"]),
+                int(data["offset"]),
+                data["prefix_hash"],
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def matches(self, direction: str, remote_path: str, source_size: int, source_mtime: int) -> bool:
+        """True if this checkpoint belongs to the same transfer of an unchanged source."""
+        return (
+            self.direction == direction
+            and self.remote_path == remote_path
+            and self.source_size == source_size
+            and self.source_mtime == int(source_mtime)
+            and 0 < self.offset <= source_size
+        )
+
+    def verify_prefix(self) -> bool:
+        """Re-hash the local prefix and compare it with the recorded hash."""
+        try:
+            if os.path.getsize(self.local_path) < self.offset:
+                return False
+            return prefix_hash(self.local_path, self.offset) == self.prefix_hash
+        except OSError:
+            return False
+
+    def update(self, offset: int):
+        """Record a new committed offset and persist it atomically."""
+        self.offset = offset
+        self.prefix_hash = prefix_hash(self.local_path, offset)
+        self.save()
+
+    def commit(self, offset: int):
+        """Note a new committed offset, persisting it at most every ``SAVE_INTERVAL`` seconds."""
+        self.committed = offset
+        now = time.monotonic()
+        if now - self._saved_at >= SAVE_INTERVAL:
+            self._saved_at = now
+            self.update(offset)
+
+    def flush(self):
+        """Persist the last committed offset if it has not been saved yet."""
+        if self.committed > self.offset:
+            self.update(self.committed)
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "direction": self.direction,
+                    "remote_path": self.remote_path,
+                    "source_size": self.source_size,
+                    "source_mtime": self.source_mtime,
+                    "offset": self.offset,
+                    "prefix_hash": self.prefix_hash,
+                }, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[!] Could not write checkpoint {self.path}: {e}")
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[!] Could not remove checkpoint {self.path}: {e}")
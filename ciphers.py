@@ -0,0 +1,222 @@
+import hmac
+import json
+import os
+import platform
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import cryptography
+import paramiko
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher
+
+ALGORITHMS_DEFAULT = "default"
+ALGORITHMS_FASTEST = "fastest"
+ALGORITHM_MODES = (ALGORITHMS_DEFAULT, ALGORITHMS_FASTEST)
+
+# Only these are ever offered. CBC modes, 3DES, SHA-1 and MD5 are left out on purpose.
+APPROVED_CIPHERS = (
+    "aes128-gcm@openssh.com",
+    "aes256-gcm@openssh.com",
+    "aes128-ctr",
+    "aes192-ctr",
+    "aes256-ctr",
+)
+APPROVED_MACS = (
+    "hmac-sha2-256-etm@openssh.com",
+    "hmac-sha2-512-etm@openssh.com",
+    "hmac-sha2-256",
+    "hmac-sha2-512",
+)
+DEFAULT_RANKING_CACHE = os.path.expanduser("~/.cache/secure-sftp/algorithms.json")
+# Packets of this size are what bulk SFTP transfers put on the wire.
+BENCH_PACKET_SIZE = 32 * 1024
+BENCH_SECONDS = 0.05
+
+
+class AlgorithmPreference(NamedTuple):
+    """Cipher and MAC order for one host; an empty tuple leaves that list to the ranking."""
+
+    ciphers: Tuple[str, ...] = ()
+    macs: Tuple[str, ...] = ()
+
+
+class AlgorithmRanking(NamedTuple):
+    """Approved ciphers and MACs, fastest first, with the bytes per second each managed."""
+
+    signature: str
+    ciphers: Tuple[str, ...]
+    macs: Tuple[str, ...]
+    rates: Dict[str, float]
+
+    def describe(self) -> str:
+        best = ", ".join(f"{name} {self.rates[name] / 1e6:.0f} MB/s" for name in self.ciphers[:3])
+        return f"cipher ranking: {best}"
+
+
+def machine_signature() -> str:
+    """Identify this CPU and crypto stack; a ranking measured elsewhere is not reused."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    openssl = default_backend().openssl_version_text()
+    return "|".join((platform.machine(), cpu, openssl, cryptography.__version__, paramiko.__version__))
+
+
+def measure_cipher(name: str, seconds: float = BENCH_SECONDS) -> float:
+    """Encrypt packets the way paramiko's packetizer does and return bytes per second."""
+    info = paramiko.Transport._cipher_info[name]
+    key = os.urandom(info["key-size"])
+    packet = os.urandom(BENCH_PACKET_SIZE)
+    if info.get("is_aead"):
+        engine = info["class"](key)
+        nonce = bytearray(os.urandom(info["iv-size"]))
+
+        def encrypt():
+            engine.encrypt(bytes(nonce), packet, packet[:4])
+    else:
+        iv = os.urandom(info["block-size"])
+        encryptor = Cipher(info["class"](key), info["mode"](iv), backend=default_backend()).encryptor()
+
+        def encrypt():
+            encryptor.update(packet)
+
+    return _rate(encrypt, seconds)
+
+
+def measure_mac(name: str, seconds: float = BENCH_SECONDS) -> float:
+    """Compute packet MACs the way paramiko does and return bytes per second."""
+    digest = paramiko.Transport._mac_info[name]["class"]
+    key = os.urandom(digest().digest_size)
+    packet = os.urandom(BENCH_PACKET_SIZE)
+    return _rate(lambda: hmac.new(key, packet, digest).digest(), seconds)
+
+
+def _rate(fn, seconds: float) -> float:
+    fn()  # warm up
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - start
+    return count * BENCH_PACKET_SIZE / elapsed
+
+
+def rank(ciphers: Sequence[str] = APPROVED_CIPHERS, macs: Sequence[str] = APPROVED_MACS) -> AlgorithmRanking:
+    """Benchmark the approved algorithms paramiko supports on this machine.
+
+    A CTR cipher also pays for a MAC on every packet while GCM authenticates
+    as it encrypts, so CTR ciphers are ranked by their throughput combined
+    with the fastest MAC.
+    """
+    ciphers = supported(ciphers, paramiko.Transport._cipher_info)
+    macs = supported(macs, paramiko.Transport._mac_info)
+    rates = {name: measure_mac(name) for name in macs}
+    best_mac = max(rates.values()) if rates else 0.0
+    for name in ciphers:
+        rate = measure_cipher(name)
+        if not paramiko.Transport._cipher_info[name].get("is_aead") and best_mac:
+            rate = 1 / (1 / rate + 1 / best_mac)
+        rates[name] = rate
+    return AlgorithmRanking(
+        machine_signature(),
+        tuple(sorted(ciphers, key=lambda n: -rates[n])),
+        tuple(sorted(macs, key=lambda n: -rates[n])),
+        rates,
+    )
+
+
+def supported(names: Iterable[str], known: Dict[str, dict]) -> Tuple[str, ...]:
+    return tuple(name for name in names if name in known)
+
+
+_ranking_lock = threading.Lock()
+_rankings: Dict[str, AlgorithmRanking] = {}
+
+
+def cached_ranking(cache_path: str = DEFAULT_RANKING_CACHE) -> AlgorithmRanking:
+    """Return this machine's ranking, measuring it only if neither memory nor ``cache_path`` has one."""
+    with _ranking_lock:
+        ranking = _rankings.get(cache_path)
+        signature = machine_signature()
+        if ranking and ranking.signature == signature:
+            return ranking
+        ranking = _load(cache_path, signature)
+        if ranking is None:
+            ranking = rank()
+            _save(cache_path, ranking)
+        _rankings[cache_path] = ranking
+        return ranking
+
+
+def _load(path: str, signature: str) -> Optional[AlgorithmRanking]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        ranking = AlgorithmRanking(data["signature"], tuple(data["ciphers"]), tuple(data["macs"]),
+                                   dict(data["rates"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return ranking if ranking.signature == signature else None
+
+
+def _save(path: str, ranking: AlgorithmRanking):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ranking._asdict(), f, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[!] Cannot cache cipher ranking in {path}: {e}")
+
+
+def preferred_order(
+    ranking: Optional[AlgorithmRanking],
+    override: Optional[AlgorithmPreference] = None,
+    approved_ciphers: Sequence[str] = APPROVED_CIPHERS,
+    approved_macs: Sequence[str] = APPROVED_MACS,
+) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Work out the (ciphers, macs) to offer: an override's order, else the ranking, within the approved set."""
+    ciphers = _order(override.ciphers if override else (), ranking.ciphers if ranking else (), approved_ciphers,
+                     paramiko.Transport._cipher_info)
+    macs = _order(override.macs if override else (), ranking.macs if ranking else (), approved_macs,
+                  paramiko.Transport._mac_info)
+    return ciphers, macs
+
+
+def _order(wanted: Sequence[str], ranked: Sequence[str], approved: Sequence[str], known: Dict[str, dict]) -> Tuple[str, ...]:
+    allowed = supported(approved, known)
+    rejected = [name for name in wanted if name not in allowed]
+    if rejected:
+        print(f"[!] Ignoring algorithms outside the approved set: {', '.join(rejected)}")
+    chosen: List[str] = [name for name in wanted if name in allowed]
+    if not chosen:
+        chosen = [name for name in ranked if name in allowed]
+        # Approved names the ranking has not seen yet still go on the end.
+        chosen += [name for name in allowed if name not in chosen]
+    return tuple(chosen)
+
+
+def transport_factory(ciphers: Sequence[str], macs: Sequence[str]):
+    """Build a ``transport_factory`` for ``SSHClient.connect`` that offers only these, in this order."""
+
+    def factory(sock, **kwargs) -> paramiko.Transport:
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        if ciphers:
+            options.ciphers = tuple(ciphers)
+        if macs:
+            options.digests = tuple(macs)
+        return transport
+
+    return factory
@@ -0,0 +1,480 @@
+"""Headless command-line client: put/get/ls/sync and batch files, without the GUI stack.
+
+Examples::
+
+    python cli.py -H host -u user put 'build/*.tar.gz' /srv/releases
+    python cli.py -H host -u user --json get '/var/log/app/*.log' ./logs
+    python cli.py -H host -u user sync ./site /var/www --delete --dry-run
+    python cli.py -H host -u user batch nightly.txt
+    python cli.py -H host -u user find /var/www --name '*.php' --exclude .git --max-depth 4
+    python cli.py -H host -u user --index ~/.cache/sftp.db index /srv/archive
+    python cli.py -H host -u user --index ~/.cache/sftp.db search --name 'report-*.pdf' --min-size 1000000
+    python cli.py -H web1 -u deploy fanout app.tar.gz /srv/releases --to web2 web3:2222 ops@web4
+    python cli.py -H host -u user --metrics sftp.prom put big.iso /srv
+
+Exit codes: 0 success, 1 some operations failed, 2 usage error, 3 could not connect.
+"""
+import argparse
+import contextlib
+import fnmatch
+import getpass
+import glob
+import json
+import os
+import posixpath
+import shlex
+import sys
+import time
+from typing import Callable, List, Optional, TextIO
+
+from ciphers import ALGORITHM_MODES, ALGORITHMS_FASTEST, AlgorithmPreference
+from compression import COMPRESSION_AUTO, COMPRESSION_MODES
+from fanout import DEFAULT_HOST_TIMEOUT, FanOutTarget, FanOutUpload, parse_target
+from local_fs import LocalFileSystem
+from metrics import TransferProgress
+from remote_index import DEFAULT_SEARCH_LIMIT
+from remote_sftp import DEFAULT_KEEPALIVE_INTERVAL, DEFAULT_RECONNECT_ATTEMPTS, RemoteSFTP
+from sync import SyncEngine, DEFAULT_DELTA_THRESHOLD, DEFAULT_SYNC_WORKERS, PUSH, PULL
+from tar_batch import DEFAULT_BATCH_FILES, DEFAULT_SMALL_FILE_LIMIT
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CONNECT = 3
+# Minimum seconds between JSON progress events for one file.
+PROGRESS_INTERVAL = 0.5
+
+
+class Reporter:
+    """Writes results as plain text, or as one JSON object per line with ``--json``."""
+
+    def __init__(self, out: TextIO, as_json: bool):
+        self.out = out
+        self.as_json = as_json
+        self.ok = 0
+        self.failed = 0
+
+    def emit(self, event: str, **fields):
+        if self.as_json:
+            self.out.write(json.dumps({"event": event, **fields}) + "\n")
+            self.out.flush()
+
+    def text(self, line: str):
+        if not self.as_json:
+            self.out.write(line + "\n")
+
+    def result(self, op: str, path: str, ok: bool, **fields):
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+        self.emit("result", op=op, path=path, ok=ok, **fields)
+
+    def progress(self, op: str, path: str) -> Callable[[int, int], None]:
+        last = [0.0]
+
+        def report(snapshot):
+            now = time.monotonic()
+            if snapshot.done == snapshot.total or now - last[0] >= PROGRESS_INTERVAL:
+                last[0] = now
+                self.emit("progress", op=op, path=path, done=snapshot.done, total=snapshot.total,
+                          rate=round(snapshot.rate), average_rate=round(snapshot.average_rate),
+                          first_byte=snapshot.first_byte)
+
+        return TransferProgress(report)
+
+
+def algorithm_list(text: str) -> tuple:
+    return tuple(name.strip() for name in text.split(",") if name.strip())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Headless secure SFTP client.")
+    parser.add_argument("-H", "--host", required=True)
+    parser.add_argument("-p", "--port", type=int, default=22)
+    parser.add_argument("-u", "--user", required=True)
+    parser.add_argument("-i", "--key", dest="key_filename", help="private key file")
+    parser.add_argument("--password-env", default="SFTP_PASSWORD",
+                        help="environment variable holding the password (default: SFTP_PASSWORD)")
+    parser.add_argument("--ask-password", action="store_true", help="prompt for the password on the terminal")
+    parser.add_argument("--known-hosts", default=os.path.expanduser("~/.ssh/known_hosts"))
+    parser.add_argument("--trust-new-host", action="store_true",
+                        help="accept and record an unknown host key instead of refusing it")
+    parser.add_argument("--compression", choices=COMPRESSION_MODES, default=COMPRESSION_AUTO,
+                        help="compress transfers: off, on, or auto to decide per file from a sample (default: auto)")
+    parser.add_argument("--algorithms", choices=ALGORITHM_MODES, default=ALGORITHMS_FASTEST,
+                        help="cipher/MAC order: paramiko's default, or the approved ones fastest-first as "
+                             "benchmarked on this machine (default: fastest)")
+    parser.add_argument("--ciphers", type=algorithm_list, default=(),
+                        help="comma-separated ciphers to offer this host, in order (approved ones only)")
+    parser.add_argument("--macs", type=algorithm_list, default=(),
+                        help="comma-separated MACs to offer this host, in order (approved ones only)")
+    parser.add_argument("--keepalive", type=int, default=DEFAULT_KEEPALIVE_INTERVAL,
+                        help="seconds between SSH keepalives; 0 turns them off (default: %(default)s)")
+    parser.add_argument("--reconnect-attempts", type=int, default=DEFAULT_RECONNECT_ATTEMPTS,
+                        help="times to reconnect and retry when the connection drops; 0 disables (default: %(default)s)")
+    parser.add_argument("--index", metavar="FILE",
+                        help="keep listings in this SQLite index between runs; needed by 'index' and 'search'")
+    parser.add_argument("--json", action="store_true", help="write JSON lines progress and results to stdout")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write latency histograms and counters to FILE in the Prometheus text format")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_commands(commands)
+    return parser
+
+
+def add_commands(commands):
+    put = commands.add_parser("put", help="upload local files matching globs into a remote folder")
+    put.add_argument("sources", nargs="+")
+    put.add_argument("dest")
+    put.add_argument("--no-resume", action="store_true")
+    put.add_argument("--delta", action="store_true",
+                     help="update files that already exist remotely by sending only changed blocks")
+
+    get = commands.add_parser("get", help="download remote files matching globs into a local folder")
+    get.add_argument("sources", nargs="+")
+    get.add_argument("dest")
+    get.add_argument("--no-resume", action="store_true")
+
+    ls = commands.add_parser("ls", help="list a remote folder")
+    ls.add_argument("path", nargs="?", default=".")
+    ls.add_argument("--cached", action="store_true",
+                    help="answer from the --index if it holds the folder, without asking the server")
+
+    find = commands.add_parser("find", help="list a remote tree recursively, many folders at a time")
+    find.add_argument("path", nargs="?", default=".")
+    find.add_argument("--name", action="append", default=[], metavar="GLOB",
+                      help="only report entries whose name or relative path matches; repeatable")
+    find.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                      help="skip matching entries and everything below them; repeatable")
+    find.add_argument("--max-depth", type=int, help="levels below PATH to descend (1 = PATH's own entries)")
+    find.add_argument("--type", choices=("f", "d"), help="only files (f) or only folders (d)")
+
+    index = commands.add_parser("index", help="update the --index of a remote tree, listing only changed folders")
+    index.add_argument("path", nargs="?", default=".")
+    index.add_argument("--full", action="store_true", help="list every folder again")
+
+    search = commands.add_parser("search", help="search the --index without asking the server")
+    search.add_argument("--name", metavar="GLOB", help="case-sensitive name glob")
+    search.add_argument("--under", metavar="PATH", help="only below this remote folder")
+    search.add_argument("--min-size", type=int, metavar="BYTES")
+    search.add_argument("--max-size", type=int, metavar="BYTES")
+    search.add_argument("--newer-than", type=float, metavar="DAYS", help="modified within this many days")
+    search.add_argument("--older-than", type=float, metavar="DAYS", help="not modified for this many days")
+    search.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT)
+
+    sync = commands.add_parser("sync", help="mirror a local folder to a remote one, or back with --pull")
+    sync.add_argument("local")
+    sync.add_argument("remote")
+    sync.add_argument("--pull", action="store_true")
+    sync.add_argument("--delete", action="store_true")
+    sync.add_argument("--checksum", action="store_true")
+    sync.add_argument("--dry-run", action="store_true")
+    sync.add_argument("--workers", type=int, default=DEFAULT_SYNC_WORKERS)
+    sync.add_argument("--small-file-limit", type=int, default=DEFAULT_SMALL_FILE_LIMIT,
+                      help="send files up to this many bytes in tar batches over exec; 0 disables (default: %(default)s)")
+    sync.add_argument("--batch-files", type=int, default=DEFAULT_BATCH_FILES, help="files per tar batch")
+    sync.add_argument("--delta-threshold", type=int, default=DEFAULT_DELTA_THRESHOLD, metavar="BYTES",
+                      help="push changes to files this large as changed blocks only (0: always whole files)")
+
+    fanout = commands.add_parser("fanout", help="upload one local file to this host and every --to host, "
+                                                "reading it only once")
+    fanout.add_argument("source")
+    fanout.add_argument("dest", help="remote folder, the same on every host")
+    fanout.add_argument("--to", nargs="+", default=[], metavar="[USER@]HOST[:PORT]",
+                        help="further hosts; user, port and credentials default to the main connection's")
+    fanout.add_argument("--host-timeout", type=float, default=DEFAULT_HOST_TIMEOUT,
+                        help="drop a host that stalls or holds the others back this many seconds (default: %(default)s)")
+
+    batch = commands.add_parser("batch", help="run put/get/ls/find/index/search/sync/fanout lines from a file ('-' for stdin)")
+    batch.add_argument("file")
+
+
+class Session:
+    """One connection and the commands run over it.
+
+    ``target`` is what the connection was made to, and ``make_remote``
+    builds the extra connections a fan-out upload needs.
+    """
+
+    def __init__(self, remote: RemoteSFTP, reporter: Reporter, target: FanOutTarget,
+                 make_remote: Callable[[FanOutTarget], RemoteSFTP]):
+        self.remote = remote
+        self.reporter = reporter
+        self.target = target
+        self.make_remote = make_remote
+        self.local_fs = LocalFileSystem()
+        with remote.pool.channel() as sftp:
+            self.home = sftp.normalize(".")
+
+    def resolve(self, path: str) -> str:
+        return posixpath.normpath(posixpath.join(self.home, path))
+
+    def run(self, args: argparse.Namespace):
+        try:
+            getattr(self, f"cmd_{args.command}")(args)
+        except Exception as e:
+            print(f"[!] {args.command} failed: {e}")
+            self.reporter.result(args.command, "", False, error=str(e))
+
+    def cmd_put(self, args: argparse.Namespace):
+        dest = self.resolve(args.dest)
+        for pattern in args.sources:
+            matches = sorted(p for p in glob.glob(os.path.expanduser(pattern)) if os.path.isfile(p))
+            if not matches:
+                self.reporter.result("put", pattern, False, error="no matching local files")
+                continue
+            for local_path in matches:
+                remote_path = posixpath.join(dest, os.path.basename(local_path))
+                progress = self.reporter.progress("put", local_path)
+                if args.delta:
+                    result = self.remote.upload_delta(local_path, remote_path, progress=progress)
+                else:
+                    result = self.remote.upload_file(local_path, remote_path, progress=progress,
+                                                     resume=not args.no_resume)
+                self._record("put", local_path, result)
+
+    def cmd_get(self, args: argparse.Namespace):
+        os.makedirs(args.dest, exist_ok=True)
+        for pattern in args.sources:
+            matches = self._remote_glob(self.resolve(pattern))
+            if not matches:
+                self.reporter.result("get", pattern, False, error="no matching remote files")
+                continue
+            for remote_path in matches:
+                local_path = os.path.join(args.dest, posixpath.basename(remote_path))
+                result = self.remote.download_file(
+                    remote_path, local_path, progress=self.reporter.progress("get", remote_path),
+                    resume=not args.no_resume,
+                )
+                self._record("get", remote_path, result)
+
+    def cmd_ls(self, args: argparse.Namespace):
+        path = self.resolve(args.path)
+        try:
+            entries = self.remote.indexed_listing(path) if args.cached else None
+            if entries is None:
+                entries = self.remote.listdir_attr(path)
+            entries = sorted(entries, key=lambda a: a.filename.lower())
+        except (IOError, OSError) as e:
+            self.reporter.result("ls", path, False, error=str(e))
+            return
+        for attr in entries:
+            is_dir = bool(attr.st_mode and attr.st_mode & 0o040000)
+            self.reporter.emit("entry", path=posixpath.join(path, attr.filename), dir=is_dir,
+                               size=attr.st_size, mtime=attr.st_mtime)
+            self.reporter.text(f"{'d' if is_dir else '-'} {attr.st_size:>14} {attr.filename}")
+        self.reporter.result("ls", path, True, count=len(entries))
+
+    def cmd_find(self, args: argparse.Namespace):
+        path = self.resolve(args.path)
+        count = size = 0
+
+        def unreadable(folder: str, error: Exception):
+            print(f"[!] Cannot list {folder}: {error}")
+            self.reporter.result("find", folder, False, error=str(error))
+
+        for entry_path, attr in self.remote.crawl(path, max_depth=args.max_depth, include=args.name,
+                                                  exclude=args.exclude, on_error=unreadable):
+            is_dir = bool(attr.st_mode and attr.st_mode & 0o040000)
+            if args.type and (args.type == "d") != is_dir:
+                continue
+            count += 1
+            size += 0 if is_dir else attr.st_size or 0
+            self.reporter.emit("entry", path=entry_path, dir=is_dir, size=attr.st_size, mtime=attr.st_mtime)
+            self.reporter.text(f"{'d' if is_dir else '-'} {attr.st_size:>14} {entry_path}")
+        self.reporter.text(f"{count} entries, {size} bytes in files")
+        self.reporter.result("find", path, True, count=count, size=size)
+
+    def cmd_index(self, args: argparse.Namespace):
+        path = self.resolve(args.path)
+        if not self.remote.index:
+            print("[!] index needs --index FILE")
+            self.reporter.result("index", path, False, error="no index; pass --index FILE")
+            return
+
+        def unreadable(folder: str, error: Exception):
+            print(f"[!] Cannot index {folder}: {error}")
+            self.reporter.result("index", folder, False, error=str(error))
+
+        stats = self.remote.refresh_index(path, full=args.full, on_error=unreadable)
+        self.reporter.text(stats.summary())
+        self.reporter.result("index", path, True, **stats._asdict())
+
+    def cmd_search(self, args: argparse.Namespace):
+        if not self.remote.index:
+            print("[!] search needs --index FILE")
+            self.reporter.result("search", args.name or "", False, error="no index; pass --index FILE")
+            return
+        now = time.time()
+        matches = self.remote.index.search(
+            name=args.name, under=self.resolve(args.under) if args.under else None,
+            min_size=args.min_size, max_size=args.max_size,
+            newer_than=now - args.newer_than * 86400 if args.newer_than is not None else None,
+            older_than=now - args.older_than * 86400 if args.older_than is not None else None,
+            limit=args.limit,
+        )
+        for entry in matches:
+            self.reporter.emit("entry", path=entry.path, dir=entry.is_dir, size=entry.size, mtime=entry.mtime)
+            self.reporter.text(f"{'d' if entry.is_dir else '-'} {entry.size:>14} {entry.path}")
+        self.reporter.result("search", args.name or "", True, count=len(matches))
+
+    def cmd_sync(self, args: argparse.Namespace):
+        engine = SyncEngine(self.local_fs, self.remote, workers=args.workers, checksum=args.checksum,
+                            delete=args.delete, small_file_limit=args.small_file_limit, batch_files=args.batch_files,
+                            delta_threshold=args.delta_threshold)
+
+        def on_action(action, ok):
+            self.reporter.emit("action", kind=action.kind, path=action.path, size=action.size, ok=ok)
+
+        direction = PULL if args.pull else PUSH
+        report = engine.run(os.path.abspath(args.local), self.resolve(args.remote), direction,
+                            dry_run=args.dry_run, on_action=on_action)
+        if args.dry_run:
+            for action in report.actions:
+                self.reporter.emit("planned", kind=action.kind, path=action.path, size=action.size)
+                self.reporter.text(f"{action.kind:<8} {action.path}")
+        self.reporter.text(report.summary())
+        ok = not (report.errors or report.unreadable)
+        self.reporter.result("sync", args.remote, ok, summary=report.summary(), counts=report.counts(),
+                             errors=len(report.errors), unreadable=len(report.unreadable))
+
+    def cmd_fanout(self, args: argparse.Namespace):
+        source = os.path.expanduser(args.source)
+        if not os.path.isfile(source):
+            self.reporter.result("fanout", args.source, False, error="no such local file")
+            return
+        main = self.target
+        targets = [parse_target(text, main.username, main.port, main.password, main.key_filename) for text in args.to]
+        fanout = FanOutUpload(self.make_remote, host_timeout=args.host_timeout)
+        remotes, results = fanout.connect(targets)
+        remotes[main.name] = self.remote
+        remote_path = posixpath.join(args.dest, os.path.basename(source))
+        meters = {}
+
+        def progress(host: str, done: int, total: int):
+            meter = meters.get(host) or meters.setdefault(host, self.reporter.progress("fanout", f"{host}:{remote_path}"))
+            meter(done, total)
+
+        try:
+            results.update(fanout.upload_to(source, remote_path, remotes, progress=progress))
+        finally:
+            for name, remote in remotes.items():
+                if remote is not self.remote:
+                    remote.disconnect()
+        for name in [main.name] + [target.name for target in targets]:
+            self._record("fanout", f"{name}:{remote_path}", results[name])
+
+    def _remote_glob(self, pattern: str) -> List[str]:
+        folder, name = posixpath.split(pattern)
+        if not any(ch in name for ch in "*?["):
+            return [pattern]
+        try:
+            entries = self.remote.listdir_attr(folder)
+        except (IOError, OSError):
+            return []
+        return sorted(
+            posixpath.join(folder, attr.filename) for attr in entries
+            if fnmatch.fnmatchcase(attr.filename, name) and not (attr.st_mode or 0) & 0o040000
+        )
+
+    def _record(self, op: str, path: str, result):
+        compression = result.compression
+        progress = result.progress
+        self.reporter.result(op, path, bool(result), size=result.size, algorithm=result.algorithm,
+                             digest=result.digest, verified=result.verified, error=result.error,
+                             compressed=compression.compress if compression else None,
+                             sample_ratio=compression.ratio if compression else None,
+                             seconds=progress.elapsed if progress else None,
+                             average_rate=round(progress.average_rate) if progress else None,
+                             first_byte=progress.first_byte if progress else None)
+
+
+def read_batch(path: str) -> List[argparse.Namespace]:
+    """Parse every non-empty, non-comment line of a batch file as a subcommand."""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    parser = argparse.ArgumentParser(prog=path)
+    add_commands(parser.add_subparsers(dest="command", required=True))
+    parsed = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        args = parser.parse_args(shlex.split(line))
+        if args.command == "batch":
+            raise SystemExit(f"{path}:{number}: batch files cannot include other batch files")
+        parsed.append(args)
+    return parsed
+
+
+def write_metrics(path: str, text: str):
+    """Replace ``path`` atomically so a scraper never reads a half-written file."""
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[!] Cannot write metrics to {path}: {e}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+        jobs = read_batch(args.file) if args.command == "batch" else [args]
+    except OSError as e:
+        print(f"[!] Cannot read batch file: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            print(e.code, file=sys.stderr)
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+
+    out = sys.stdout
+    reporter = Reporter(out, args.json)
+    password = os.environ.get(args.password_env)
+    if args.ask_password:
+        password = getpass.getpass(f"{args.user}@{args.host}'s password: ")
+
+    overrides = {args.host: AlgorithmPreference(args.ciphers, args.macs)} if args.ciphers or args.macs else None
+
+    def trust(host: str, fingerprint: str) -> bool:
+        print(f"[?] {host} presented unknown key {fingerprint}; "
+              f"{'trusting' if args.trust_new_host else 'refusing'} it", file=sys.stderr)
+        return args.trust_new_host
+
+    def make_remote(_target: FanOutTarget) -> RemoteSFTP:
+        remote = RemoteSFTP(known_hosts_path=args.known_hosts, compression=args.compression,
+                            algorithms=args.algorithms, algorithm_overrides=overrides,
+                            keepalive_interval=args.keepalive, reconnect_attempts=args.reconnect_attempts,
+                            index_path=os.path.expanduser(args.index) if args.index else None)
+        remote.ask_trust_callback = trust
+        return remote
+
+    target = FanOutTarget(args.host, args.user, args.port, password, args.key_filename)
+    remote = make_remote(target)
+    # Library messages go to stderr so stdout stays machine-readable.
+    with contextlib.redirect_stdout(sys.stderr):
+        if not remote.connect(args.host, args.port, args.user, password, args.key_filename):
+            reporter.emit("error", error="connection failed")
+            return EXIT_CONNECT
+        try:
+            session = Session(remote, reporter, target, make_remote)
+            for job in jobs:
+                session.run(job)
+        finally:
+            remote.disconnect()
+            if args.metrics:
+                write_metrics(args.metrics, remote.metrics.to_prometheus())
+
+    reporter.emit("summary", ok=reporter.ok, failed=reporter.failed)
+    return EXIT_FAILED if reporter.failed else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import zlib
+from typing import Callable, NamedTuple, Optional
+
+COMPRESSION_OFF = "off"
+COMPRESSION_ON = "on"
+COMPRESSION_AUTO = "auto"
+COMPRESSION_MODES = (COMPRESSION_OFF, COMPRESSION_ON, COMPRESSION_AUTO)
+
+SAMPLE_SIZE = 256 * 1024
+# Send over the compressed transport when the sample shrinks to this fraction of its size or less.
+COMPRESSIBLE_RATIO = 0.75
+# Below this size a file goes in a few round trips either way; not worth a sample.
+MIN_COMPRESS_SIZE = 64 * 1024
+
+
+class CompressionDecision(NamedTuple):
+    """Whether one transfer goes over a compressed transport, and why.
+
+    ``ratio`` is the compressed size of the sample over its raw size, or
+    None when no sample was taken.
+    """
+
+    compress: bool
+    ratio: Optional[float] = None
+    sampled: int = 0
+
+    def describe(self) -> str:
+        verdict = "compressed" if self.compress else "uncompressed"
+        if self.ratio is None:
+            return verdict
+        return f"{verdict} (sample of {self.sampled} bytes compresses to {self.ratio:.1%})"
+
+
+def sample_ratio(data: bytes) -> float:
+    """Estimate how well data compresses with the zlib the SSH transport uses."""
+    if not data:
+        return 1.0
+    return len(zlib.compress(data, 6)) / len(data)
+
+
+def decide(mode: str, size: int, read_sample: Callable[[int], bytes]) -> CompressionDecision:
+    """Pick compression for a file of ``size`` bytes; ``read_sample(n)`` returns its first ``n`` bytes."""
+    if mode == COMPRESSION_ON:
+        return CompressionDecision(True)
+    if mode != COMPRESSION_AUTO or size < MIN_COMPRESS_SIZE:
+        return CompressionDecision(False)
+    data = read_sample(min(size, SAMPLE_SIZE))
+    ratio = sample_ratio(data)
+    return CompressionDecision(ratio <= COMPRESSIBLE_RATIO, ratio, len(data))
@@ -0,0 +1,365 @@
+import fnmatch
+import itertools
+import posixpath
+import queue
+import stat
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import paramiko
+from paramiko.message import Message
+from paramiko.sftp import CMD_CLOSE, CMD_HANDLE, CMD_NAME, CMD_OPENDIR, CMD_READDIR, CMD_STATUS, SFTPError
+
+from sftp_pool import DEFAULT_POOL_SIZE
+from transfer import TransferCancelled
+
+if TYPE_CHECKING:
+    from remote_sftp import RemoteSFTP
+
+# READDIR requests kept in flight while streaming a directory listing.
+DEFAULT_READ_AHEADS = 16
+DEFAULT_CRAWL_WORKERS = DEFAULT_POOL_SIZE
+# Directories each crawl channel has open at once, and READDIRs kept in flight for each.
+DEFAULT_DIRS_PER_CHANNEL = 16
+DEFAULT_CRAWL_READ_AHEADS = 2
+# Pages of records the workers may get ahead of the consumer before they wait.
+DEFAULT_CRAWL_BUFFER = 64
+
+Record = Tuple[str, paramiko.SFTPAttributes]
+ErrorCallback = Callable[[str, Exception], None]
+
+_DONE = object()
+
+
+class _DirPages:
+    """Collects READDIR responses that paramiko hands back out of order."""
+
+    def __init__(self):
+        self.responses: Dict[int, Tuple[int, Message]] = {}
+
+    def _async_response(self, t: int, msg: Message, num: int):
+        self.responses[num] = (t, msg)
+
+
+def iter_dir_pages(
+    sftp: paramiko.SFTPClient,
+    path: str,
+    read_aheads: int = DEFAULT_READ_AHEADS,
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[List[paramiko.SFTPAttributes]]:
+    """Yield a remote directory one server page at a time.
+
+    Keeps ``read_aheads`` READDIR requests in flight, so a listing costs
+    about one round trip per ``read_aheads`` pages. Stopping early, by
+    ``cancel`` or by closing the generator, drains the outstanding replies
+    and closes the handle, so the channel can go back to a pool.
+    """
+    t, msg = sftp._request(CMD_OPENDIR, path)
+    if t != CMD_HANDLE:
+        raise SFTPError("Expected handle")
+    handle = msg.get_binary()
+    pages = _DirPages()
+    pending = deque(sftp._async_request(pages, CMD_READDIR, handle) for _ in range(max(1, read_aheads)))
+    try:
+        while pending and not (cancel and cancel.is_set()):
+            num = pending.popleft()
+            while num not in pages.responses:
+                sftp._read_response()
+            t, msg = pages.responses.pop(num)
+            if t == CMD_STATUS:
+                try:
+                    sftp._convert_status(msg)
+                except EOFError:
+                    return
+            if t != CMD_NAME:
+                raise SFTPError("Expected name response")
+            page = []
+            for _ in range(msg.get_int()):
+                filename = msg.get_text()
+                longname = msg.get_text()
+                attr = paramiko.SFTPAttributes._from_msg(msg, filename, longname)
+                if filename not in (".", ".."):
+                    page.append(attr)
+            pending.append(sftp._async_request(pages, CMD_READDIR, handle))
+            yield page
+    finally:
+        for num in pending:
+            while num not in pages.responses:
+                sftp._read_response()
+        try:
+            sftp._request(CMD_CLOSE, handle)
+        except (IOError, paramiko.SSHException):
+            pass
+
+
+class TreeCrawler:
+    """Recursive remote listing with many directories in flight at once.
+
+    ``workers`` pooled channels each keep ``dirs_per_channel`` directories
+    open at once with ``read_aheads`` READDIR requests outstanding for
+    each, so a deep or wide tree costs about one round trip per wave of
+    directories rather than several per directory. Records stream out as ``(path, attrs)`` with
+    full remote paths, a directory always before anything inside it, in no
+    other particular order.
+
+    ``max_depth`` 1 lists only the root's entries; None has no limit.
+    ``include`` globs pick which records are yielded and ``exclude`` globs
+    drop records and prune whole subtrees; both are matched against the
+    path relative to the root and against the bare name. Symlinks are
+    yielded but never followed.
+
+    Workers wait once ``buffer`` pages are queued for the consumer. Every
+    subdirectory of a listed directory is pushed at once and the newest is
+    taken first, so the backlog holds the unlisted siblings along the
+    current branch: it grows with depth times fan-out, not with the size
+    of the whole tree, but one very wide directory puts all its children
+    on it. A directory that cannot be listed raises in the consumer, or
+    is passed to ``on_error`` if one is given and the crawl goes on.
+    """
+
+    def __init__(
+        self,
+        remote: "RemoteSFTP",
+        workers: int = DEFAULT_CRAWL_WORKERS,
+        buffer: int = DEFAULT_CRAWL_BUFFER,
+        max_depth: Optional[int] = None,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        on_error: Optional[ErrorCallback] = None,
+        dirs_per_channel: int = DEFAULT_DIRS_PER_CHANNEL,
+        read_aheads: int = DEFAULT_CRAWL_READ_AHEADS,
+    ):
+        self.remote = remote
+        self.dirs_per_channel = max(1, dirs_per_channel)
+        self.read_aheads = max(1, read_aheads)
+        self.workers = max(1, workers)
+        self.buffer = max(1, buffer)
+        self.max_depth = max_depth
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.on_error = on_error
+
+    def crawl(self, root: str) -> Iterator[Record]:
+        """Yield every record below ``root``. Closing the generator early stops the workers."""
+        run = _CrawlRun(self, root)
+        return run.records()
+
+    def matches(self, patterns: Sequence[str], rel: str) -> bool:
+        name = posixpath.basename(rel)
+        return any(fnmatch.fnmatchcase(rel, p) or fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+class _Listing:
+    """One directory being read on a shared channel."""
+
+    def __init__(self, path: str, rel: str, depth: int):
+        self.path = path
+        self.rel = rel
+        self.depth = depth
+        self.handle: Optional[bytes] = None
+        self.reads = 0
+        self.eof = False
+        self.error: Optional[Exception] = None
+        # Once anything from this directory has gone out, listing it again would repeat it.
+        self.emitted = False
+        self.started = time.monotonic()
+
+
+class _CrawlRun:
+    """State of one crawl: the directory backlog, the result queue and the worker threads.
+
+    Each worker holds one pooled channel and keeps up to ``dirs_per_channel``
+    directories open on it at once, with ``read_aheads`` READDIR requests
+    outstanding for each, reacting to replies in whatever order they come.
+    """
+
+    def __init__(self, crawler: TreeCrawler, root: str):
+        self.crawler = crawler
+        self.remote = crawler.remote
+        self.stop = threading.Event()
+        self.results: "queue.Queue" = queue.Queue(maxsize=crawler.buffer)
+        self.backlog: Deque[Tuple[str, str, int]] = deque([(root, "", 0)])
+        # Directories queued or being listed; the crawl is over when this reaches zero.
+        self.outstanding = 1
+        self.cond = threading.Condition()
+
+    def records(self) -> Iterator[Record]:
+        pool = self.remote.pool
+        count = min(self.crawler.workers, pool.size) if pool else 1
+        for i in range(count):
+            threading.Thread(target=self._work, name=f"sftp-crawl-{i}", daemon=True).start()
+        try:
+            while True:
+                item = self.results.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            self.stop.set()
+            with self.cond:
+                self.cond.notify_all()
+
+    def _work(self):
+        for attempt in itertools.count():
+            active: Dict[int, _Listing] = {}
+            generation = self.remote._generation
+            try:
+                with self.remote.pool.channel() as sftp:
+                    self._serve(sftp, active)
+                return
+            except Exception as e:
+                if self.stop.is_set():
+                    return
+                # The channel failed. Directories it had not reported anything from can be listed again.
+                fresh = [listing for listing in active.values() if not listing.emitted]
+                if not self.remote._recover(e, generation, attempt):
+                    self.remote.metrics.error("listdir", e)
+                    self._put(e)
+                    self.stop.set()
+                    return
+                with self.cond:
+                    self.backlog.extend((l.path, l.rel, l.depth) for l in fresh)
+                    self.cond.notify_all()
+                for listing in active.values():
+                    if listing.emitted:
+                        listing.error = e
+                        self._finish(listing)
+
+    def _serve(self, sftp: paramiko.SFTPClient, active: Dict[int, _Listing]):
+        crawler = self.crawler
+        replies = _DirPages()
+        requests: Dict[int, Tuple[int, _Listing]] = {}
+        while not self.stop.is_set():
+            while len(active) < crawler.dirs_per_channel:
+                item = self._take(block=not active)
+                if item is None:
+                    break
+                listing = _Listing(*item)
+                active[id(listing)] = listing
+                requests[sftp._async_request(replies, CMD_OPENDIR, listing.path)] = (CMD_OPENDIR, listing)
+            if not active:
+                break
+            while not replies.responses:
+                sftp._read_response()
+            for num in sorted(replies.responses):
+                t, msg = replies.responses.pop(num)
+                kind, listing = requests.pop(num)
+                if kind == CMD_OPENDIR:
+                    self._opened(sftp, replies, requests, listing, t, msg)
+                elif kind == CMD_READDIR:
+                    self._page(sftp, replies, requests, listing, t, msg)
+                if listing.eof and not listing.reads and id(listing) in active:
+                    del active[id(listing)]
+                    if listing.handle is not None:
+                        requests[sftp._async_request(replies, CMD_CLOSE, listing.handle)] = (CMD_CLOSE, listing)
+                    self._finish(listing)
+        if self.stop.is_set():
+            raise TransferCancelled("Crawl stopped")
+        # Only CLOSE replies are left; collect them so the channel goes back to the pool clean.
+        while requests:
+            sftp._read_response()
+            for num in list(replies.responses):
+                replies.responses.pop(num)
+                requests.pop(num, None)
+
+    def _opened(self, sftp, replies, requests, listing: _Listing, t: int, msg: Message):
+        if t != CMD_HANDLE:
+            listing.error = _status_error(sftp, t, msg, "Expected handle")
+            listing.eof = True
+            return
+        listing.handle = msg.get_binary()
+        for _ in range(self.crawler.read_aheads):
+            self._read_more(sftp, replies, requests, listing)
+
+    def _read_more(self, sftp, replies, requests, listing: _Listing):
+        requests[sftp._async_request(replies, CMD_READDIR, listing.handle)] = (CMD_READDIR, listing)
+        listing.reads += 1
+
+    def _page(self, sftp, replies, requests, listing: _Listing, t: int, msg: Message):
+        listing.reads -= 1
+        if listing.eof:
+            return
+        if t != CMD_NAME:
+            error = _status_error(sftp, t, msg, "Expected name response")
+            if not isinstance(error, EOFError):
+                listing.error = error
+            listing.eof = True
+            return
+        crawler = self.crawler
+        records: List[Record] = []
+        subdirs = []
+        for _ in range(msg.get_int()):
+            filename = msg.get_text()
+            longname = msg.get_text()
+            attr = paramiko.SFTPAttributes._from_msg(msg, filename, longname)
+            if filename in (".", ".."):
+                continue
+            child_rel = f"{listing.rel}/{filename}" if listing.rel else filename
+            if crawler.exclude and crawler.matches(crawler.exclude, child_rel):
+                continue
+            child = posixpath.join(listing.path, filename)
+            if not crawler.include or crawler.matches(crawler.include, child_rel):
+                records.append((child, attr))
+            if stat.S_ISDIR(attr.st_mode or 0) and (crawler.max_depth is None or listing.depth + 1 < crawler.max_depth):
+                subdirs.append((child, child_rel, listing.depth + 1))
+        if records:
+            self._put(records)
+            listing.emitted = True
+        if subdirs:
+            self._push(subdirs)
+            listing.emitted = True
+        self._read_more(sftp, replies, requests, listing)
+
+    def _take(self, block: bool) -> Optional[Tuple[str, str, int]]:
+        with self.cond:
+            while block and not self.backlog and self.outstanding and not self.stop.is_set():
+                self.cond.wait()
+            if self.backlog and not self.stop.is_set():
+                return self.backlog.pop()
+            return None
+
+    def _push(self, subdirs: List[Tuple[str, str, int]]):
+        with self.cond:
+            self.backlog.extend(subdirs)
+            self.outstanding += len(subdirs)
+            self.cond.notify_all()
+
+    def _finish(self, listing: _Listing):
+        if listing.error is None:
+            self.remote.metrics.observe("listdir", time.monotonic() - listing.started)
+        else:
+            self.remote.metrics.error("listdir", listing.error)
+            if self.crawler.on_error:
+                self.crawler.on_error(listing.path, listing.error)
+            else:
+                self._put(listing.error)
+        with self.cond:
+            self.outstanding -= 1
+            finished = self.outstanding == 0
+            self.cond.notify_all()
+        if finished:
+            self._put(_DONE)
+
+    def _put(self, item):
+        # Bounded waits so a consumer that went away is noticed.
+        while not self.stop.is_set():
+            try:
+                self.results.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def _status_error(sftp: paramiko.SFTPClient, t: int, msg: Message, unexpected: str) -> Exception:
+    """The error a STATUS reply stands for, or an SFTPError for any other unexpected reply."""
+    if t != CMD_STATUS:
+        return SFTPError(unexpected)
+    try:
+        sftp._convert_status(msg)
+    except Exception as e:
+        return e
+    return SFTPError(unexpected)
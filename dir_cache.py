@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Optional, Tuple, TypeVar
+
+DEFAULT_LISTING_TTL = 30.0
+DEFAULT_LISTING_ENTRIES = 256
+
+T = TypeVar("T")
+
+
+class DirectoryCache(Generic[T]):
+    """Per-path cache of directory listings with a TTL and LRU eviction.
+
+    Entries older than ``ttl`` seconds are treated as missing. Once more than
+    ``max_entries`` paths are cached, the least recently used one is dropped.
+    Callers invalidate a path themselves after changing that directory.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_LISTING_TTL, max_entries: int = DEFAULT_LISTING_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, T]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[T]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return value
+
+    def put(self, path: str, value: T):
+        with self._lock:
+            self._entries[path] = (time.monotonic(), value)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,339 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import paramiko
+from paramiko.sftp import CMD_STATUS, CMD_WRITE, SFTPError, int64
+
+from integrity import StreamHasher, TransferResult
+from metrics import CANCELLED, Metrics
+from remote_sftp import RemoteSFTP
+from transfer import DEFAULT_QUEUE_DEPTH, DEFAULT_REQUEST_SIZE, SourceChanged, TransferCancelled
+
+DEFAULT_FANOUT_CHUNK = 1024 * 1024
+# Chunks held in memory at once; the fastest host can run this far ahead of the slowest.
+DEFAULT_WINDOW_CHUNKS = 32
+# A host that acknowledges nothing, or holds every other host back, for this long is dropped.
+DEFAULT_HOST_TIMEOUT = 60.0
+DEFAULT_CONNECT_WORKERS = 16
+
+HostProgressCallback = Callable[[str, int, int], None]
+
+
+class FanOutTarget(NamedTuple):
+    """One destination of a fan-out upload."""
+
+    host: str
+    username: str
+    port: int = 22
+    password: Optional[str] = None
+    key_filename: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.host if self.port == 22 else f"{self.host}:{self.port}"
+
+
+class HostDropped(Exception):
+    """Raised in a host's writer when the fan-out gave up on that host."""
+
+
+class _SharedChunks:
+    """The local file read once, front to back, into a sliding window of chunks.
+
+    Every host has a cursor: the index of the next chunk it needs. The
+    reader stays at most ``window`` chunks ahead of the slowest cursor and
+    a chunk is freed once every cursor has passed it, so memory is bounded
+    by the window whatever the number of hosts. A host that holds the
+    reader back for ``host_timeout`` seconds is dropped so the rest go on.
+    """
+
+    def __init__(self, path: str, hosts: Sequence[str], chunk_size: int, window: int, host_timeout: float,
+                 hasher: StreamHasher, stop: threading.Event):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.window = max(1, window)
+        self.host_timeout = host_timeout
+        self.hasher = hasher
+        self.stop = stop
+        self.total = os.path.getsize(path)
+        self.count = -(-self.total // chunk_size)
+        self.error: Optional[BaseException] = None
+        self._chunks: Dict[int, bytes] = {}
+        self._cursors: Dict[str, int] = {host: 0 for host in hosts}
+        self._dropped: Dict[str, str] = {}
+        self._read = 0
+        self._freed = 0
+        self._cond = threading.Condition()
+
+    def read_all(self):
+        """Reader thread body: fill the window until the file is read or no host is left."""
+        try:
+            with open(self.path, "rb") as f:
+                for index in range(self.count):
+                    if not self._wait_for_room(index):
+                        return
+                    data = f.read(self.chunk_size)
+                    if len(data) < min(self.chunk_size, self.total - index * self.chunk_size):
+                        raise SourceChanged(f"{self.path} shrank during upload")
+                    self.hasher.update(index * self.chunk_size, data)
+                    with self._cond:
+                        self._chunks[index] = data
+                        self._read = index + 1
+                        self._cond.notify_all()
+        except BaseException as e:
+            with self._cond:
+                self.error = e
+                self._cond.notify_all()
+
+    def _wait_for_room(self, index: int) -> bool:
+        with self._cond:
+            waited_since = time.monotonic()
+            while not self.stop.is_set() and self._cursors:
+                slowest = min(self._cursors, key=self._cursors.get)
+                if index - self._cursors[slowest] < self.window:
+                    return True
+                if time.monotonic() - waited_since >= self.host_timeout:
+                    self._drop(slowest, f"fell {self.window} chunks behind the other hosts for "
+                                        f"{self.host_timeout:.0f}s")
+                    waited_since = time.monotonic()
+                    continue
+                self._cond.wait(min(1.0, self.host_timeout))
+            return False
+
+    def get(self, host: str, index: int) -> bytes:
+        """Wait for chunk ``index`` on behalf of ``host``."""
+        with self._cond:
+            while True:
+                if host in self._dropped:
+                    raise HostDropped(self._dropped[host])
+                if self.error is not None:
+                    raise self.error
+                if self.stop.is_set():
+                    raise TransferCancelled("Transfer cancelled")
+                if index < self._read:
+                    return self._chunks[index]
+                # Bounded so a cancel, which does not notify, is still seen.
+                self._cond.wait(1.0)
+
+    def advance(self, host: str, index: int):
+        """``host`` has sent every chunk below ``index``; free what no host needs any more."""
+        with self._cond:
+            if host not in self._cursors:
+                return
+            self._cursors[host] = index
+            self._release()
+
+    def drop(self, host: str, reason: str):
+        with self._cond:
+            self._drop(host, reason)
+
+    def dropped(self, host: str) -> Optional[str]:
+        with self._cond:
+            return self._dropped.get(host)
+
+    def _drop(self, host: str, reason: str):
+        if self._cursors.pop(host, None) is None:
+            return
+        self._dropped[host] = reason
+        self._release()
+
+    def _release(self):
+        low = min(self._cursors.values(), default=self.count)
+        for index in range(self._freed, low):
+            self._chunks.pop(index, None)
+        self._freed = max(self._freed, low)
+        self._cond.notify_all()
+
+
+class FanOutUpload:
+    """Upload one local file to many hosts, reading it from disk only once.
+
+    Hosts are connected concurrently. A reader thread then fills a shared
+    window of chunks which a writer per host sends on that host's own SFTP
+    channel, keeping ``queue_depth`` write requests in flight, so the whole
+    distribution takes about as long as the slowest link. Each host
+    succeeds or fails on its own: a failed connect, write or verification
+    only costs that host, and a host that stalls or holds the window back
+    for ``host_timeout`` seconds is dropped. Every upload is verified
+    against the digest taken while reading, as ``RemoteSFTP.upload_file``
+    does.
+
+    ``make_remote`` builds the ``RemoteSFTP`` for one target, which is
+    where known hosts, cipher choice and metrics are configured.
+    """
+
+    def __init__(
+        self,
+        make_remote: Callable[[FanOutTarget], RemoteSFTP] = lambda target: RemoteSFTP(),
+        chunk_size: int = DEFAULT_FANOUT_CHUNK,
+        window_chunks: int = DEFAULT_WINDOW_CHUNKS,
+        request_size: int = DEFAULT_REQUEST_SIZE,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        host_timeout: float = DEFAULT_HOST_TIMEOUT,
+        connect_workers: int = DEFAULT_CONNECT_WORKERS,
+    ):
+        self.make_remote = make_remote
+        self.chunk_size = max(1, chunk_size)
+        self.window_chunks = max(1, window_chunks)
+        self.request_size = max(1, min(request_size, self.chunk_size))
+        self.queue_depth = max(1, queue_depth)
+        self.host_timeout = host_timeout
+        self.connect_workers = max(1, connect_workers)
+
+    def connect(self, targets: Sequence[FanOutTarget]) -> Tuple[Dict[str, RemoteSFTP], Dict[str, TransferResult]]:
+        """Connect to every target at once. Returns the connected remotes and a failed result per other host."""
+        remotes: Dict[str, RemoteSFTP] = {}
+        failures: Dict[str, TransferResult] = {}
+
+        def connect_one(target: FanOutTarget):
+            remote = self.make_remote(target)
+            try:
+                ok = remote.connect(target.host, target.port, target.username, target.password,
+                                    target.key_filename)
+            except Exception as e:
+                print(f"[!] {target.name}: {e}")
+                ok = False
+            if ok:
+                remotes[target.name] = remote
+            else:
+                failures[target.name] = TransferResult(False, error="connection failed")
+
+        with ThreadPoolExecutor(max_workers=min(self.connect_workers, len(targets) or 1),
+                                thread_name_prefix="fanout-connect") as pool:
+            list(pool.map(connect_one, targets))
+        return remotes, failures
+
+    def upload(
+        self,
+        local_path: str,
+        remote_path: str,
+        targets: Sequence[FanOutTarget],
+        progress: Optional[HostProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Dict[str, TransferResult]:
+        """Connect to ``targets``, upload ``local_path`` to ``remote_path`` on each and disconnect.
+
+        Returns a ``TransferResult`` per target name.
+        """
+        remotes, results = self.connect(targets)
+        try:
+            results.update(self.upload_to(local_path, remote_path, remotes, progress, cancel))
+        finally:
+            for remote in remotes.values():
+                remote.disconnect()
+        return {target.name: results[target.name] for target in targets}
+
+    def upload_to(
+        self,
+        local_path: str,
+        remote_path: str,
+        remotes: Dict[str, RemoteSFTP],
+        progress: Optional[HostProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Dict[str, TransferResult]:
+        """Upload ``local_path`` to ``remote_path`` over already connected ``remotes``, keyed by host name.
+
+        ``progress`` is called as ``(host, done, total)``. A relative
+        ``remote_path`` is taken from each remote's current folder.
+        """
+        if not remotes:
+            return {}
+        stop = cancel or threading.Event()
+        hasher = StreamHasher(next(iter(remotes.values())).digest_algorithm)
+        shared = _SharedChunks(local_path, list(remotes), self.chunk_size, self.window_chunks,
+                               self.host_timeout, hasher, stop)
+        reader = threading.Thread(target=shared.read_all, name="fanout-reader", daemon=True)
+        reader.start()
+        with ThreadPoolExecutor(max_workers=len(remotes), thread_name_prefix="fanout-host") as pool:
+            futures = {
+                host: pool.submit(self._upload_host, host, remote, remote._remote_path(remote_path), shared,
+                                  progress)
+                for host, remote in remotes.items()
+            }
+            results = {host: future.result() for host, future in futures.items()}
+        reader.join()
+
+        sent = sum(1 for result in results.values() if result)
+        print(f"[+] Uploaded {os.path.basename(local_path)} to {sent} of {len(results)} hosts")
+        return results
+
+    def _upload_host(self, host: str, remote: RemoteSFTP, remote_path: str, shared: _SharedChunks,
+                     progress: Optional[HostProgressCallback]) -> TransferResult:
+        meter, report = remote._metered(
+            (lambda done, total: progress(host, done, total)) if progress else None
+        )
+        try:
+            report(0, shared.total)
+            with remote.pool.channel() as sftp:
+                self._send(host, sftp, remote, remote_path, shared, report)
+            result = remote._verify(remote_path, shared.total, shared.hasher.hexdigest(shared.total))
+            if result:
+                print(f"[+] {host}: uploaded {remote_path}")
+            else:
+                print(f"[!] {host}: upload verification failed: {result.error}")
+            return remote._finished("upload", result, meter)
+        except TransferCancelled:
+            print(f"[*] {host}: upload stopped")
+            return remote._finished("upload", TransferResult(False, error="cancelled"), meter, CANCELLED)
+        except Exception as e:
+            reason = shared.dropped(host)
+            if reason is None:
+                reason = "timed out" if isinstance(e, TimeoutError) else str(e) or type(e).__name__
+                shared.drop(host, reason)
+            print(f"[!] {host}: upload failed: {reason}")
+            return remote._finished("upload", TransferResult(False, error=reason), meter)
+
+    def _send(self, host: str, sftp: paramiko.SFTPClient, remote: RemoteSFTP, remote_path: str,
+              shared: _SharedChunks, report):
+        channel = sftp.get_channel()
+        # A reply that takes longer than this means the host has stalled; the pool discards the channel.
+        channel.settimeout(self.host_timeout)
+        pending: Deque[Tuple[int, int, float]] = deque()
+        done = 0
+        with remote.metrics.timed("open"):
+            dst = sftp.open(remote_path, "wb")
+        with dst:
+            for index in range(shared.count):
+                data = shared.get(host, index)
+                base = index * shared.chunk_size
+                for start in range(0, len(data), self.request_size):
+                    piece = data[start:start + self.request_size]
+                    num = sftp._async_request(type(None), CMD_WRITE, dst.handle, int64(base + start), piece)
+                    pending.append((num, len(piece), time.monotonic()))
+                    if len(pending) >= self.queue_depth:
+                        done += self._finish_write(sftp, pending.popleft(), remote.metrics)
+                        report(done, shared.total)
+                shared.advance(host, index + 1)
+            while pending:
+                done += self._finish_write(sftp, pending.popleft(), remote.metrics)
+                report(done, shared.total)
+        channel.settimeout(None)
+
+    @staticmethod
+    def _finish_write(sftp: paramiko.SFTPClient, request: Tuple[int, int, float], metrics: Metrics) -> int:
+        num, size, sent_at = request
+        t, _ = sftp._read_response(num)
+        metrics.observe("write", time.monotonic() - sent_at)
+        if t != CMD_STATUS:
+            raise SFTPError("Expected status")
+        return size
+
+
+def parse_target(text: str, username: str, port: int = 22, password: Optional[str] = None,
+                 key_filename: Optional[str] = None) -> FanOutTarget:
+    """Parse ``[user@]host[:port]``, filling in the defaults given."""
+    if "@" in text:
+        username, text = text.rsplit("@", 1)
+    host = text
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        if rest.startswith(":"):
+            port = int(rest[1:])
+    elif text.count(":") == 1:
+        host, port_text = text.split(":")
+        port = int(port_text)
+    return FanOutTarget(host, username, port, password, key_filename)
@@ -0,0 +1,239 @@
+import time
+import tkinter as tk
+import tkinter.font as tkfont
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import customtkinter as ctk
+
+from file_model import FileEntry, FileListModel, SORT_MTIME, SORT_NAME, SORT_SIZE
+from utils import human_size
+
+SIZE_COLUMN = 80
+MTIME_COLUMN = 130
+# Rows moved per mouse wheel notch.
+WHEEL_ROWS = 3
+
+EntryCallback = Callable[[FileEntry], None]
+
+
+class VirtualFileList(ctk.CTkFrame):
+    """List view that only draws the rows currently on screen.
+
+    Entries live in a ``FileListModel``; the canvas holds one set of text
+    items per visible row and rebinds them to model entries as the view
+    scrolls, so a 100k-entry directory draws as fast as a 30-entry one.
+    With ``details`` the list shows size and modification time columns and
+    clicking a heading sorts by it. ``on_select`` receives the clicked
+    entry and ``on_activate`` the double-clicked one.
+    """
+
+    def __init__(
+        self,
+        master,
+        details: bool = True,
+        on_select: Optional[EntryCallback] = None,
+        on_activate: Optional[EntryCallback] = None,
+        font: Tuple[str, int] = ("Consolas", 11),
+        **kwargs,
+    ):
+        super().__init__(master, **kwargs)
+        self.model = FileListModel()
+        self.details = details
+        self.on_select = on_select
+        self.on_activate = on_activate
+        self.placeholder = ""
+        self._selected_name: Optional[str] = None
+        self._source: Optional[str] = None
+        self._top = 0
+        self._font = tkfont.Font(family=font[0], size=font[1])
+        self._char_width = max(1, self._font.measure("0"))
+        self.row_height = self._font.metrics("linespace") + 4
+        self._rows: List[Tuple[int, int, int, int]] = []
+
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self._headings = {}
+        if details:
+            header = ctk.CTkFrame(self, fg_color="transparent")
+            header.grid(row=0, column=0, sticky="ew")
+            header.grid_columnconfigure(0, weight=1)
+            for col, (column, width) in enumerate(((SORT_NAME, 0), (SORT_SIZE, SIZE_COLUMN), (SORT_MTIME, MTIME_COLUMN))):
+                button = ctk.CTkButton(
+                    header, text="", width=width or 100, height=22, anchor="w", fg_color="transparent",
+                    text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"],
+                    command=lambda c=column: self.sort_by(c),
+                )
+                button.grid(row=0, column=col, sticky="ew")
+                self._headings[column] = button
+            self._update_headings()
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, borderwidth=0)
+        self.canvas.grid(row=1, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+        self._apply_colors()
+
+        self.canvas.bind("<Configure>", lambda e: self._layout())
+        self.canvas.bind("<ButtonRelease-1>", self._on_click)
+        self.canvas.bind("<Double-Button-1>", self._on_double_click)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.scroll(-WHEEL_ROWS))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll(WHEEL_ROWS))
+
+    @property
+    def selected(self) -> Optional[FileEntry]:
+        if self._selected_name is None:
+            return None
+        index = self.model.index_of(self._selected_name)
+        return None if index is None else self.model[index]
+
+    def set_entries(self, entries: Iterable[FileEntry], source: Optional[str] = None, placeholder: str = ""):
+        """Replace the contents. Scroll position and selection survive when ``source`` is unchanged."""
+        self.model.set_entries(entries)
+        self.placeholder = placeholder
+        if source is None or source != self._source:
+            self._top = 0
+            self._selected_name = None
+        elif self._selected_name is not None and self.model.index_of(self._selected_name) is None:
+            self._selected_name = None
+        self._source = source
+        self._redraw()
+
+    def extend(self, entries: Iterable[FileEntry]):
+        """Add entries to the current contents, e.g. as a listing streams in."""
+        self.model.extend(entries)
+        self._redraw()
+
+    def sort_by(self, column: str):
+        self.model.sort_by(column)
+        self._update_headings()
+        index = self.model.index_of(self._selected_name) if self._selected_name is not None else None
+        if index is not None:
+            self.see(index)
+        self._redraw()
+
+    def yview(self, *args):
+        """Scrollbar protocol: ``("moveto", fraction)`` or ``("scroll", n, "units"|"pages")``."""
+        if not args:
+            return
+        if args[0] == "moveto":
+            self._top = int(float(args[1]) * len(self.model))
+        elif args[0] == "scroll":
+            rows = int(args[1])
+            if len(args) > 2 and args[2] == "pages":
+                rows *= max(1, self._visible_rows() - 1)
+            self._top += rows
+        self._redraw()
+
+    def scroll(self, rows: int):
+        self._top += rows
+        self._redraw()
+
+    def see(self, index: int):
+        visible = self._visible_rows()
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + visible:
+            self._top = index - visible + 1
+
+    def _visible_rows(self) -> int:
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def _layout(self):
+        """Grow or shrink the pool of row items to fill the canvas height."""
+        wanted = self.canvas.winfo_height() // self.row_height + 1
+        while len(self._rows) < wanted:
+            y = len(self._rows) * self.row_height
+            self._rows.append((
+                self.canvas.create_rectangle(0, y, 0, y + self.row_height, width=0),
+                self.canvas.create_text(6, y + 2, anchor="nw", font=self._font, fill=self._text_color),
+                self.canvas.create_text(0, y + 2, anchor="ne", font=self._font, fill=self._text_color),
+                self.canvas.create_text(0, y + 2, anchor="nw", font=self._font, fill=self._text_color),
+            ))
+        while len(self._rows) > wanted:
+            self.canvas.delete(*self._rows.pop())
+        self._redraw()
+
+    def _redraw(self):
+        total = len(self.model)
+        visible = self._visible_rows()
+        self._top = max(0, min(self._top, total - visible))
+        width = self.canvas.winfo_width()
+        size_x = width - MTIME_COLUMN - 10
+        name_chars = max(4, (size_x - SIZE_COLUMN - 12 if self.details else width - 12) // self._char_width)
+
+        for i, (background, name_item, size_item, mtime_item) in enumerate(self._rows):
+            index = self._top + i
+            y = i * self.row_height
+            name = size = mtime = ""
+            fill = ""
+            if index < total:
+                entry = self.model[index]
+                name = f"[DIR]  {entry.name}" if entry.is_dir else entry.name
+                if len(name) > name_chars:
+                    name = name[:name_chars - 1] + "…"
+                if self.details and not entry.is_dir:
+                    size = human_size(entry.size)
+                if self.details and entry.mtime:
+                    mtime = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.mtime))
+                if entry.name == self._selected_name:
+                    fill = self._selection_color
+            elif i == 0 and total == 0:
+                name = self.placeholder
+            self.canvas.coords(background, 0, y, width, y + self.row_height)
+            self.canvas.itemconfigure(background, fill=fill)
+            self.canvas.itemconfigure(name_item, text=name)
+            self.canvas.coords(size_item, size_x, y + 2)
+            self.canvas.itemconfigure(size_item, text=size)
+            self.canvas.coords(mtime_item, width - MTIME_COLUMN, y + 2)
+            self.canvas.itemconfigure(mtime_item, text=mtime)
+
+        if total:
+            self.scrollbar.set(self._top / total, min(1.0, (self._top + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _row_at(self, y: int) -> Optional[FileEntry]:
+        index = self._top + y // self.row_height
+        return self.model[index] if 0 <= index < len(self.model) else None
+
+    def _on_click(self, event):
+        entry = self._row_at(event.y)
+        if entry is None:
+            return
+        self._selected_name = entry.name
+        self._redraw()
+        if self.on_select:
+            self.on_select(entry)
+
+    def _on_double_click(self, event):
+        entry = self._row_at(event.y)
+        if entry is not None and self.on_activate:
+            self.on_activate(entry)
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS small deltas.
+        notches = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        self.scroll(-notches * WHEEL_ROWS)
+
+    def _update_headings(self):
+        titles = {SORT_NAME: "Name", SORT_SIZE: "Size", SORT_MTIME: "Modified"}
+        for column, button in self._headings.items():
+            arrow = (" ▼" if self.model.descending else " ▲") if column == self.model.sort_column else ""
+            button.configure(text=titles[column] + arrow)
+
+    def _apply_colors(self):
+        theme = ctk.ThemeManager.theme
+        text_color = self._apply_appearance_mode(theme["CTkTextbox"]["text_color"])
+        self.canvas.configure(bg=self._apply_appearance_mode(theme["CTkTextbox"]["fg_color"]))
+        self._selection_color = self._apply_appearance_mode(theme["CTkButton"]["fg_color"])
+        self._text_color = text_color
+        for row in self._rows:
+            for item in row[1:]:
+                self.canvas.itemconfigure(item, fill=text_color)
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        self._apply_colors()
+        self._redraw()
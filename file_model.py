@@ -0,0 +1,80 @@
+from typing import Iterable, List, NamedTuple, Optional
+
+SORT_NAME = "name"
+SORT_SIZE = "size"
+SORT_MTIME = "mtime"
+
+
+class FileEntry(NamedTuple):
+    name: str
+    size: int
+    mtime: float
+    is_dir: bool
+
+
+def _sort_key(column: str):
+    if column == SORT_SIZE:
+        return lambda e: (e.size, e.name.lower())
+    if column == SORT_MTIME:
+        return lambda e: (e.mtime, e.name.lower())
+    return lambda e: e.name.lower()
+
+
+class FileListModel:
+    """Sorted, indexable list of directory entries behind a list view.
+
+    Views only ever ask for ``len(model)`` and ``model[i]`` for the rows
+    they show, so a directory of any size costs one sort and no widgets.
+    ".." always stays on top whatever the sort order.
+    """
+
+    def __init__(self, sort_by: str = SORT_NAME, descending: bool = False):
+        self.sort_column = sort_by
+        self.descending = descending
+        self._entries: List[FileEntry] = []
+        self._parent: Optional[FileEntry] = None
+
+    def __len__(self) -> int:
+        return len(self._entries) + (1 if self._parent else 0)
+
+    def __getitem__(self, index: int) -> FileEntry:
+        if self._parent:
+            if index == 0:
+                return self._parent
+            index -= 1
+        return self._entries[index]
+
+    def set_entries(self, entries: Iterable[FileEntry]):
+        self._entries = []
+        self._parent = None
+        self.extend(entries)
+
+    def extend(self, entries: Iterable[FileEntry]):
+        """Add entries and keep the list sorted; used for listings that arrive in batches."""
+        for entry in entries:
+            if entry.name == "..":
+                self._parent = entry
+            else:
+                self._entries.append(entry)
+        self._sort()
+
+    def clear(self):
+        self.set_entries([])
+
+    def sort_by(self, column: str, descending: Optional[bool] = None):
+        """Sort on ``column``; picking the current column again flips the direction."""
+        if descending is None:
+            descending = not self.descending if column == self.sort_column else False
+        self.sort_column = column
+        self.descending = descending
+        self._sort()
+
+    def index_of(self, name: str) -> Optional[int]:
+        for index in range(len(self)):
+            if self[index].name == name:
+                return index
+        return None
+
+    def _sort(self):
+        # Timsort makes re-sorting after an appended batch close to linear.
+        self._entries.sort(key=_sort_key(self.sort_column), reverse=self.descending)
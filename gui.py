@@ -1,5 +1,13 @@
+import threading
 import customtkinter as ctk
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+
+from file_list import VirtualFileList
+from file_model import FileEntry
+from utils import human_size
+
+SPINNER_FRAMES = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+SPINNER_INTERVAL_MS = 100
 
 class SFTPInterface:
     def __init__(self, root: ctk.CTk):
@@ -8,8 +16,19 @@ class SFTPInterface:
         self.on_disconnect_callback: Optional[Callable] = None
         self.on_upload_callback: Optional[Callable] = None
         self.on_download_callback: Optional[Callable] = None
+        # Per-transfer controls; each gets the job id of its row.
+        self.on_transfer_pause_callback: Optional[Callable[[int], None]] = None
+        self.on_transfer_cancel_callback: Optional[Callable[[int], None]] = None
+        self.on_transfer_run_next_callback: Optional[Callable[[int], None]] = None
         self.selected_local_file: Optional[str] = None
         self.selected_remote_file: Optional[str] = None
+        self._spinner_job: Optional[str] = None
+        self._spinner_frame = 0
+        self._transfer_rows: Dict[
+            int, Tuple[ctk.CTkFrame, ctk.CTkLabel, ctk.CTkProgressBar, ctk.CTkButton, ctk.CTkButton]
+        ] = {}
+        self._ui_thread = threading.current_thread()
+        self._prompt_lock = threading.Lock()
         self._build_ui()
 
     def _build_ui(self):
@@ -67,9 +86,8 @@ class SFTPInterface:
 
         self.local_folder_label = ctk.CTkLabel(local_tree_section, text="Local Folders", font=("Segoe UI", 13, "bold"), anchor="w")
         self.local_folder_label.grid(row=0, column=0, sticky="ew", padx=4, pady=(4, 2))
-        self.local_tree = ctk.CTkTextbox(local_tree_section, font=("Consolas", 11), wrap="none")
+        self.local_tree = VirtualFileList(local_tree_section, details=False, on_select=self._on_local_tree_click)
         self.local_tree.grid(row=1, column=0, sticky="nsew", padx=2, pady=(0, 4))
-        self.local_tree.bind("<ButtonRelease-1>", self._on_local_tree_click)
 
         local_files_section = ctk.CTkFrame(local_frame)
         local_files_section.grid(row=1, column=0, sticky="nsew", padx=8, pady=(4, 8))
@@ -77,10 +95,10 @@ class SFTPInterface:
         local_files_section.grid_columnconfigure(0, weight=1)
 
         ctk.CTkLabel(local_files_section, text="Local Files", font=("Segoe UI", 13, "bold"), anchor="w").grid(row=0, column=0, sticky="ew", padx=4, pady=(4, 2))
-        self.local_files = ctk.CTkTextbox(local_files_section, font=("Consolas", 11), wrap="none")
+        self.local_files = VirtualFileList(
+            local_files_section, on_select=self._on_local_file_click, on_activate=self._on_local_file_double_click
+        )
         self.local_files.grid(row=1, column=0, sticky="nsew", padx=2, pady=(0, 4))
-        self.local_files.bind("<Double-Button-1>", self._on_local_file_double_click)
-        self.local_files.bind("<ButtonRelease-1>", self._on_local_file_click)
 
         # Action buttons
         btn_frame = ctk.CTkFrame(main_frame, width=120)
@@ -93,6 +111,9 @@ class SFTPInterface:
         self.upload_btn = ctk.CTkButton(btn_frame, text="Upload", width=100, height=40, state="disabled", command=self._on_upload)
         self.upload_btn.pack(pady=10)
 
+        self.queue_label = ctk.CTkLabel(btn_frame, text="Idle", font=("Segoe UI", 11))
+        self.queue_label.pack(pady=10)
+
         # Remote side
         remote_frame = ctk.CTkFrame(main_frame)
         remote_frame.grid(row=0, column=2, sticky="nsew", padx=(6, 0))
@@ -107,9 +128,10 @@ class SFTPInterface:
 
         self.remote_folder_label = ctk.CTkLabel(remote_tree_section, text="Remote Folders", font=("Segoe UI", 13, "bold"), anchor="w")
         self.remote_folder_label.grid(row=0, column=0, sticky="ew", padx=4, pady=(4, 2))
-        self.remote_tree = ctk.CTkTextbox(remote_tree_section, font=("Consolas", 11), wrap="none")
-        self.remote_tree.grid(row=1, column=0, sticky="nsew", padx=2, pady=(0, 4))
-        self.remote_tree.bind("<ButtonRelease-1>", self._on_remote_tree_click)
+        self.remote_spinner = ctk.CTkLabel(remote_tree_section, text="", font=("Segoe UI", 11), anchor="e")
+        self.remote_spinner.grid(row=0, column=1, sticky="e", padx=4, pady=(4, 2))
+        self.remote_tree = VirtualFileList(remote_tree_section, details=False, on_select=self._on_remote_tree_click)
+        self.remote_tree.grid(row=1, column=0, columnspan=2, sticky="nsew", padx=2, pady=(0, 4))
 
         remote_files_section = ctk.CTkFrame(remote_frame)
         remote_files_section.grid(row=1, column=0, sticky="nsew", padx=8, pady=(4, 8))
@@ -117,13 +139,17 @@ class SFTPInterface:
         remote_files_section.grid_columnconfigure(0, weight=1)
 
         ctk.CTkLabel(remote_files_section, text="Remote Files", font=("Segoe UI", 13, "bold"), anchor="w").grid(row=0, column=0, sticky="ew", padx=4, pady=(4, 2))
-        self.remote_files = ctk.CTkTextbox(remote_files_section, font=("Consolas", 11), wrap="none")
+        self.remote_files = VirtualFileList(
+            remote_files_section, on_select=self._on_remote_file_click, on_activate=self._on_remote_file_double_click
+        )
         self.remote_files.grid(row=1, column=0, sticky="nsew", padx=2, pady=(0, 4))
-        self.remote_files.bind("<Double-Button-1>", self._on_remote_file_double_click)
-        self.remote_files.bind("<ButtonRelease-1>", self._on_remote_file_click)
+
+        # Queued, running and paused transfers; packed above the log only while there are any.
+        self.transfers_frame = ctk.CTkFrame(self.root)
 
         # Log
-        ctk.CTkLabel(self.root, text="Log", font=("Segoe UI", 12, "bold"), anchor="w").pack(fill="x", padx=15, pady=(0, 2))
+        self.log_heading = ctk.CTkLabel(self.root, text="Log", font=("Segoe UI", 12, "bold"), anchor="w")
+        self.log_heading.pack(fill="x", padx=15, pady=(0, 2))
         self.log_text = ctk.CTkTextbox(self.root, height=100, font=("Consolas", 10), state="disabled")
         self.log_text.pack(fill="x", padx=15, pady=(0, 12))
 
@@ -139,31 +165,86 @@ class SFTPInterface:
         from utils import log_to_widget
         log_to_widget(self.log_text, msg)
 
-    def update_local_tree(self, text: str):
-        self.local_tree.configure(state="normal")
-        self.local_tree.delete("0.0", "end")
-        self.local_tree.insert("0.0", text)
-        self.local_tree.configure(state="disabled")
-
-    def update_local_files(self, files: list):
-        self.local_files.configure(state="normal")
-        self.local_files.delete("0.0", "end")
-        for name, size in files:
-            self.local_files.insert("end", f"[FILE] {name:<30} {self._human_size(size)}\n")
-        self.local_files.configure(state="disabled")
-
-    def update_remote_tree(self, text: str):
-        self.remote_tree.configure(state="normal")
-        self.remote_tree.delete("0.0", "end")
-        self.remote_tree.insert("0.0", text)
-        self.remote_tree.configure(state="disabled")
-
-    def update_remote_files(self, files: list):
-        self.remote_files.configure(state="normal")
-        self.remote_files.delete("0.0", "end")
-        for name, size in files:
-            self.remote_files.insert("end", f"[FILE] {name:<30} {self._human_size(size)}\n")
-        self.remote_files.configure(state="disabled")
+    def update_local_tree(self, folders: List[FileEntry], path: str = ""):
+        self.local_tree.set_entries(folders, source=path)
+
+    def update_local_files(self, files: List[FileEntry], path: str = ""):
+        self.local_files.set_entries(files, source=path)
+
+    def update_remote_tree(self, folders: List[FileEntry], path: str = "", placeholder: str = ""):
+        self.remote_tree.set_entries(folders, source=path, placeholder=placeholder)
+
+    def update_remote_files(self, files: List[FileEntry], path: str = ""):
+        self.remote_files.set_entries(files, source=path)
+
+    def extend_remote(self, folders: List[FileEntry], files: List[FileEntry]):
+        """Append a batch of a listing that is still arriving."""
+        if folders:
+            self.remote_tree.extend(folders)
+        if files:
+            self.remote_files.extend(files)
+
+    def set_remote_loading(self, loading: bool):
+        """Show or hide the spinner and running entry count next to the remote folder label."""
+        if self._spinner_job:
+            self.root.after_cancel(self._spinner_job)
+            self._spinner_job = None
+        if loading:
+            self._spin()
+        else:
+            self.remote_spinner.configure(text="")
+
+    def _spin(self):
+        count = len(self.remote_tree.model) + len(self.remote_files.model)
+        frame = SPINNER_FRAMES[self._spinner_frame % len(SPINNER_FRAMES)]
+        self._spinner_frame += 1
+        self.remote_spinner.configure(text=f"{frame} {count:,} entries")
+        self._spinner_job = self.root.after(SPINNER_INTERVAL_MS, self._spin)
+
+    def update_queue_status(self, running: int, queued: int):
+        text = f"{running} running\n{queued} queued" if running or queued else "Idle"
+        self.queue_label.configure(text=text)
+
+    def show_transfer(
+        self, job_id: int, title: str, fraction: float, detail: str, paused: bool = False, queued: bool = False
+    ):
+        """Create or update the row of a transfer, with its progress bar and controls.
+
+        The first button pauses or, for a ``paused`` transfer, resumes it; "Run next"
+        is offered while it is ``queued``.
+        """
+        row = self._transfer_rows.get(job_id)
+        if row is None:
+            if not self._transfer_rows:
+                self.transfers_frame.pack(fill="x", padx=15, pady=(0, 8), before=self.log_heading)
+            frame = ctk.CTkFrame(self.transfers_frame, fg_color="transparent")
+            frame.pack(fill="x", padx=8, pady=2)
+            frame.grid_columnconfigure(1, weight=1)
+            label = ctk.CTkLabel(frame, text="", font=("Segoe UI", 11), anchor="w", width=420)
+            label.grid(row=0, column=0, sticky="w", padx=(0, 8))
+            bar = ctk.CTkProgressBar(frame)
+            bar.grid(row=0, column=1, sticky="ew")
+            pause_btn = ctk.CTkButton(frame, text="Pause", width=70, command=lambda: self._on_transfer_pause(job_id))
+            pause_btn.grid(row=0, column=2, padx=(8, 0))
+            next_btn = ctk.CTkButton(frame, text="Run next", width=80,
+                                     command=lambda: self._on_transfer_run_next(job_id))
+            next_btn.grid(row=0, column=3, padx=(4, 0))
+            ctk.CTkButton(frame, text="Cancel", width=70, command=lambda: self._on_transfer_cancel(job_id)).grid(
+                row=0, column=4, padx=(4, 0))
+            row = self._transfer_rows[job_id] = (frame, label, bar, pause_btn, next_btn)
+        _, label, bar, pause_btn, next_btn = row
+        label.configure(text=f"{title}  {detail}")
+        bar.set(max(0.0, min(1.0, fraction)))
+        pause_btn.configure(text="Resume" if paused else "Pause")
+        next_btn.configure(state="normal" if queued else "disabled")
+
+    def remove_transfer(self, job_id: int):
+        row = self._transfer_rows.pop(job_id, None)
+        if row is None:
+            return
+        row[0].destroy()
+        if not self._transfer_rows:
+            self.transfers_frame.pack_forget()
 
     def set_connected(self, connected: bool):
         state = "normal" if connected else "disabled"
@@ -188,83 +269,41 @@ class SFTPInterface:
         if self.on_download_callback:
             self.on_download_callback()
 
-    def _on_local_tree_click(self, event):
-        try:
-            index = self.local_tree.index(f"@{event.x},{event.y}")
-            line_num = int(index.split(".")[0])
-            line = self.local_tree.get(f"{line_num}.0", f"{line_num}.end").strip()
-            if not line or not line.startswith("[DIR]"):
-                return
-            name = line[5:].strip()
-            if name and hasattr(self, '_on_local_folder_select'):
-                self._on_local_folder_select(name)
-        except Exception as e:
-            self.log(f"Local folder click error: {e}")
-
-    def _on_remote_tree_click(self, event):
-        try:
-            index = self.remote_tree.index(f"@{event.x},{event.y}")
-            line_num = int(index.split(".")[0])
-            line = self.remote_tree.get(f"{line_num}.0", f"{line_num}.end").strip()
-            if not line or not line.startswith("[DIR]"):
-                return
-            name = line[5:].strip()
-            if name and hasattr(self, '_on_remote_folder_select'):
-                self._on_remote_folder_select(name)
-        except Exception as e:
-            self.log(f"Remote folder click error: {e}")
-
-    def _on_local_file_click(self, event):
-        try:
-            index = self.local_files.index(f"@{event.x},{event.y}")
-            line_num = int(index.split(".")[0])
-            line = self.local_files.get(f"{line_num}.0", f"{line_num}.end").strip()
-            if not line or not line.startswith("[FILE]"):
-                self.selected_local_file = None
-                return
-            # Extract filename from "[FILE] filename size" format
-            parts = line.strip().split()
-            if len(parts) >= 2:
-                self.selected_local_file = parts[1]
-                self.log(f"Selected local file: {self.selected_local_file}")
-        except Exception as e:
-            self.log(f"Local file click error: {e}")
-
-    def _on_remote_file_click(self, event):
-        try:
-            index = self.remote_files.index(f"@{event.x},{event.y}")
-            line_num = int(index.split(".")[0])
-            line = self.remote_files.get(f"{line_num}.0", f"{line_num}.end").strip()
-            if not line or not line.startswith("[FILE]"):
-                self.selected_remote_file = None
-                return
-            # Extract filename from "[FILE] filename size" format
-            parts = line.strip().split()
-            if len(parts) >= 2:
-                self.selected_remote_file = parts[1]
-                self.log(f"Selected remote file: {self.selected_remote_file}")
-        except Exception as e:
-            self.log(f"Remote file click error: {e}")
-
-    def _on_local_file_double_click(self, event):
-        filename = self.get_selected_local_file()
-        if filename and hasattr(self, '_on_local_file_select'):
-            self._on_local_file_select(filename)
-
-    def _on_remote_file_double_click(self, event):
-        filename = self.get_selected_remote_file()
-        if filename and hasattr(self, '_on_remote_file_select'):
-            self._on_remote_file_select(filename)
-
-    def _human_size(self, size_bytes: int) -> str:
-        if size_bytes == 0:
-            return "0 B"
-        units = ["B", "KB", "MB", "GB"]
-        i = 0
-        while size_bytes >= 1024 and i < len(units) - 1:
-            size_bytes /= 1024.0
-            i += 1
-        return f"{size_bytes:.1f} {units[i]}"
+    def _on_transfer_pause(self, job_id: int):
+        if self.on_transfer_pause_callback:
+            self.on_transfer_pause_callback(job_id)
+
+    def _on_transfer_cancel(self, job_id: int):
+        if self.on_transfer_cancel_callback:
+            self.on_transfer_cancel_callback(job_id)
+
+    def _on_transfer_run_next(self, job_id: int):
+        if self.on_transfer_run_next_callback:
+            self.on_transfer_run_next_callback(job_id)
+
+    def _on_local_tree_click(self, entry: FileEntry):
+        if hasattr(self, '_on_local_folder_select'):
+            self._on_local_folder_select(entry.name)
+
+    def _on_remote_tree_click(self, entry: FileEntry):
+        if hasattr(self, '_on_remote_folder_select'):
+            self._on_remote_folder_select(entry.name)
+
+    def _on_local_file_click(self, entry: FileEntry):
+        self.selected_local_file = entry.name
+        self.log(f"Selected local file: {self.selected_local_file}")
+
+    def _on_remote_file_click(self, entry: FileEntry):
+        self.selected_remote_file = entry.name
+        self.log(f"Selected remote file: {self.selected_remote_file}")
+
+    def _on_local_file_double_click(self, entry: FileEntry):
+        if hasattr(self, '_on_local_file_select'):
+            self._on_local_file_select(entry.name)
+
+    def _on_remote_file_double_click(self, entry: FileEntry):
+        if hasattr(self, '_on_remote_file_select'):
+            self._on_remote_file_select(entry.name)
 
     def get_selected_local_file(self) -> str:
         """Get the currently selected local file"""
@@ -274,8 +313,37 @@ class SFTPInterface:
         """Get the currently selected remote file"""
         return self.selected_remote_file
 
+    def _ask(self, prompt: Callable[[], bool]) -> bool:
+        """Run a modal prompt on the Tk thread and return its answer.
+
+        Tk must only be touched from its own thread, so a call from a worker
+        is handed over with ``after`` and waited for. Workers take turns, so
+        at most one of their dialogs is open at a time.
+        """
+        if threading.current_thread() is self._ui_thread:
+            return prompt()
+        with self._prompt_lock:
+            answered = threading.Event()
+            result = [False]
+
+            def run():
+                try:
+                    result[0] = prompt()
+                finally:
+                    answered.set()
+
+            self.root.after(0, run)
+            answered.wait()
+            return result[0]
+
     def ask_trust_host(self, host: str, fingerprint: str) -> bool:
-        """Show a modal dialog asking user to trust an unknown host. Returns True if user clicks Yes."""
+        """Show a modal dialog asking user to trust an unknown host. Returns True if user clicks Yes.
+
+        Safe to call from any thread.
+        """
+        return self._ask(lambda: self._ask_trust_host(host, fingerprint))
+
+    def _ask_trust_host(self, host: str, fingerprint: str) -> bool:
         result = {"trust": False}  # mutable container to get result
 
         def on_yes():
@@ -306,3 +374,43 @@ class SFTPInterface:
 
         dialog.wait_window()
         return result["trust"]
+
+    def ask_resume(self, filename: str, offset: int, total: int) -> bool:
+        """Ask whether to resume a partial transfer. Returns True if user clicks Resume.
+
+        Safe to call from any thread; scheduler workers call it mid-transfer.
+        """
+        return self._ask(lambda: self._ask_resume(filename, offset, total))
+
+    def _ask_resume(self, filename: str, offset: int, total: int) -> bool:
+        result = {"resume": False}
+
+        def on_resume():
+            result["resume"] = True
+            dialog.destroy()
+
+        def on_restart():
+            result["resume"] = False
+            dialog.destroy()
+
+        dialog = ctk.CTkToplevel(self.root)
+        dialog.title("Resume Transfer")
+        dialog.geometry("400x180")
+        dialog.grab_set()
+
+        label = ctk.CTkLabel(
+            dialog,
+            text=f"A partial copy of {filename} was found\n"
+                 f"({human_size(offset)} of {human_size(total)}).\n\nResume where it stopped?",
+            wraplength=380
+        )
+        label.pack(padx=20, pady=20)
+
+        btn_frame = ctk.CTkFrame(dialog)
+        btn_frame.pack(pady=10)
+
+        ctk.CTkButton(btn_frame, text="Resume", command=on_resume).pack(side="left", padx=10)
+        ctk.CTkButton(btn_frame, text="Start over", command=on_restart).pack(side="left", padx=10)
+
+        dialog.wait_window()
+        return result["resume"]
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import paramiko
+
+HASHED_PREFIX = "|1|"
+
+
+def host_entry_name(host: str, port: int) -> str:
+    """The name known_hosts files use for a host: bare on port 22, ``[host]:port`` otherwise."""
+    return host if port == 22 else f"[{host}]:{port}"
+
+
+class KnownHostsStore:
+    """An OpenSSH known_hosts file parsed once and indexed by host name.
+
+    Plain entries go into a dict keyed by name, so a lookup costs the same
+    however many hosts the file holds. Hashed ``|1|salt|hash`` entries
+    cannot be indexed, so the first lookup of a name checks it against each
+    of them and the answer is remembered. Keys stay base64 until a lookup
+    needs them. The file is parsed again only when its mtime or size
+    changes, and ``add`` rewrites it atomically without duplicating an
+    entry already there. ``@cert-authority`` and ``@revoked`` lines are
+    skipped, as paramiko does. A key passed to ``add`` is trusted for the
+    rest of the process even if the file cannot be written, so every
+    connection to that host agrees with the user's decision.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._plain: Dict[str, List[Tuple[str, str]]] = {}
+        self._hashed: List[Tuple[bytes, bytes, str, str]] = []
+        self._resolved: Dict[str, List[Tuple[str, str]]] = {}
+        # Keys accepted through ``add``; kept across reloads of the file.
+        self._accepted: Dict[str, List[Tuple[str, str]]] = {}
+
+    def lookup(self, host: str, port: int = 22) -> List[paramiko.PKey]:
+        """Keys recorded for ``host`` on ``port``; empty if the host is unknown."""
+        with self._lock:
+            self._refresh()
+            name = host_entry_name(host, port)
+            entries = self._entries(name) + [e for e in self._accepted.get(name, ()) if e not in self._entries(name)]
+        keys = []
+        for keytype, data in entries:
+            try:
+                keys.append(paramiko.PKey.from_type_string(keytype, base64.b64decode(data)))
+            except Exception:
+                continue
+        return keys
+
+    def add(self, host: str, port: int, key: paramiko.PKey) -> bool:
+        """Record ``key`` for ``host`` on ``port``. Returns False if the file already had it.
+
+        The key is trusted in memory before the file is written, so it stays
+        trusted for this process even if the write raises.
+        """
+        name = host_entry_name(host, port)
+        entry = (key.get_name(), key.get_base64())
+        with self._lock:
+            self._refresh()
+            accepted = self._accepted.setdefault(name, [])
+            if entry not in accepted:
+                accepted.append(entry)
+            if entry in self._entries(name):
+                return False
+            path = os.path.realpath(self.path)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                mode = os.stat(path).st_mode & 0o777
+            except FileNotFoundError:
+                text, mode = "", 0o600
+            if text and not text.endswith("\n"):
+                text += "\n"
+            text += f"{name} {entry[0]} {entry[1]}\n"
+            self._write(path, text, mode)
+            # Parse again on next use: the file may also hold lines other processes added since the last load.
+            self._loaded = False
+            return True
+
+    def _entries(self, name: str) -> List[Tuple[str, str]]:
+        entries = self._resolved.get(name)
+        if entries is None:
+            entries = list(self._plain.get(name, ()))
+            for salt, digest, keytype, data in self._hashed:
+                if hmac.compare_digest(hmac.new(salt, name.encode(), hashlib.sha1).digest(), digest):
+                    entries.append((keytype, data))
+            self._resolved[name] = entries
+        return entries
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self):
+        stamp = self._stat()
+        if self._loaded and stamp == self._stamp:
+            return
+        self._plain, self._hashed, self._resolved = {}, [], {}
+        self._loaded, self._stamp = True, stamp
+        if stamp is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    self._index_line(line)
+        except OSError as e:
+            print(f"[!] Cannot read {self.path}: {e}")
+
+    def _index_line(self, line: str):
+        fields = line.split()
+        if len(fields) < 3 or fields[0].startswith(("#", "@")):
+            return
+        names, keytype, data = fields[:3]
+        for name in names.split(","):
+            if name.startswith(HASHED_PREFIX):
+                try:
+                    salt, digest = name[len(HASHED_PREFIX):].split("|")
+                    self._hashed.append((base64.b64decode(salt), base64.b64decode(digest), keytype, data))
+                except ValueError:
+                    continue
+            else:
+                self._plain.setdefault(name, []).append((keytype, data))
+
+    @staticmethod
+    def _write(path: str, text: str, mode: int):
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".known_hosts.", dir=folder)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+
+_stores_lock = threading.Lock()
+_stores: Dict[str, KnownHostsStore] = {}
+
+
+def known_hosts(path: str) -> KnownHostsStore:
+    """The process-wide store for ``path``, so every connection shares one parse of the file."""
+    path = os.path.abspath(os.path.expanduser(path))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = KnownHostsStore(path)
+        return store
@@ -0,0 +1,175 @@
+import hashlib
+import shlex
+import socket
+import threading
+from typing import Callable, Dict, Optional
+
+import paramiko
+
+DEFAULT_ALGORITHM = "sha256"
+HASH_BLOCK = 1024 * 1024
+# Out-of-order bytes a StreamHasher holds before callers ahead of the gap have to wait.
+DEFAULT_MAX_HELD = 64 * 1024 * 1024
+# Seconds a digest exec may go without output. The tool prints nothing until it has read
+# the whole file, so this has to cover hashing the largest file at disk speed.
+DEFAULT_DIGEST_TIMEOUT = 300.0
+
+# Name understood by the "check-file" extension and the coreutils tool that prints the same digest.
+ALGORITHMS = {
+    "sha256": ("sha256", "sha256sum"),
+    "blake2b": ("blake2b", "b2sum"),
+}
+
+
+class HasherAborted(Exception):
+    """Raised to a caller waiting in ``StreamHasher.update`` once the transfer feeding it has failed."""
+
+
+class StreamHasher:
+    """Whole-file digest fed with ``(offset, data)`` pieces arriving in any order.
+
+    Pieces past the next expected offset are held until the gap is filled,
+    so the digest is the same as hashing the file front to back. With the
+    chunked transfer engine the backlog stays around one chunk per channel.
+
+    Once ``max_held`` bytes are held, a caller with another out-of-order
+    piece waits until the gap is filled, so a stalled channel slows the
+    others down instead of growing the backlog without limit. The piece at
+    the expected offset never waits. ``abort`` releases the waiters when
+    whoever should fill the gap has failed.
+    """
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, start: int = 0, max_held: int = DEFAULT_MAX_HELD):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unsupported digest algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.max_held = max_held
+        self._digest = hashlib.new(algorithm)
+        self._next = start
+        self._held: Dict[int, bytes] = {}
+        self._held_bytes = 0
+        self._aborted: Optional[str] = None
+        self._lock = threading.Condition()
+
+    def feed_file(self, path: str, length: int):
+        """Hash the first ``length`` bytes of a local file; used for the part a resume skips."""
+        with open(path, "rb") as f:
+            remaining = length
+            while remaining:
+                block = f.read(min(HASH_BLOCK, remaining))
+                if not block:
+                    raise EOFError(f"{path} is shorter than {length} bytes")
+                self._digest.update(block)
+                remaining -= len(block)
+        self._next = length
+
+    def update(self, offset: int, data: bytes):
+        with self._lock:
+            while offset != self._next and self._held_bytes >= self.max_held and not self._aborted:
+                self._lock.wait()
+            if self._aborted:
+                raise HasherAborted(self._aborted)
+            if offset != self._next:
+                # Callers may reuse the buffer behind ``data``; keep a copy.
+                self._held[offset] = bytes(data)
+                self._held_bytes += len(data)
+                return
+            self._digest.update(data)
+            self._next += len(data)
+            while self._next in self._held:
+                data = self._held.pop(self._next)
+                self._held_bytes -= len(data)
+                self._digest.update(data)
+                self._next += len(data)
+            # A waiter may now hold the expected offset, or fit under the limit again.
+            self._lock.notify_all()
+
+    def abort(self, reason: str):
+        """Wake every caller waiting in ``update``; they and later callers get ``HasherAborted``."""
+        with self._lock:
+            self._aborted = reason
+            self._lock.notify_all()
+
+    def hexdigest(self, length: int) -> str:
+        """Final digest; ``length`` is the file size, to catch pieces that never arrived."""
+        with self._lock:
+            if self._next != length or self._held:
+                raise ValueError(f"Digest covers {self._next} of {length} bytes")
+            return self._digest.hexdigest()
+
+
+class TransferResult:
+    """Outcome of one upload or download; truthy when it succeeded.
+
+    ``verified`` is True when the remote digest matched, False when it did
+    not, and None when the server offered no way to compute one and only the
+    size could be compared. ``compression`` is the ``CompressionDecision``
+    the transfer ran with, when one was made, and ``progress`` the final
+    ``metrics.ProgressSnapshot`` with its rates and time to first byte.
+    """
+
+    def __init__(
+        self,
+        ok: bool,
+        size: int = 0,
+        algorithm: Optional[str] = None,
+        digest: Optional[str] = None,
+        remote_digest: Optional[str] = None,
+        verified: Optional[bool] = None,
+        error: Optional[str] = None,
+        compression=None,
+        progress=None,
+    ):
+        self.ok = ok
+        self.size = size
+        self.algorithm = algorithm
+        self.digest = digest
+        self.remote_digest = remote_digest
+        self.verified = verified
+        self.error = error
+        self.compression = compression
+        self.progress = progress
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        return f"TransferResult(ok={self.ok}, size={self.size}, {self.algorithm}={self.digest}, verified={self.verified})"
+
+
+def remote_digest(
+    sftp: paramiko.SFTPClient,
+    open_exec: Optional[Callable[[str], paramiko.Channel]],
+    path: str,
+    algorithm: str = DEFAULT_ALGORITHM,
+    timeout: float = DEFAULT_DIGEST_TIMEOUT,
+) -> Optional[str]:
+    """Ask the server for the digest of ``path`` without downloading it.
+
+    Tries the ``check-file`` SFTP extension first and a ``sha256sum`` /
+    ``b2sum`` exec second. Returns None if neither is available, or if the
+    exec stalls for ``timeout`` seconds.
+    """
+    extension_name, tool = ALGORITHMS[algorithm]
+    try:
+        with sftp.open(path, "rb") as f:
+            return f.check(extension_name).hex()
+    except (IOError, paramiko.SSHException):
+        pass
+    if not open_exec:
+        return None
+    try:
+        channel = open_exec(f"{tool} -- {shlex.quote(path)}")
+        try:
+            channel.settimeout(timeout)
+            output = channel.makefile("rb").read().decode("ascii", "replace")
+            if not channel.status_event.wait(timeout):
+                return None
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+    except (paramiko.SSHException, socket.timeout):
+        return None
+    if status != 0 or not output:
+        return None
+    return output.split()[0].lstrip("\\").lower()
@@ -1,43 +1,39 @@
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 import os
+import stat
+
+from file_model import FileEntry
+from local_index import LocalIndex
 
 class LocalFileSystem:
     def __init__(self):
         self.current_folder = Path.home()
+        self.index = LocalIndex()
 
     def get_folders(self) -> List[str]:
-        folders = []
-        try:
-            if self.current_folder != self.current_folder.anchor:
-                folders.append("..")
-            for p in self.current_folder.iterdir():
-                if p.is_dir() and not p.name.startswith('.'):
-                    try:
-                        if p.stat().st_mode & 0o400:
-                            folders.append(p.name)
-                    except (PermissionError, OSError):
-                        continue
-            folders.sort(key=str.lower)
-        except (PermissionError, FileNotFoundError):
-            pass
+        folders = [entry.name for entry in self.list_dir()[0] if entry.name != ".."]
+        folders.sort(key=str.lower)
+        if self.current_folder.parent != self.current_folder:
+            folders.insert(0, "..")
         return folders
 
     def get_files(self) -> List[Tuple[str, int]]:
-        files = []
+        files = [(entry.name, entry.size) for entry in self.list_dir()[1]]
+        files.sort(key=lambda x: x[0].lower())
+        return files
+
+    def list_dir(self, refresh: bool = False) -> Tuple[List[FileEntry], List[FileEntry]]:
+        """Return (folders, files) of the current folder, unsorted, from the scandir index."""
+        folders: List[FileEntry] = []
+        if self.current_folder.parent != self.current_folder:
+            folders.append(FileEntry("..", 0, 0.0, True))
         try:
-            for p in self.current_folder.iterdir():
-                if p.is_file() and not p.name.startswith('.'):
-                    try:
-                        if p.stat().st_mode & 0o400:
-                            size = p.stat().st_size
-                            files.append((p.name, size))
-                    except (PermissionError, OSError):
-                        continue
-            files.sort(key=lambda x: x[0].lower())
+            snapshot = self.index.scan(str(self.current_folder), refresh=refresh)
         except (PermissionError, FileNotFoundError):
-            pass
-        return files
+            return folders, []
+        folders.extend(snapshot.folders)
+        return folders, list(snapshot.files)
 
     def navigate_to(self, folder_name: str) -> bool:
         try:
@@ -56,6 +52,42 @@ class LocalFileSystem:
             pass
         return False
 
+    def walk(
+        self, root: Optional[str] = None, on_error: Optional[Callable[[str, OSError], None]] = None
+    ) -> Iterator[Tuple[str, os.stat_result]]:
+        """Yield (relative posix path, stat) for every entry below root, parents before children.
+
+        Symlinks are skipped so a link cannot pull a tree into itself. A folder
+        that cannot be listed or an entry that cannot be stat'ed raises, as the
+        remote walk does, or is passed to ``on_error`` with its full path and
+        the walk goes on without it.
+        """
+        base = str(root or self.current_folder)
+        pending = [""]
+        while pending:
+            rel = pending.pop()
+            folder = os.path.join(base, rel)
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_symlink():
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError as e:
+                            if on_error is None:
+                                raise
+                            on_error(entry.path, e)
+                            continue
+                        child = f"{rel}/{entry.name}" if rel else entry.name
+                        yield child, st
+                        if stat.S_ISDIR(st.st_mode):
+                            pending.append(child)
+            except OSError as e:
+                if on_error is None:
+                    raise
+                on_error(folder, e)
+
     def get_selected_file(self, filename: str) -> str:
         """Get the full path of a selected file"""
         try:
@@ -0,0 +1,90 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from file_model import FileEntry
+
+DEFAULT_INDEX_DIRS = 128
+# A folder changed this recently may change again within its mtime tick, so its snapshot is not trusted.
+RACY_WINDOW = 2.0
+
+
+class DirSnapshot(NamedTuple):
+    mtime_ns: int
+    scanned_at: float
+    folders: List[FileEntry]
+    files: List[FileEntry]
+
+
+class LocalIndex:
+    """Per-folder snapshots of local listings built in one ``os.scandir`` pass.
+
+    Each entry is stat'ed once through its ``DirEntry`` (free on Windows,
+    one call on POSIX) and kept as a ``FileEntry`` tuple. A folder is only
+    scanned again when its own mtime moves, which is what adding, removing
+    or renaming an entry does. Rewriting a file in place does not touch the
+    folder mtime, so callers that just wrote into a folder should
+    ``invalidate`` it. Hidden and unreadable entries are left out.
+    """
+
+    def __init__(self, max_dirs: int = DEFAULT_INDEX_DIRS):
+        self.max_dirs = max(1, max_dirs)
+        self.scans = 0
+        self.hits = 0
+        self._snapshots: "OrderedDict[str, DirSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def scan(self, path: str, refresh: bool = False) -> DirSnapshot:
+        """Return the snapshot of ``path``, rescanning only if the folder changed."""
+        path = os.path.abspath(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            snapshot = None if refresh else self._snapshots.get(path)
+            if snapshot and snapshot.mtime_ns == mtime_ns and not self._racy(snapshot):
+                self._snapshots.move_to_end(path)
+                self.hits += 1
+                return snapshot
+
+        snapshot = self._scan(path, mtime_ns)
+        with self._lock:
+            self.scans += 1
+            self._snapshots[path] = snapshot
+            self._snapshots.move_to_end(path)
+            while len(self._snapshots) > self.max_dirs:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, path: Optional[str] = None):
+        with self._lock:
+            if path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(os.path.abspath(path), None)
+
+    @staticmethod
+    def _racy(snapshot: DirSnapshot) -> bool:
+        return snapshot.scanned_at - snapshot.mtime_ns / 1e9 < RACY_WINDOW
+
+    @staticmethod
+    def _scan(path: str, mtime_ns: int) -> DirSnapshot:
+        folders: List[FileEntry] = []
+        files: List[FileEntry] = []
+        scanned_at = time.time()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if not st.st_mode & 0o400:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    folders.append(FileEntry(entry.name, 0, st.st_mtime, True))
+                elif stat.S_ISREG(st.st_mode):
+                    files.append(FileEntry(entry.name, st.st_size, st.st_mtime, False))
+        return DirSnapshot(mtime_ns, scanned_at, folders, files)
@@ -1,9 +1,22 @@
 import customtkinter as ctk
 import threading
+import time
 import os
+from typing import List, Optional
+
+import paramiko
+from ciphers import ALGORITHMS_FASTEST
+from compression import COMPRESSION_AUTO
+from file_model import FileEntry
 from gui import SFTPInterface
 from local_fs import LocalFileSystem
+from remote_index import DEFAULT_INDEX_PATH
 from remote_sftp import RemoteSFTP
+from scheduler import TransferScheduler, TransferJob, UPLOAD, DONE, FAILED, CANCELLED, PAUSED, QUEUED, RUNNING
+from utils import human_duration, human_size
+
+# Seconds between pushes of listing batches to the UI while a directory streams in.
+LISTING_BATCH_INTERVAL = 0.1
 
 
 class SFTPApp:
@@ -13,7 +26,11 @@ class SFTPApp:
         self.root.geometry("1280x720")
 
         self.local_fs = LocalFileSystem()
-        self.remote_sftp = RemoteSFTP()
+        # The listing index lets folders seen in earlier sessions open before the server answers.
+        self.remote_sftp = RemoteSFTP(compression=COMPRESSION_AUTO, algorithms=ALGORITHMS_FASTEST,
+                                      index_path=DEFAULT_INDEX_PATH)
+        self.scheduler = TransferScheduler(on_update=self._on_job_update)
+        self._listing_cancel: Optional[threading.Event] = None
 
         self.gui = SFTPInterface(self.root)
         self._bind_events()
@@ -22,40 +39,114 @@ class SFTPApp:
         self._refresh_remote()
         self.gui.log("Ready. Enter credentials and connect securely.")
         self.remote_sftp.ask_trust_callback = self.gui.ask_trust_host
+        self.remote_sftp.ask_resume_callback = self.gui.ask_resume
 
     def _bind_events(self):
         self.gui.on_connect_callback = self.connect
         self.gui.on_disconnect_callback = self.disconnect
         self.gui.on_upload_callback = self.upload
         self.gui.on_download_callback = self.download
+        self.gui.on_transfer_pause_callback = self._toggle_pause
+        self.gui.on_transfer_cancel_callback = self.scheduler.cancel
+        self.gui.on_transfer_run_next_callback = self._run_next
         self.gui._on_local_folder_select = self._local_folder_selected
         self.gui._on_remote_folder_select = self._remote_folder_selected
 
     def _refresh_local(self):
-        folders = self.local_fs.get_folders()
-        folder_text = "\n".join(f"[DIR]  {name}" for name in folders)
-        self.gui.update_local_tree(folder_text)
-
-        files = self.local_fs.get_files()
-        self.gui.update_local_files(files)
+        folders, files = self.local_fs.list_dir()
+        path = self.local_fs.get_full_path()
+        self.gui.update_local_tree(folders, path)
+        self.gui.update_local_files(files, path)
 
         self.gui.local_folder_label.configure(text=f"Local: {self.local_fs.current_folder}")
 
     def _refresh_remote(self):
-        if not self.remote_sftp.is_connected():
-            self.gui.update_remote_tree("Not connected")
+        if not self.remote_sftp.has_session():
+            self._cancel_listing()
+            self.gui.set_remote_loading(False)
+            self.gui.update_remote_tree([], placeholder="Not connected")
             self.gui.update_remote_files([])
             self.gui.remote_folder_label.configure(text="Remote Folders")
             return
 
-        folders = self.remote_sftp.get_folders()
-        folder_text = "\n".join(f"[DIR]  {name}" for name in folders)
-        self.gui.update_remote_tree(folder_text)
-
-        files = self.remote_sftp.get_files()
-        self.gui.update_remote_files(files)
+        self._load_remote(self.remote_sftp.current_path)
+
+    def _cancel_listing(self):
+        if self._listing_cancel:
+            self._listing_cancel.set()
+            self._listing_cancel = None
+
+    def _load_remote(self, path: str, announce: bool = False):
+        """List ``path`` on a background thread and stream it into the remote views.
+
+        The current view stays until the first batch arrives, so a folder
+        that cannot be opened leaves it untouched. Starting another listing
+        cancels this one; its late batches are dropped.
+
+        A folder the listing index already holds is shown from it at once;
+        the live listing then replaces it in one go when it completes.
+        """
+        self._cancel_listing()
+        cancel = self._listing_cancel = threading.Event()
+        self.gui.set_remote_loading(True)
+        cached = None
+        if self.remote_sftp.listings.get(path) is None:
+            cached = self.remote_sftp.indexed_listing(path)
+        if cached is not None:
+            self._show_listing(cancel, path, cached, True, announce)
+
+        def _list_thread():
+            batch: List[paramiko.SFTPAttributes] = []
+            first = True
+            sent_at = time.monotonic()
+            try:
+                for page in self.remote_sftp.iter_dir(path, cancel=cancel):
+                    if cancel.is_set():
+                        return
+                    batch.extend(page)
+                    if cached is not None:
+                        continue
+                    now = time.monotonic()
+                    if first or now - sent_at >= LISTING_BATCH_INTERVAL:
+                        self.root.after(0, lambda b=batch, f=first: self._show_listing(cancel, path, b, f, announce))
+                        batch, first, sent_at = [], False, now
+            except Exception as e:
+                self.root.after(0, lambda error=e: self._listing_failed(cancel, path, error))
+                return
+            self.root.after(0, lambda: self._listing_done(cancel, path, batch, first, announce and cached is None))
+
+        threading.Thread(target=_list_thread, daemon=True).start()
+
+    def _show_listing(self, cancel: threading.Event, path: str, attrs: list, first: bool, announce: bool):
+        if cancel is not self._listing_cancel:
+            return
+        folders, files = self.remote_sftp.to_entries(attrs)
+        if not first:
+            self.gui.extend_remote(folders, files)
+            return
+        # First batch: the folder opened, so it becomes the current one.
+        self.remote_sftp.current_path = path
+        if path != "/":
+            folders.insert(0, FileEntry("..", 0, 0.0, True))
+        self.gui.update_remote_tree(folders, path)
+        self.gui.update_remote_files(files, path)
+        self.gui.remote_folder_label.configure(text=f"Remote: {path}")
+        if announce:
+            self.gui.log(f"Remote: {path}")
+
+    def _listing_done(self, cancel: threading.Event, path: str, attrs: list, first: bool, announce: bool):
+        if cancel is not self._listing_cancel:
+            return
+        self._show_listing(cancel, path, attrs, first, announce)
+        self._listing_cancel = None
+        self.gui.set_remote_loading(False)
 
-        self.gui.remote_folder_label.configure(text=f"Remote: {self.remote_sftp.current_path}")
+    def _listing_failed(self, cancel: threading.Event, path: str, error: Exception):
+        if cancel is not self._listing_cancel:
+            return
+        self._listing_cancel = None
+        self.gui.set_remote_loading(False)
+        self.gui.log(f"Remote: Cannot list {path}: {error}")
 
     def _local_folder_selected(self, folder_name: str):
         if self.local_fs.navigate_to(folder_name):
@@ -65,11 +156,11 @@ class SFTPApp:
             self.gui.log(f"Cannot enter: {folder_name}")
 
     def _remote_folder_selected(self, folder_name: str):
-        if self.remote_sftp.navigate_to(folder_name):
-            self._refresh_remote()
-            self.gui.log(f"Remote: {self.remote_sftp.current_path}")
-        else:
+        path = self.remote_sftp.resolve_folder(folder_name)
+        if path is None or not self.remote_sftp.has_session():
             self.gui.log(f"Remote: Cannot enter '{folder_name}'")
+            return
+        self._load_remote(path, announce=True)
 
     def connect(self):
         creds = self.gui.get_credentials()
@@ -113,7 +204,7 @@ class SFTPApp:
         self.gui.log("Disconnected securely.")
 
     def upload(self):
-        if not self.remote_sftp.is_connected():
+        if not self.remote_sftp.has_session():
             self.gui.log("Not connected to remote server")
             return
 
@@ -127,22 +218,11 @@ class SFTPApp:
             self.gui.log(f"File not found: {filename}")
             return
 
-        def _upload_thread():
-            success = self.remote_sftp.upload_file(local_path, filename)
-            self.root.after(0, lambda: self._on_upload_result(success, filename))
-
-        self.gui.log(f"Uploading {filename} securely...")
-        threading.Thread(target=_upload_thread, daemon=True).start()
-
-    def _on_upload_result(self, success: bool, filename: str):
-        if success:
-            self.gui.log(f"Successfully uploaded {filename}")
-            self._refresh_remote()
-        else:
-            self.gui.log(f"Failed to upload {filename}")
+        job = self.scheduler.submit_upload(self.remote_sftp, local_path, filename)
+        self.gui.log(f"Queued upload of {filename} (job {job.id})")
 
     def download(self):
-        if not self.remote_sftp.is_connected():
+        if not self.remote_sftp.has_session():
             self.gui.log("Not connected to remote server")
             return
 
@@ -153,19 +233,69 @@ class SFTPApp:
 
         local_path = os.path.join(self.local_fs.get_full_path(), filename)
 
-        def _download_thread():
-            success = self.remote_sftp.download_file(filename, local_path)
-            self.root.after(0, lambda: self._on_download_result(success, filename))
-
-        self.gui.log(f"Downloading {filename} securely...")
-        threading.Thread(target=_download_thread, daemon=True).start()
-
-    def _on_download_result(self, success: bool, filename: str):
-        if success:
-            self.gui.log(f"Successfully downloaded {filename}")
-            self._refresh_local()
-        else:
-            self.gui.log(f"Failed to download {filename}")
+        job = self.scheduler.submit_download(self.remote_sftp, filename, local_path)
+        self.gui.log(f"Queued download of {filename} (job {job.id})")
+
+    def _on_job_update(self, job: TransferJob):
+        # Called from scheduler threads; hand over to the Tk main loop.
+        state = job.state
+        self.root.after(0, lambda: self._show_job(job, state))
+
+    def _show_job(self, job: TransferJob, state: str):
+        counts = self.scheduler.counts()
+        self.gui.update_queue_status(counts.get("running", 0), counts.get("queued", 0))
+        name = os.path.basename(job.local_path if job.kind == UPLOAD else job.remote_path)
+        verb = "upload" if job.kind == UPLOAD else "download"
+        if state in (QUEUED, RUNNING, PAUSED):
+            # Unfinished jobs keep a row with their controls.
+            self._show_progress(job, name, verb, state)
+            if state == PAUSED:
+                self.gui.log(f"Paused {verb} of {name}")
+            return
+        self.gui.remove_transfer(job.id)
+        if state == DONE:
+            self.gui.log(f"Successfully {verb}ed {name}")
+            if job.kind == UPLOAD:
+                self._refresh_remote()
+            else:
+                # An overwritten file leaves the folder mtime alone, so drop the snapshot.
+                self.local_fs.index.invalidate(os.path.dirname(job.local_path))
+                self._refresh_local()
+        elif state == FAILED:
+            self.gui.log(f"Failed to {verb} {name}")
+        elif state == CANCELLED:
+            self.gui.log(f"Cancelled {verb} of {name}")
+
+    def _show_progress(self, job: TransferJob, name: str, verb: str, state: str):
+        title = f"{verb.capitalize()}ing {name}"
+        if state != RUNNING:
+            fraction = job.bytes_done / job.bytes_total if job.bytes_total else 0.0
+            detail = "paused" if state == PAUSED else "queued"
+            if job.bytes_total:
+                detail += f" at {human_size(job.bytes_done)} of {human_size(job.bytes_total)}"
+            self.gui.show_transfer(job.id, title, fraction, detail, paused=state == PAUSED, queued=state == QUEUED)
+            return
+        snapshot = job.snapshot()
+        if snapshot is None or not snapshot.total:
+            self.gui.show_transfer(job.id, title, 0.0, "starting...")
+            return
+        detail = f"{human_size(snapshot.done)} of {human_size(snapshot.total)}"
+        if snapshot.rate:
+            detail += f" at {human_size(int(snapshot.rate))}/s"
+            if snapshot.eta is not None:
+                detail += f", {human_duration(snapshot.eta)} left"
+        elif snapshot.first_byte is not None:
+            detail += ", stalled"
+        self.gui.show_transfer(job.id, title, snapshot.fraction, detail)
+
+    def _toggle_pause(self, job_id: int):
+        # A paused job resumes; a queued or running one pauses. The row follows the job's update.
+        if not self.scheduler.resume(job_id):
+            self.scheduler.pause(job_id)
+
+    def _run_next(self, job_id: int):
+        queued = [job["priority"] for job in self.scheduler.jobs() if job["state"] == QUEUED and job["id"] != job_id]
+        self.scheduler.set_priority(job_id, max(queued, default=0) + 1)
 
     def run(self):
         self.root.mainloop()
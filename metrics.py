@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The instantaneous rate is measured over this many trailing seconds.
+RATE_WINDOW = 2.0
+METRIC_PREFIX = "sftp"
+
+OK = "ok"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class ProgressSnapshot(NamedTuple):
+    """Where one transfer stands. Rates are in bytes per second and count only bytes moved by this run."""
+
+    done: int
+    total: int
+    elapsed: float
+    rate: float
+    average_rate: float
+    first_byte: Optional[float] = None
+    start: int = 0
+
+    @property
+    def moved(self) -> int:
+        return self.done - self.start
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Seconds left at the current rate, or None before the rate is known."""
+        if self.done >= self.total:
+            return 0.0
+        return (self.total - self.done) / self.rate if self.rate > 0 else None
+
+
+class TransferProgress:
+    """A progress callback that keeps rates and time to first byte.
+
+    Pass an instance wherever a ``(done, total)`` progress callback is
+    taken. The clock starts when it is created, so create it right before
+    the transfer. The first report is the baseline: a resumed transfer
+    reports its starting offset first, and those bytes do not count
+    towards the rates. ``on_update``, if given, is called with a fresh
+    snapshot on every report.
+    """
+
+    def __init__(self, on_update: Optional[Callable[[ProgressSnapshot], None]] = None):
+        self.on_update = on_update
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._base: Optional[int] = None
+        self._done = 0
+        self._total = 0
+        self._first_byte: Optional[float] = None
+        self._samples: Deque[Tuple[float, int]] = deque()
+
+    def __call__(self, done: int, total: int):
+        now = time.monotonic()
+        with self._lock:
+            if self._base is None:
+                self._base = done
+            elif self._first_byte is None and done > self._base:
+                self._first_byte = now - self.started
+            self._done, self._total = done, total
+            self._samples.append((now, done))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW:
+                self._samples.popleft()
+        if self.on_update:
+            self.on_update(self.snapshot())
+
+    def snapshot(self) -> ProgressSnapshot:
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self.started
+            moved = self._done - (self._base or 0)
+            rate = 0.0
+            if len(self._samples) > 1:
+                (t0, d0), (t1, d1) = self._samples[0], self._samples[-1]
+                # A transfer that has gone quiet is stalled, not still moving at its last rate.
+                if t1 > t0 and now - t1 < RATE_WINDOW:
+                    rate = (d1 - d0) / (t1 - t0)
+            average = moved / elapsed if elapsed > 0 else 0.0
+            return ProgressSnapshot(self._done, self._total, elapsed, rate, average, self._first_byte, self._base or 0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """``(le, count)`` pairs, ending with ``+Inf``."""
+        pairs, running = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            pairs.append(("+Inf" if bound == float("inf") else repr(bound), running))
+        return pairs
+
+
+class Metrics:
+    """Process-side counters and latency histograms for one connection.
+
+    Operation latencies (``stat``, ``listdir``, ``open``, ``read``,
+    ``write``) go into one histogram per operation; ``read`` and ``write``
+    time each pipelined request from send to reply, so a stalled link
+    shows up in the high buckets. Errors are counted by operation and
+    exception type. Safe to update from any thread.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._latency: Dict[str, Histogram] = {}
+        self._first_byte: Dict[str, Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._bytes: Dict[str, int] = {}
+        self._transfers: Dict[Tuple[str, str], int] = {}
+        self._resumed: Dict[str, int] = {}
+
+    def observe(self, op: str, seconds: float):
+        with self._lock:
+            self._histogram(self._latency, op).observe(seconds)
+
+    @contextmanager
+    def timed(self, op: str) -> Iterator[None]:
+        """Time the block as one ``op``; an exception escaping it is counted as an error of ``op``."""
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.error(op, e)
+            raise
+        finally:
+            self.observe(op, time.monotonic() - start)
+
+    def error(self, op: str, error: BaseException):
+        key = (op, type(error).__name__)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def transfer_finished(self, direction: str, outcome: str, progress: Optional[ProgressSnapshot] = None,
+                          resumed: bool = False):
+        with self._lock:
+            self._transfers[(direction, outcome)] = self._transfers.get((direction, outcome), 0) + 1
+            if resumed:
+                self._resumed[direction] = self._resumed.get(direction, 0) + 1
+            if progress is None:
+                return
+            self._bytes[direction] = self._bytes.get(direction, 0) + progress.moved
+            if progress.first_byte is not None:
+                self._histogram(self._first_byte, direction).observe(progress.first_byte)
+
+    def errors(self) -> Dict[Tuple[str, str], int]:
+        with self._lock:
+            return dict(self._errors)
+
+    def latency(self, op: str) -> Optional[Histogram]:
+        return self._latency.get(op)
+
+    def to_prometheus(self, prefix: str = METRIC_PREFIX) -> str:
+        """Render everything in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            self._render_histograms(lines, f"{prefix}_operation_seconds", "Latency of SFTP operations.",
+                                    "op", self._latency)
+            self._render_histograms(lines, f"{prefix}_time_to_first_byte_seconds",
+                                    "Time from starting a transfer to its first byte.", "direction", self._first_byte)
+            self._render_counter(lines, f"{prefix}_errors_total", "Failed operations.", ("op", "error"), self._errors)
+            self._render_counter(lines, f"{prefix}_transfers_total", "Finished transfers.",
+                                 ("direction", "outcome"), self._transfers)
+            self._render_counter(lines, f"{prefix}_resumed_transfers_total", "Transfers resumed from a checkpoint.",
+                                 ("direction",), {(k,): v for k, v in self._resumed.items()})
+            self._render_counter(lines, f"{prefix}_transferred_bytes_total", "Bytes moved by transfers.",
+                                 ("direction",), {(k,): v for k, v in self._bytes.items()})
+        return "\n".join(lines) + "\n"
+
+    def _histogram(self, table: Dict[str, Histogram], name: str) -> Histogram:
+        histogram = table.get(name)
+        if histogram is None:
+            histogram = table[name] = Histogram(self.buckets)
+        return histogram
+
+    @staticmethod
+    def _render_histograms(lines: List[str], name: str, help_text: str, label: str, table: Dict[str, Histogram]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key in sorted(table):
+            histogram = table[key]
+            labels = f'{label}="{_escape(key)}"'
+            for le, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    @staticmethod
+    def _render_counter(lines: List[str], name: str, help_text: str, labels: Tuple[str, ...],
+                        table: Dict[Tuple[str, ...], int]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for key in sorted(table):
+            rendered = ",".join(f'{label}="{_escape(value)}"' for label, value in zip(labels, key))
+            lines.append(f"{name}{{{rendered}}} {table[key]}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,288 @@
+import os
+import posixpath
+import sqlite3
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional, Tuple
+
+import paramiko
+
+from crawler import ErrorCallback, iter_dir_pages
+from local_index import RACY_WINDOW
+
+if TYPE_CHECKING:
+    from remote_sftp import RemoteSFTP
+
+DEFAULT_INDEX_PATH = os.path.expanduser("~/.cache/secure-sftp/index.sqlite3")
+DEFAULT_SEARCH_LIMIT = 1000
+# File type bits of st_mode, for picking folders out in SQL.
+_S_IFMT = 0o170000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    host TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime INTEGER,
+    listed_at REAL NOT NULL,
+    PRIMARY KEY (host, path)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    host TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    mode INTEGER,
+    PRIMARY KEY (host, dir, name)
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (host, name);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (host, size);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries (host, mtime);
+"""
+
+
+class IndexedEntry(NamedTuple):
+    path: str
+    size: int
+    mtime: int
+    mode: int
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode or 0)
+
+
+class RefreshStats(NamedTuple):
+    listed: int
+    unchanged: int
+    removed: int
+    failed: int
+    entries: int
+    seconds: float
+
+    def summary(self) -> str:
+        failed = f", {self.failed} unreadable" if self.failed else ""
+        return (f"{self.listed} folders listed, {self.unchanged} unchanged, {self.removed} gone{failed}, "
+                f"{self.entries} entries in {self.seconds:.1f}s")
+
+
+def _subtree(path: str) -> Tuple[str, str]:
+    """Bounds that select every path strictly below ``path``: '/' sorts just before '0'."""
+    base = path.rstrip("/")
+    return base + "/", base + "0"
+
+
+class RemoteIndex:
+    """SQLite index of remote directory metadata, kept per host between sessions.
+
+    Each listed folder is stored with its own mtime and every entry's name,
+    size, mtime and mode, so a folder can be shown and the whole tree
+    searched without asking the server. ``refresh`` brings the index up to
+    date incrementally: adding, removing or renaming an entry moves its
+    folder's mtime, so only folders whose mtime changed are listed again and
+    the rest cost one stat. As with ``local_index.LocalIndex``, a file
+    rewritten in place leaves its folder's mtime alone; ``full`` relists
+    everything. ``host`` keys the rows, so one database file serves many
+    servers.
+    """
+
+    def __init__(self, host: str, path: str = DEFAULT_INDEX_PATH):
+        self.host = host
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def listing(self, path: str) -> Optional[List[paramiko.SFTPAttributes]]:
+        """The indexed entries of folder ``path``, or None if it was never listed."""
+        path = _normalize(path)
+        with self._lock:
+            if not self._db.execute("SELECT 1 FROM dirs WHERE host = ? AND path = ?", (self.host, path)).fetchone():
+                return None
+            rows = self._db.execute(
+                "SELECT name, size, mtime, mode FROM entries WHERE host = ? AND dir = ? ORDER BY name",
+                (self.host, path),
+            ).fetchall()
+        attrs = []
+        for name, size, mtime, mode in rows:
+            attr = paramiko.SFTPAttributes()
+            attr.filename, attr.st_size, attr.st_mtime, attr.st_mode = name, size, mtime, mode
+            attrs.append(attr)
+        return attrs
+
+    def store(self, path: str, attrs: Iterable[paramiko.SFTPAttributes], mtime: Optional[int] = None):
+        """Replace the indexed contents of folder ``path``.
+
+        ``mtime`` is the folder's own; None means unknown, and ``refresh``
+        then lists the folder again rather than trusting it. Subfolders that
+        are gone lose their indexed subtrees.
+        """
+        path = _normalize(path)
+        attrs = list(attrs)
+        names = {attr.filename for attr in attrs if stat.S_ISDIR(attr.st_mode or 0)}
+        with self._lock, self._db:
+            old_dirs = [
+                name for (name,) in self._db.execute(
+                    "SELECT name FROM entries WHERE host = ? AND dir = ? AND (mode & ?) = ?",
+                    (self.host, path, _S_IFMT, stat.S_IFDIR),
+                )
+            ]
+            for name in old_dirs:
+                if name not in names:
+                    self._forget(posixpath.join(path, name))
+            self._db.execute("DELETE FROM entries WHERE host = ? AND dir = ?", (self.host, path))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries (host, dir, name, size, mtime, mode) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.host, path, a.filename, a.st_size, a.st_mtime, a.st_mode) for a in attrs],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO dirs (host, path, mtime, listed_at) VALUES (?, ?, ?, ?)",
+                (self.host, path, mtime, time.time()),
+            )
+
+    def forget(self, path: str):
+        """Drop folder ``path`` and everything indexed below it."""
+        with self._lock, self._db:
+            self._forget(_normalize(path))
+
+    def search(
+        self,
+        name: Optional[str] = None,
+        under: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        newer_than: Optional[float] = None,
+        older_than: Optional[float] = None,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+    ) -> List[IndexedEntry]:
+        """Find indexed entries by name glob (case-sensitive), folder, size and mtime bounds.
+
+        Sizes are in bytes and times are epoch seconds. Nothing is asked of the server.
+        """
+        clauses, params = ["host = ?"], [self.host]
+        if name:
+            clauses.append("name GLOB ?")
+            params.append(name)
+        if under:
+            under = _normalize(under)
+            low, high = _subtree(under)
+            clauses.append("(dir = ? OR (dir >= ? AND dir < ?))")
+            params += [under, low, high]
+        for clause, value in (("size >= ?", min_size), ("size <= ?", max_size),
+                              ("mtime >= ?", newer_than), ("mtime <= ?", older_than)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        query = (f"SELECT dir, name, size, mtime, mode FROM entries WHERE {' AND '.join(clauses)} "
+                 "ORDER BY dir, name LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(query, params + [limit]).fetchall()
+        return [IndexedEntry(posixpath.join(d, n), size, mtime, mode) for d, n, size, mtime, mode in rows]
+
+    def refresh(
+        self, remote: "RemoteSFTP", root: str, full: bool = False, on_error: Optional[ErrorCallback] = None
+    ) -> RefreshStats:
+        """Bring the index of ``root`` and everything below it up to date from the server.
+
+        Each level of the tree is handled in parallel over pooled channels.
+        A folder whose mtime matches the index, and was not listed within
+        ``RACY_WINDOW`` of that mtime, keeps its indexed entries; the rest
+        are listed again. Folders found through a fresh listing already
+        carry their current mtime, so only unchanged branches need a stat.
+
+        A folder that cannot be read keeps whatever the index had for it and
+        its subtree is skipped; it is passed to ``on_error``, or reported,
+        and the refresh goes on. A lost connection still raises.
+        """
+        started = time.monotonic()
+        counts = {"listed": 0, "unchanged": 0, "removed": 0, "failed": 0, "entries": 0}
+        counts_lock = threading.Lock()
+
+        def count(key: str, n: int = 1):
+            with counts_lock:
+                counts[key] += n
+
+        def visit(item: Tuple[str, Optional[int]]) -> List[Tuple[str, Optional[int]]]:
+            try:
+                return update(*item)
+            except (ConnectionError, TimeoutError):
+                raise
+            except OSError as e:
+                # metrics.timed has already counted it as a stat or listdir error.
+                count("failed")
+                if on_error:
+                    on_error(item[0], e)
+                else:
+                    print(f"[!] Cannot index {item[0]}: {e}")
+                return []
+
+        def update(path: str, mtime: Optional[int]) -> List[Tuple[str, Optional[int]]]:
+            if mtime is None:
+                try:
+                    with remote.pool.channel() as sftp, remote.metrics.timed("stat"):
+                        mtime = sftp.stat(path).st_mtime
+                except FileNotFoundError:
+                    self.forget(path)
+                    count("removed")
+                    return []
+            known = None if full else self._dir_state(path)
+            if known and known[0] == mtime and known[1] - mtime >= RACY_WINDOW:
+                count("unchanged")
+                return [(child, None) for child in self._subdirs(path)]
+            try:
+                with remote.pool.channel() as sftp, remote.metrics.timed("listdir"):
+                    attrs = [attr for page in iter_dir_pages(sftp, path) for attr in page]
+            except FileNotFoundError:
+                self.forget(path)
+                count("removed")
+                return []
+            self.store(path, attrs, mtime)
+            count("listed")
+            count("entries", len(attrs))
+            return [
+                (posixpath.join(path, attr.filename), attr.st_mtime)
+                for attr in attrs if stat.S_ISDIR(attr.st_mode or 0)
+            ]
+
+        level: List[Tuple[str, Optional[int]]] = [(_normalize(root), None)]
+        with ThreadPoolExecutor(max_workers=remote.pool.size, thread_name_prefix="sftp-index") as executor:
+            while level:
+                level = [child for children in executor.map(visit, level) for child in children]
+        return RefreshStats(counts["listed"], counts["unchanged"], counts["removed"], counts["failed"],
+                            counts["entries"], time.monotonic() - started)
+
+    def _dir_state(self, path: str) -> Optional[Tuple[Optional[int], float]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT mtime, listed_at FROM dirs WHERE host = ? AND path = ?", (self.host, path)
+            ).fetchone()
+
+    def _subdirs(self, path: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name FROM entries WHERE host = ? AND dir = ? AND (mode & ?) = ?",
+                (self.host, path, _S_IFMT, stat.S_IFDIR),
+            ).fetchall()
+        return [posixpath.join(path, name) for (name,) in rows]
+
+    def _forget(self, path: str):
+        low, high = _subtree(path)
+        for table, column in (("dirs", "path"), ("entries", "dir")):
+            self._db.execute(
+                f"DELETE FROM {table} WHERE host = ? AND ({column} = ? OR ({column} >= ? AND {column} < ?))",
+                (self.host, path, low, high),
+            )
+
+
+def _normalize(path: str) -> str:
+    return posixpath.normpath(path) if path not in ("", "/") else "/"
@@ -1,16 +1,171 @@
 import paramiko
 import os
 import posixpath
-from typing import List, Tuple, Optional
+import stat
+import itertools
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar, Optional
+
+
+from transfer import (
+    ChunkedTransfer,
+    TransferCancelled,
+    ProgressCallback,
+    DEFAULT_CHANNELS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_QUEUE_DEPTH,
+    DEFAULT_REQUEST_SIZE,
+)
+from ciphers import (
+    ALGORITHM_MODES,
+    ALGORITHMS_DEFAULT,
+    ALGORITHMS_FASTEST,
+    DEFAULT_RANKING_CACHE,
+    AlgorithmPreference,
+    cached_ranking,
+    preferred_order,
+    transport_factory,
+)
+from crawler import DEFAULT_CRAWL_WORKERS, ErrorCallback, TreeCrawler, iter_dir_pages
+from checkpoint import TransferCheckpoint, digest_prefix, hash_ranges
+from compression import COMPRESSION_AUTO, COMPRESSION_MODES, COMPRESSION_OFF, COMPRESSION_ON, CompressionDecision, decide
+from delta import DeltaUpload, DEFAULT_BLOCK_SIZE
+from integrity import StreamHasher, TransferResult, remote_digest, DEFAULT_ALGORITHM
+from host_keys import host_entry_name, known_hosts
+from remote_index import RefreshStats, RemoteIndex
+from dir_cache import DirectoryCache, DEFAULT_LISTING_ENTRIES, DEFAULT_LISTING_TTL
+from file_model import FileEntry
+from metrics import CANCELLED, FAILED, OK, Metrics, TransferProgress
+from sftp_pool import (
+    SFTPChannelPool,
+    DEFAULT_HEALTH_CHECK_AFTER,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+)
+
+DEFAULT_KEEPALIVE_INTERVAL = 30
+DEFAULT_LIVENESS_TIMEOUT = 10.0
+DEFAULT_RECONNECT_ATTEMPTS = 3
+DEFAULT_RECONNECT_BACKOFF = 1.0
+# Errors that mean the connection itself failed rather than the operation. EOFError is
+# left out: SFTP also raises it for end of file, so it only counts once a probe fails.
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, paramiko.SSHException)
+
+T = TypeVar("T")
+
+
+class HostKeyNotTrusted(paramiko.SSHException):
+    """Raised during the handshake when the user declines an unknown host key."""
+
+
+class _AskTrustPolicy(paramiko.MissingHostKeyPolicy):
+    """Ask about an unknown host key as soon as key exchange reveals it, before any credentials are sent.
+
+    Accepting lets the same transport go on to authenticate.
+    """
+
+    def __init__(self, decide: Callable[[paramiko.PKey], bool]):
+        self.decide = decide
+
+    def missing_host_key(self, client: paramiko.SSHClient, hostname: str, key: paramiko.PKey):
+        if not self.decide(key):
+            raise HostKeyNotTrusted(f"Host key for {hostname} was not trusted")
 
 
 class RemoteSFTP:
-    def __init__(self, known_hosts_path: str = os.path.expanduser("~/.ssh/known_hosts")):
+    def __init__(
+        self,
+        known_hosts_path: str = os.path.expanduser("~/.ssh/known_hosts"),
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        request_size: int = DEFAULT_REQUEST_SIZE,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        transfer_channels: int = DEFAULT_CHANNELS,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_transports: int = 1,
+        pool_idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        pool_health_check_after: float = DEFAULT_HEALTH_CHECK_AFTER,
+        listing_ttl: float = DEFAULT_LISTING_TTL,
+        listing_cache_size: int = DEFAULT_LISTING_ENTRIES,
+        delta_block_size: int = DEFAULT_BLOCK_SIZE,
+        digest_algorithm: str = DEFAULT_ALGORITHM,
+        compression: str = COMPRESSION_OFF,
+        algorithms: str = ALGORITHMS_DEFAULT,
+        algorithm_overrides: Optional[Dict[str, AlgorithmPreference]] = None,
+        ranking_cache: str = DEFAULT_RANKING_CACHE,
+        keepalive_interval: int = DEFAULT_KEEPALIVE_INTERVAL,
+        reconnect_attempts: int = DEFAULT_RECONNECT_ATTEMPTS,
+        reconnect_backoff: float = DEFAULT_RECONNECT_BACKOFF,
+        index_path: Optional[str] = None,
+    ):
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown compression mode: {compression}")
+        if algorithms not in ALGORITHM_MODES:
+            raise ValueError(f"Unknown algorithm selection: {algorithms}")
         self.ssh: Optional[paramiko.SSHClient] = None
         self.sftp: Optional[paramiko.SFTPClient] = None
+        self.pool: Optional[SFTPChannelPool] = None
+        self.pool_size = pool_size
+        self.pool_transports = pool_transports
+        self.pool_idle_timeout = pool_idle_timeout
+        self.pool_health_check_after = pool_health_check_after
         self.current_path = "/"
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self.listings: DirectoryCache[List[paramiko.SFTPAttributes]] = DirectoryCache(
+            listing_ttl, listing_cache_size
+        )
         self.known_hosts_path = known_hosts_path
+        # With index_path set, listings are also kept in an on-disk SQLite index per user@host:port.
+        self.index_path = index_path
+        self.index: Optional[RemoteIndex] = None
+        # Seconds between keepalives on every transport; a connection idle this long is probed before use.
+        self.keepalive_interval = keepalive_interval
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_backoff = reconnect_backoff
+        # What connect() was given, kept so a dropped connection can be re-established; cleared on disconnect.
+        self._credentials: Optional[Tuple[str, int, str, Optional[str], Optional[str]]] = None
+        self._generation = 0
+        self._last_activity = 0.0
+        self._reconnect_lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        # "off", "on" (every transfer compressed) or "auto" (chosen per file by sampling it).
+        self.compression = compression
+        self.compressed_ssh: Optional[paramiko.SSHClient] = None
+        self.compressed_pool: Optional[SFTPChannelPool] = None
+        self._compressed_lock = threading.Lock()
+        self._client_factory: Optional[Callable[[bool], paramiko.SSHClient]] = None
+        # "default" keeps paramiko's cipher order; "fastest" offers the approved ciphers and MACs
+        # fastest-first as benchmarked on this machine. Overrides are keyed by "host:port" or "host".
+        self.algorithms = algorithms
+        self.algorithm_overrides: Dict[str, AlgorithmPreference] = dict(algorithm_overrides or {})
+        self.ranking_cache = ranking_cache
+        self._algorithm_orders: Dict[Tuple[str, int], Optional[Tuple[Tuple[str, ...], Tuple[str, ...]]]] = {}
+        self.digest_algorithm = digest_algorithm
         self.ask_trust_callback: Optional[Callable[[str, str], bool]] = None
+        # Called with (filename, offset, total) when a verified partial file can be resumed.
+        self.ask_resume_callback: Optional[Callable[[str, int, int], bool]] = None
+        # Latency histograms and counters for everything this connection does; see metrics.Metrics.
+        self.metrics = Metrics()
+        self.transfer = ChunkedTransfer(
+            self._open_channel,
+            chunk_size=chunk_size,
+            request_size=request_size,
+            queue_depth=queue_depth,
+            channels=transfer_channels,
+            metrics=self.metrics,
+        )
+        # Same engine settings over the compressed transport that "auto" mode opens on demand.
+        self.compressed_transfer = ChunkedTransfer(
+            self._open_compressed_channel,
+            chunk_size=chunk_size,
+            request_size=request_size,
+            queue_depth=queue_depth,
+            channels=transfer_channels,
+            metrics=self.metrics,
+        )
+        self.delta = DeltaUpload(self.transfer, self._open_channel, self.open_exec, block_size=delta_block_size)
 
     def connect(
         self,
@@ -22,49 +177,31 @@ class RemoteSFTP:
     ) -> bool:
         """Connect securely to an SFTP server with host key verification and optional user trust."""
         try:
-            self.ssh = paramiko.SSHClient()
-
-            # Load known_hosts file if exists
-            if os.path.exists(self.known_hosts_path):
-                self.ssh.load_host_keys(self.known_hosts_path)
-            else:
+            if not os.path.exists(self.known_hosts_path):
                 print(f"[!] No known_hosts file found at {self.known_hosts_path}")
 
-            # Reject unknown host keys by default
-            self.ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
-
-            # Attempt secure SSH connection
-            self.ssh.connect(
-                hostname=host,
-                port=port,
-                username=username,
-                password=password,
-                key_filename=key_filename,
-                timeout=10,
-                look_for_keys=False,
-                allow_agent=False
-            )
-
-            self.sftp = self.ssh.open_sftp()
+            self._establish(host, port, username, password, key_filename,
+                            trust=_AskTrustPolicy(lambda key: self._trust_new_host(host, port, key)))
+            self._credentials = (host, port, username, password, key_filename)
             self.current_path = "/"
+            self.host, self.port = host, port
+            self._open_index(username, host, port)
             print(f"[+] Connected securely to {host}:{port} as {username}")
+            if self._algorithm_order(host, port):
+                transport = self.ssh.get_transport()
+                # GCM authenticates on its own; the negotiated MAC goes unused.
+                mac = "" if "-gcm@" in transport.local_cipher else f" with {transport.local_mac}"
+                print(f"[*] Using {transport.local_cipher}{mac}")
             return True
 
         except paramiko.ssh_exception.BadHostKeyException:
             print("[!] Host key mismatch — possible MITM attack.")
         except paramiko.ssh_exception.AuthenticationException:
             print("[!] Authentication failed — check username, password, or SSH key.")
+        except HostKeyNotTrusted:
+            print("[!] Connection aborted.")
         except paramiko.ssh_exception.SSHException as e:
-            if "not found in known_hosts" in str(e).lower() or "unknown server" in str(e).lower():
-                print(f"[?] Unknown host: {host}")
-                if self._attempt_trust_prompt(host, port, username, password, key_filename):
-                    return self.connect(host, port, username, password, key_filename)
-                else:
-                    print("[!] Connection aborted.")
-                    self.disconnect()
-                    return False
-            else:
-                print(f"[!] SSH error: {e}")
+            print(f"[!] SSH error: {e}")
         except Exception as e:
             print(f"[!] Connection failed: {e}")
 
@@ -72,14 +209,165 @@ class RemoteSFTP:
         self.disconnect()
         return False
 
-    def _attempt_trust_prompt(
-            self, host: str, port: int, username: str, password: Optional[str], key_filename: Optional[str]
-    ) -> bool:
-        """Prompt user to trust unknown host key, using GUI if callback is set."""
-        temp_client = paramiko.SSHClient()
-        temp_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    def _establish(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: Optional[str],
+        key_filename: Optional[str],
+        trust: Optional[paramiko.MissingHostKeyPolicy] = None,
+    ):
+        """Open the main client, its channel pool and, in "auto" mode, the compressed client factory.
+
+        ``trust`` decides about an unknown host key on the main client only;
+        by the time any other connection is made the key is in known_hosts.
+        """
+        compress = self.compression == COMPRESSION_ON
+        self.ssh = self._open_client(host, port, username, password, key_filename, compress, trust)
+        self.sftp = self.ssh.open_sftp()
+        self.pool = SFTPChannelPool(
+            self.ssh.get_transport(),
+            size=self.pool_size,
+            transports=self.pool_transports,
+            client_factory=(
+                (lambda: self._open_client(host, port, username, password, key_filename, compress))
+                if self.pool_transports > 1 else None
+            ),
+            window_size=self.transfer.window_size,
+            idle_timeout=self.pool_idle_timeout,
+            health_check_after=self.pool_health_check_after,
+        )
+        if self.compression == COMPRESSION_AUTO:
+            self._client_factory = lambda c: self._open_client(host, port, username, password, key_filename, c)
+        self._generation += 1
+        self._last_activity = time.monotonic()
+
+    def reconnect(self, generation: Optional[int] = None) -> bool:
+        """Connect again with the cached credentials, through the same known_hosts checks.
+
+        ``generation`` is the connection a caller saw fail; if another thread
+        has already replaced it, this returns True without reconnecting.
+        Gives up after ``reconnect_attempts`` tries with exponential backoff,
+        or at once if the host key or the credentials are rejected.
+        """
+        with self._reconnect_lock:
+            if self._credentials is None:
+                return False
+            if generation is not None and generation != self._generation and self.is_connected():
+                return True
+            host, port = self._credentials[:2]
+            for attempt in range(self.reconnect_attempts):
+                self._close_connections()
+                try:
+                    self._establish(*self._credentials)
+                    print(f"[+] Reconnected to {host}:{port}")
+                    return True
+                except paramiko.ssh_exception.BadHostKeyException:
+                    print("[!] Host key mismatch on reconnect — possible MITM attack.")
+                    break
+                except paramiko.ssh_exception.AuthenticationException:
+                    print("[!] Authentication failed on reconnect.")
+                    break
+                except Exception as e:
+                    print(f"[!] Reconnect attempt {attempt + 1} of {self.reconnect_attempts} failed: {e}")
+                    if attempt + 1 < self.reconnect_attempts:
+                        time.sleep(self.reconnect_backoff * 2 ** attempt)
+            self._close_connections()
+            return False
+
+    def check_alive(self, timeout: float = DEFAULT_LIVENESS_TIMEOUT) -> bool:
+        """Round-trip a cheap request on the main channel; False if it is not answered within ``timeout``.
+
+        A NAT that dropped the session leaves the transport looking active, so
+        only an answered request proves the connection still works.
+        """
+        if not self.is_connected():
+            return False
+        with self._probe_lock:
+            sftp = self.sftp
+            if sftp is None:
+                return False
+            channel = sftp.get_channel()
+            try:
+                channel.settimeout(timeout)
+                sftp.normalize(".")
+            except Exception:
+                # A late reply would now be read by the wrong request; the channel goes with the reconnect.
+                return False
+            finally:
+                channel.settimeout(None)
+            self._last_activity = time.monotonic()
+            return True
+
+    def retry(self, fn: Callable[[], T]) -> T:
+        """Run ``fn``, reconnecting and running it again if the connection drops under it.
+
+        Only for work that is safe to repeat, such as listings and whole-file copies.
+        """
+        for attempt in itertools.count():
+            self._ensure_alive()
+            generation = self._generation
+            try:
+                result = fn()
+            except Exception as e:
+                if not self._recover(e, generation, attempt):
+                    raise
+                print(f"[*] Connection was lost ({e or type(e).__name__}); retrying")
+                continue
+            self._last_activity = time.monotonic()
+            return result
+
+    def _ensure_alive(self):
+        """Probe a connection that has been idle past ``keepalive_interval`` and replace it if it is dead."""
+        if self._credentials is None or not self.keepalive_interval:
+            return
+        if time.monotonic() - self._last_activity < self.keepalive_interval:
+            return
+        generation = self._generation
+        if not self.check_alive():
+            print("[*] Connection is not responding; reconnecting")
+            self.reconnect(generation)
+
+    def _recover(self, error: Exception, generation: int, attempt: int) -> bool:
+        """Reconnect after ``error`` if it was the connection failing. True when the work should be retried."""
+        if attempt >= self.reconnect_attempts or self._credentials is None:
+            return False
+        if isinstance(error, CONNECTION_ERRORS) or not self._transport_active():
+            return self.reconnect(generation)
+        if isinstance(error, EOFError) and not self.check_alive():
+            return self.reconnect(generation)
+        return False
+
+    def _transport_active(self) -> bool:
+        transport = self.ssh.get_transport() if self.ssh else None
+        return transport is not None and transport.is_active()
+
+    def _open_client(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: Optional[str],
+        key_filename: Optional[str],
+        compress: bool = False,
+        trust: Optional[paramiko.MissingHostKeyPolicy] = None,
+    ) -> paramiko.SSHClient:
+        """Open an authenticated SSH client that rejects unknown host keys unless ``trust`` accepts them."""
+        client = paramiko.SSHClient()
+        order = self._algorithm_order(host, port)
+
+        # Only this host's keys, from the shared index, instead of parsing all of known_hosts
+        name = host_entry_name(host, port)
+        for key in known_hosts(self.known_hosts_path).lookup(host, port):
+            client.get_host_keys().add(name, key.get_name(), key)
+
+        # Reject unknown host keys by default
+        client.set_missing_host_key_policy(trust or paramiko.RejectPolicy())
+
         try:
-            temp_client.connect(
+            # Attempt secure SSH connection
+            client.connect(
                 hostname=host,
                 port=port,
                 username=username,
@@ -87,137 +375,638 @@ class RemoteSFTP:
                 key_filename=key_filename,
                 timeout=10,
                 look_for_keys=False,
-                allow_agent=False
+                allow_agent=False,
+                compress=compress,
+                transport_factory=transport_factory(*order) if order else None,
             )
+        except Exception:
+            client.close()
+            raise
+        if self.keepalive_interval:
+            client.get_transport().set_keepalive(self.keepalive_interval)
+        return client
 
-            key = temp_client.get_transport().get_remote_server_key()
-            fingerprint = ":".join(f"{b:02x}" for b in key.get_fingerprint())
+    def _algorithm_order(self, host: str, port: int) -> Optional[Tuple[Tuple[str, ...], Tuple[str, ...]]]:
+        """The (ciphers, macs) to offer this host, or None to leave paramiko's defaults alone."""
+        if (host, port) in self._algorithm_orders:
+            return self._algorithm_orders[(host, port)]
+        override = self.algorithm_overrides.get(f"{host}:{port}") or self.algorithm_overrides.get(host)
+        order = None
+        if self.algorithms == ALGORITHMS_FASTEST or override:
+            ranking = cached_ranking(self.ranking_cache) if self.algorithms == ALGORITHMS_FASTEST else None
+            order = preferred_order(ranking, override)
+        self._algorithm_orders[(host, port)] = order
+        return order
 
-            if self.ask_trust_callback:
-                decision = self.ask_trust_callback(host, fingerprint)
-            else:
-                decision = input(f"Trust this server and add to known_hosts? (yes/no): ").strip().lower().startswith(
-                    "y")
+    def _trust_new_host(self, host: str, port: int, key: paramiko.PKey) -> bool:
+        """Ask the user, through the GUI if a callback is set, whether to trust an unknown host key."""
+        print(f"[?] Unknown host: {host}")
+        fingerprint = ":".join(f"{b:02x}" for b in key.get_fingerprint())
+        if self.ask_trust_callback:
+            decision = self.ask_trust_callback(host, fingerprint)
+        else:
+            decision = input(f"Trust this server and add to known_hosts? (yes/no): ").strip().lower().startswith("y")
+        if decision:
+            self._save_known_host_entry(host, port, key)
+        return decision
 
-            if decision:
-                self._save_known_host_entry(host, key)
-                return True
-            return False
-
-        except Exception as e:
-            print(f"[!] Could not verify host key: {e}")
-            return False
-        finally:
-            temp_client.close()
-    def _save_known_host_entry(self, host: str, key: paramiko.PKey):
-        """Write the host key to known_hosts in OpenSSH format."""
+    def _save_known_host_entry(self, host: str, port: int, key: paramiko.PKey):
+        """Record the host key in known_hosts in OpenSSH format, as ``[host]:port`` off port 22."""
         try:
-            os.makedirs(os.path.dirname(self.known_hosts_path), exist_ok=True)
-            with open(self.known_hosts_path, "a", encoding="utf-8") as f:
-                entry = f"{host} {key.get_name()} {key.get_base64()}\n"
-                f.write(entry)
+            known_hosts(self.known_hosts_path).add(host, port, key)
         except Exception as e:
-            print(f"[!] Failed to write known_hosts entry: {e}")
+            print(f"[!] Failed to write known_hosts entry: {e}; the key is trusted until this program exits")
 
     def disconnect(self):
-        """Close the SFTP and SSH connections cleanly."""
+        """Close the SFTP and SSH connections cleanly and forget the cached credentials."""
+        self._credentials = None
+        self._close_connections()
+        self.current_path = "/"
+        self.listings.clear()
+        if self.index:
+            self.index.close()
+            self.index = None
+
+    def _open_index(self, username: str, host: str, port: int):
+        if not self.index_path or self.index:
+            return
         try:
+            self.index = RemoteIndex(f"{username}@{host}:{port}", self.index_path)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[!] Cannot open the listing index at {self.index_path}: {e}")
+
+    def refresh_index(
+        self, root: Optional[str] = None, full: bool = False, on_error: Optional[ErrorCallback] = None
+    ) -> RefreshStats:
+        """Bring the on-disk index of ``root`` up to date, listing only folders that changed.
+
+        Folders that cannot be read go to ``on_error`` and are skipped; see ``RemoteIndex.refresh``.
+        """
+        if not self.index:
+            raise ValueError("No listing index; pass index_path")
+        root = self._remote_path(root or self.current_path)
+        return self.retry(lambda: self.index.refresh(self, root, full, on_error))
+
+    def _close_connections(self):
+        try:
+            if self.compressed_pool:
+                self.compressed_pool.close()
+            if self.compressed_ssh:
+                self.compressed_ssh.close()
+            if self.pool:
+                self.pool.close()
             if self.sftp:
                 self.sftp.close()
             if self.ssh:
                 self.ssh.close()
         finally:
-            self.ssh = self.sftp = None
-            self.current_path = "/"
+            self.ssh = self.sftp = self.pool = None
+            self.compressed_ssh = self.compressed_pool = None
+            self._client_factory = None
+
+    def has_session(self) -> bool:
+        """True from a successful connect until disconnect, even while a dropped connection is being replaced."""
+        return self._credentials is not None
 
     def is_connected(self) -> bool:
-        return self.sftp is not None
+        """True while the transport is up. A silently dropped session needs ``check_alive`` to be noticed."""
+        return self.sftp is not None and self._transport_active()
+
+    def _open_channel(self):
+        """Check out a pooled SFTP channel for one worker."""
+        if not self.pool:
+            raise paramiko.SSHException("Not connected")
+        return self.pool.channel()
+
+    def _open_compressed_channel(self):
+        """Check out a pooled SFTP channel on the compressed transport."""
+        if not self.compressed_pool:
+            raise paramiko.SSHException("Compressed transport not connected")
+        return self.compressed_pool.channel()
+
+    def _compressed_pool_ready(self) -> bool:
+        """Connect the compressed transport on first use; False if it cannot be had."""
+        with self._compressed_lock:
+            if self.compressed_pool:
+                return True
+            if not self._client_factory:
+                return False
+            try:
+                client = self._client_factory(True)
+            except (paramiko.SSHException, OSError) as e:
+                print(f"[!] Compressed transport unavailable ({e}); sending uncompressed")
+                self._client_factory = None
+                return False
+            if client.get_transport().local_compression == "none":
+                print("[*] Server does not offer compression; sending uncompressed")
+                client.close()
+                self._client_factory = None
+                return False
+            self.compressed_ssh = client
+            self.compressed_pool = SFTPChannelPool(
+                client.get_transport(),
+                size=self.pool_size,
+                window_size=self.transfer.window_size,
+                idle_timeout=self.pool_idle_timeout,
+                health_check_after=self.pool_health_check_after,
+            )
+            return True
+
+    def _engine_for(
+        self, name: str, size: int, read_sample: Callable[[int], bytes]
+    ) -> Tuple[ChunkedTransfer, CompressionDecision]:
+        """Pick the transport for one file. In "auto" mode a sample of the file decides."""
+        if self.compression != COMPRESSION_AUTO:
+            negotiated = self.ssh.get_transport().local_compression != "none"
+            return self.transfer, CompressionDecision(self.compression == COMPRESSION_ON and negotiated)
+        decision = decide(self.compression, size, read_sample)
+        if decision.compress and not self._compressed_pool_ready():
+            decision = decision._replace(compress=False)
+        if decision.ratio is not None:
+            print(f"[*] {name}: sending {decision.describe()}")
+        return (self.compressed_transfer if decision.compress else self.transfer), decision
+
+    def _read_remote_sample(self, remote_path: str, offset: int, length: int) -> bytes:
+        with self.pool.channel() as sftp:
+            with sftp.open(remote_path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+    def open_exec(self, command: str) -> paramiko.Channel:
+        """Start ``command`` on the server over a fresh exec channel of the main transport."""
+        if not self.ssh:
+            raise paramiko.SSHException("Not connected")
+        channel = self.ssh.get_transport().open_session(timeout=10)
+        channel.exec_command(command)
+        return channel
+
+    def _remote_path(self, filename: str) -> str:
+        """Resolve a name against the current directory; absolute paths are kept as they are."""
+        return posixpath.join(self.current_path, filename)
+
+    def listdir_attr(self, path: Optional[str] = None, refresh: bool = False) -> List[paramiko.SFTPAttributes]:
+        """Return the attributes of every entry in a remote directory, served from cache when fresh."""
+        path = path or self.current_path
+        entries = None if refresh else self.listings.get(path)
+        if entries is None:
+            def fetch() -> List[paramiko.SFTPAttributes]:
+                with self.pool.channel() as sftp, self.metrics.timed("listdir"):
+                    return sftp.listdir_attr(path)
+
+            entries = self.retry(fetch)
+            self.listings.put(path, entries)
+            self._index_listing(path, entries)
+        return entries
+
+    def indexed_listing(self, path: Optional[str] = None) -> Optional[List[paramiko.SFTPAttributes]]:
+        """The listing of a directory as the index last saw it, without asking the server.
+
+        None if there is no index or the directory was never listed into it.
+        """
+        if not self.index:
+            return None
+        try:
+            return self.index.listing(self._remote_path(path or self.current_path))
+        except sqlite3.Error as e:
+            print(f"[!] Cannot read the listing index: {e}")
+            return None
+
+    def _index_listing(self, path: str, entries: List[paramiko.SFTPAttributes]):
+        # The folder's own mtime is not known here, so a refresh still lists it once.
+        if self.index:
+            try:
+                self.index.store(self._remote_path(path), entries)
+            except sqlite3.Error as e:
+                print(f"[!] Cannot update the listing index: {e}")
+
+    def iter_dir(
+        self, path: Optional[str] = None, refresh: bool = False, cancel: Optional[threading.Event] = None
+    ) -> Iterator[List[paramiko.SFTPAttributes]]:
+        """Yield a remote directory in pages as the server sends them.
+
+        A fresh cached listing comes back as one page. Otherwise the pages
+        are streamed over a pooled channel and, if the listing ran to the
+        end, the result is cached for ``listdir_attr``. A listing that loses
+        its connection before the first page is retried after reconnecting.
+        """
+        path = path or self.current_path
+        entries = None if refresh else self.listings.get(path)
+        if entries is not None:
+            yield entries
+            return
+        for attempt in itertools.count():
+            self._ensure_alive()
+            generation = self._generation
+            entries = []
+            started = time.monotonic()
+            try:
+                with self.pool.channel() as sftp:
+                    for page in iter_dir_pages(sftp, path, cancel=cancel):
+                        entries.extend(page)
+                        yield page
+            except Exception as e:
+                # Pages already handed out cannot be taken back, so only a listing that has not started is retried.
+                if entries or not self._recover(e, generation, attempt):
+                    self.metrics.error("listdir", e)
+                    raise
+                print(f"[*] Connection was lost listing {path}; retrying")
+                continue
+            break
+        self._last_activity = time.monotonic()
+        if not (cancel and cancel.is_set()):
+            self.metrics.observe("listdir", time.monotonic() - started)
+            self.listings.put(path, entries)
+            self._index_listing(path, entries)
+
+    def list_dir(self, path: Optional[str] = None) -> Tuple[List[FileEntry], List[FileEntry]]:
+        """Return (folders, files) of a remote directory from a single listing, unsorted."""
+        path = path or self.current_path
+        folders, files = self.to_entries(self.listdir_attr(path))
+        if path != "/":
+            folders.insert(0, FileEntry("..", 0, 0.0, True))
+        return folders, files
+
+    @staticmethod
+    def to_entries(attrs: Iterable[paramiko.SFTPAttributes]) -> Tuple[List[FileEntry], List[FileEntry]]:
+        """Split listing attributes into (folders, files) entries, leaving out hidden names."""
+        folders: List[FileEntry] = []
+        files: List[FileEntry] = []
+        for attr in attrs:
+            if attr.filename.startswith('.'):
+                continue
+            if (attr.st_mode or 0) & 0o040000:
+                folders.append(FileEntry(attr.filename, 0, attr.st_mtime or 0, True))
+            else:
+                files.append(FileEntry(attr.filename, attr.st_size or 0, attr.st_mtime or 0, False))
+        return folders, files
+
+    def crawl(
+        self,
+        root: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+        workers: int = DEFAULT_CRAWL_WORKERS,
+        on_error: Optional[ErrorCallback] = None,
+    ) -> Iterator[Tuple[str, paramiko.SFTPAttributes]]:
+        """Stream (remote path, attrs) for everything below root, many directories at a time.
+
+        See ``crawler.TreeCrawler`` for depth, glob and error handling. The listing cache is bypassed.
+        """
+        crawler = TreeCrawler(self, workers=workers, max_depth=max_depth, include=tuple(include),
+                              exclude=tuple(exclude), on_error=on_error)
+        return crawler.crawl(root or self.current_path)
+
+    def walk(
+        self, root: Optional[str] = None, on_error: Optional[ErrorCallback] = None
+    ) -> Iterator[Tuple[str, paramiko.SFTPAttributes]]:
+        """Yield (relative path, attrs) for every entry below root, parents before children.
+
+        Runs on ``crawl``, so many directories are listed at once over pooled
+        channels, and any directory that cannot be listed raises, or goes to
+        ``on_error`` if one is given. Symlinks are skipped.
+        """
+        root = root or self.current_path
+        prefix = root.rstrip("/") + "/"
+        for path, attr in self.crawl(root, on_error=on_error):
+            if not stat.S_ISLNK(attr.st_mode or 0):
+                yield path[len(prefix):], attr
 
     def get_folders(self) -> List[str]:
         """Return list of folders in the current remote directory."""
         if not self.sftp:
             return []
-        folders = []
         try:
-            if self.current_path != "/":
-                folders.append("..")
-            entries = self.sftp.listdir_attr(self.current_path)
-            for attr in entries:
-                if (attr.st_mode & 0o040000) and not attr.filename.startswith('.'):
-                    folders.append(attr.filename)
-            folders.sort(key=str.lower)
+            folders = self.list_dir()[0]
+            names = sorted((f.name for f in folders if f.name != ".."), key=str.lower)
+            return ([".."] if len(names) < len(folders) else []) + names
         except Exception as e:
             print(f"[!] Error listing folders: {e}")
-        return folders
+            return []
 
     def get_files(self) -> List[Tuple[str, int]]:
         """Return list of (filename, size) tuples in the current directory."""
         if not self.sftp:
             return []
-        files = []
         try:
-            entries = self.sftp.listdir_attr(self.current_path)
-            for attr in entries:
-                if not (attr.st_mode & 0o040000) and not attr.filename.startswith('.'):
-                    files.append((attr.filename, attr.st_size))
-            files.sort(key=lambda x: x[0].lower())
+            return sorted(((f.name, f.size) for f in self.list_dir()[1]), key=lambda x: x[0].lower())
         except Exception as e:
             print(f"[!] Error listing files: {e}")
-        return files
+            return []
+
+    def resolve_folder(self, folder_name: str) -> Optional[str]:
+        """Return the path a folder name leads to from the current directory, or None above the root."""
+        folder_name = folder_name.strip()
+        if folder_name == "..":
+            if self.current_path == "/":
+                return None
+            parts = self.current_path.rstrip("/").split("/")
+            return "/".join(parts[:-1]) or "/"
+        return posixpath.normpath(posixpath.join(self.current_path, folder_name))
 
     def navigate_to(self, folder_name: str) -> bool:
         """Navigate securely to another directory."""
         try:
-            folder_name = folder_name.strip()
-            if folder_name == "..":
-                if self.current_path == "/":
-                    return False
-                parts = self.current_path.rstrip("/").split("/")
-                new_path = "/".join(parts[:-1]) or "/"
-            else:
-                new_path = posixpath.normpath(f"{self.current_path}/{folder_name}")
+            new_path = self.resolve_folder(folder_name)
+            if new_path is None:
+                return False
 
-            self.sftp.listdir(new_path)
+            # Listing validates the path and primes the cache for the refresh that follows.
+            self.listdir_attr(new_path)
             self.current_path = new_path
             return True
         except Exception as e:
             print(f"[!] Cannot navigate to {folder_name}: {e}")
             return False
 
-    def upload_file(self, local_path: str, remote_filename: str) -> bool:
-        """Upload a file with basic integrity check."""
+    def make_dir(self, folder_name: str) -> bool:
+        """Create a folder in the current remote directory."""
         if not self.sftp:
             return False
         try:
-            remote_path = f"{self.current_path.rstrip('/')}/{remote_filename}"
-            self.sftp.put(local_path, remote_path)
-
-            remote_stat = self.sftp.stat(remote_path)
-            if os.path.getsize(local_path) != remote_stat.st_size:
-                print("[!] Upload verification failed: file sizes differ.")
-                return False
-
-            print(f"[+] Uploaded {remote_filename}")
+            with self.pool.channel() as sftp:
+                sftp.mkdir(self._remote_path(folder_name))
+            self.listings.invalidate(self.current_path)
+            print(f"[+] Created folder {folder_name}")
             return True
         except Exception as e:
-            print(f"[!] Upload failed: {e}")
+            print(f"[!] Cannot create folder {folder_name}: {e}")
             return False
 
-    def download_file(self, remote_filename: str, local_path: str) -> bool:
-        """Download a file with basic integrity check."""
-        if not self.sftp:
-            return False
+    def upload_file(
+        self,
+        local_path: str,
+        remote_filename: str,
+        progress: Optional[ProgressCallback] = None,
+        resume: bool = True,
+        cancel: Optional[threading.Event] = None,
+    ) -> TransferResult:
+        """Upload a file over parallel pipelined channels, resuming a verified partial upload.
+
+        The file is hashed as it is sent and checked against a digest computed by the server.
+        Setting ``cancel`` stops the transfer and keeps its checkpoint so it can be resumed later.
+        If the connection drops, it is re-established and the upload continues from its checkpoint.
+        The result carries a ``ProgressSnapshot`` with the rates and time to first byte.
+        """
+        if not self.sftp and not self.reconnect():
+            return TransferResult(False, error="Not connected")
+        meter, progress = self._metered(progress)
+        remote_path = self._remote_path(remote_filename)
+        confirm = True
         try:
-            remote_path = f"{self.current_path.rstrip('/')}/{remote_filename}"
-            self.sftp.get(remote_path, local_path)
+            for attempt in itertools.count():
+                self._ensure_alive()
+                generation = self._generation
+                checkpoint = None
+                try:
+                    st = os.stat(local_path)
+                    checkpoint = self._checkpoint_for("upload", local_path, remote_path, st, resume, confirm)
+                    hasher = StreamHasher(self.digest_algorithm)
+                    if checkpoint.offset:
+                        hasher.feed_file(local_path, checkpoint.offset)
+                    engine, compression = self._engine_for(
+                        remote_filename, st.st_size - checkpoint.offset,
+                        lambda n: _read_local_sample(local_path, checkpoint.offset, n),
+                    )
+                    size = engine.upload(
+                        local_path, remote_path, offset=checkpoint.offset, progress=progress, cancel=cancel,
+                        on_commit=checkpoint.commit, hasher=hasher,
+                    )
 
-            remote_stat = self.sftp.stat(remote_path)
-            if os.path.getsize(local_path) != remote_stat.st_size:
-                print("[!] Download verification failed: file sizes differ.")
-                return False
+                    result = self._verify(remote_path, size, hasher.hexdigest(size), compression)
+                    if not result:
+                        print(f"[!] Upload verification failed: {result.error}.")
+                        return self._finished("upload", result, meter)
 
-            print(f"[+] Downloaded {remote_filename}")
-            return True
+                    checkpoint.remove()
+                    print(f"[+] Uploaded {remote_filename}")
+                    return self._finished("upload", result, meter)
+                except TransferCancelled:
+                    checkpoint.flush()
+                    print(f"[*] Upload of {remote_filename} stopped at byte {checkpoint.committed}")
+                    return self._finished("upload", TransferResult(False, error="cancelled"), meter, CANCELLED)
+                except Exception as e:
+                    if checkpoint:
+                        checkpoint.flush()
+                    if self._recover(e, generation, attempt):
+                        print(f"[*] Connection was lost; resuming upload of {remote_filename} "
+                              f"from byte {checkpoint.committed if checkpoint else 0}")
+                        # Our own checkpoint, so no need to ask before picking it up.
+                        resume, confirm = True, False
+                        continue
+                    print(f"[!] Upload failed: {e}")
+                    self.metrics.error("upload", e)
+                    return self._finished("upload", TransferResult(False, error=str(e)), meter)
+        finally:
+            # Even a failed upload may have created or grown the remote file.
+            self.listings.invalidate(posixpath.dirname(remote_path))
+
+    def upload_delta(
+        self,
+        local_path: str,
+        remote_filename: str,
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> TransferResult:
+        """Update an existing remote file by sending only the blocks that differ from the local copy.
+
+        The blocks are written in place. If the connection drops, the delta is worked out again
+        against what the remote file now holds and the rest is sent; if the result does not match
+        the local digest, the whole file is uploaded instead. A cancelled update leaves the remote
+        file partly updated until it is sent again.
+        """
+        if not self.sftp and not self.reconnect():
+            return TransferResult(False, error="Not connected")
+        remote_path = self._remote_path(remote_filename)
+        try:
+            with self.pool.channel() as sftp, self.metrics.timed("stat"):
+                sftp.stat(remote_path)
+        except FileNotFoundError:
+            return self.upload_file(local_path, remote_filename, progress=progress, cancel=cancel)
         except Exception as e:
-            print(f"[!] Download failed: {e}")
+            print(f"[!] Upload failed: {e}")
+            return TransferResult(False, error=str(e))
+
+        meter, progress = self._metered(progress)
+        try:
+            for attempt in itertools.count():
+                self._ensure_alive()
+                generation = self._generation
+                try:
+                    hasher = StreamHasher(self.digest_algorithm)
+                    stats = self.delta.upload(local_path, remote_path, progress=progress, hasher=hasher, cancel=cancel)
+                    result = self._verify(remote_path, stats.total, hasher.hexdigest(stats.total))
+                except TransferCancelled:
+                    print(f"[*] Upload of {remote_filename} stopped; the remote file is partly updated")
+                    return self._finished("upload", TransferResult(False, error="cancelled"), meter, CANCELLED)
+                except Exception as e:
+                    if self._recover(e, generation, attempt):
+                        print(f"[*] Connection was lost; comparing {remote_filename} again and sending the rest")
+                        continue
+                    print(f"[!] Upload failed: {e}")
+                    self.metrics.error("upload", e)
+                    return self._finished("upload", TransferResult(False, error=str(e)), meter)
+
+                if not result:
+                    print(f"[!] Delta upload of {remote_filename} did not verify ({result.error}); sending it whole")
+                    return self.upload_file(local_path, remote_filename, progress=progress, resume=False, cancel=cancel)
+                print(
+                    f"[+] Uploaded {remote_filename}: sent {stats.sent} of {stats.total} bytes, "
+                    f"{stats.matched}/{stats.blocks} blocks unchanged ({stats.method})"
+                )
+                return self._finished("upload", result, meter)
+        finally:
+            self.listings.invalidate(posixpath.dirname(remote_path))
+
+    def download_file(
+        self,
+        remote_filename: str,
+        local_path: str,
+        progress: Optional[ProgressCallback] = None,
+        resume: bool = True,
+        cancel: Optional[threading.Event] = None,
+    ) -> TransferResult:
+        """Download a file over parallel pipelined channels, resuming a verified partial download.
+
+        The file is hashed as it arrives and checked against a digest computed by the server.
+        Setting ``cancel`` stops the transfer and keeps its checkpoint so it can be resumed later.
+        If the connection drops, it is re-established and the download continues from its checkpoint.
+        The result carries a ``ProgressSnapshot`` with the rates and time to first byte.
+        """
+        if not self.sftp and not self.reconnect():
+            return TransferResult(False, error="Not connected")
+        meter, progress = self._metered(progress)
+        remote_path = self._remote_path(remote_filename)
+        confirm = True
+        for attempt in itertools.count():
+            self._ensure_alive()
+            generation = self._generation
+            checkpoint = None
+            try:
+                with self.pool.channel() as sftp, self.metrics.timed("stat"):
+                    source = sftp.stat(remote_path)
+                checkpoint = self._checkpoint_for("download", local_path, remote_path, source, resume, confirm)
+                hasher = StreamHasher(self.digest_algorithm)
+                if checkpoint.offset:
+                    hasher.feed_file(local_path, checkpoint.offset)
+                engine, compression = self._engine_for(
+                    remote_filename, source.st_size - checkpoint.offset,
+                    lambda n: self._read_remote_sample(remote_path, checkpoint.offset, n),
+                )
+                size = engine.download(
+                    remote_path, local_path, offset=checkpoint.offset, progress=progress, cancel=cancel,
+                    on_commit=checkpoint.commit, hasher=hasher,
+                )
+
+                if os.path.getsize(local_path) != size:
+                    print("[!] Download verification failed: file sizes differ.")
+                    return self._finished("download", TransferResult(False, size, error="file sizes differ"), meter)
+                result = self._verify(remote_path, size, hasher.hexdigest(size), compression)
+                if not result:
+                    print(f"[!] Download verification failed: {result.error}.")
+                    return self._finished("download", result, meter)
+
+                checkpoint.remove()
+                print(f"[+] Downloaded {remote_filename}")
+                return self._finished("download", result, meter)
+            except TransferCancelled:
+                checkpoint.flush()
+                print(f"[*] Download of {remote_filename} stopped at byte {checkpoint.committed}")
+                return self._finished("download", TransferResult(False, error="cancelled"), meter, CANCELLED)
+            except Exception as e:
+                if checkpoint:
+                    checkpoint.flush()
+                if self._recover(e, generation, attempt):
+                    print(f"[*] Connection was lost; resuming download of {remote_filename} "
+                          f"from byte {checkpoint.committed if checkpoint else 0}")
+                    resume, confirm = True, False
+                    continue
+                print(f"[!] Download failed: {e}")
+                self.metrics.error("download", e)
+                return self._finished("download", TransferResult(False, error=str(e)), meter)
+
+    def _metered(self, progress: Optional[ProgressCallback]) -> Tuple[TransferProgress, ProgressCallback]:
+        """Return a fresh meter and a progress callback that feeds it before passing reports on."""
+        meter = TransferProgress()
+
+        def report(done: int, total: int):
+            meter(done, total)
+            if progress:
+                progress(done, total)
+
+        return meter, report
+
+    def _finished(
+        self,
+        direction: str,
+        result: TransferResult,
+        meter: TransferProgress,
+        outcome: Optional[str] = None,
+    ) -> TransferResult:
+        """Attach the final progress snapshot to a result and count the transfer."""
+        result.progress = meter.snapshot()
+        # The meter's baseline is where the transfer started, so a non-zero one means it resumed.
+        self.metrics.transfer_finished(
+            direction, outcome or (OK if result else FAILED), result.progress, resumed=result.progress.start > 0
+        )
+        return result
+
+    def _verify(
+        self, remote_path: str, size: int, digest: str, compression: Optional[CompressionDecision] = None
+    ) -> TransferResult:
+        """Compare a streamed digest with the server's, or only the size if it cannot compute one."""
+        algorithm = self.digest_algorithm
+        with self.pool.channel() as sftp:
+            theirs = remote_digest(sftp, self.open_exec, remote_path, algorithm)
+            if theirs is None:
+                with self.metrics.timed("stat"):
+                    ok = sftp.stat(remote_path).st_size == size
+                return TransferResult(ok, size, algorithm, digest, error=None if ok else "file sizes differ",
+                                      compression=compression)
+        ok = theirs == digest
+        return TransferResult(ok, size, algorithm, digest, theirs, ok, error=None if ok else f"{algorithm} mismatch",
+                              compression=compression)
+
+    def _checkpoint_for(
+        self, direction: str, local_path: str, remote_path: str, source, resume: bool, confirm: bool = True
+    ) -> TransferCheckpoint:
+        """Return the checkpoint to run a transfer with, resuming from it only if it still checks out.
+
+        ``confirm`` asks ``ask_resume_callback`` first; retries of our own transfer skip that.
+        """
+        checkpoint = TransferCheckpoint.load(local_path) if resume else None
+        if (
+            checkpoint
+            and checkpoint.matches(direction, remote_path, source.st_size, source.st_mtime)
+            and self._partial_intact(checkpoint)
+            and (not confirm or self._confirm_resume(os.path.basename(local_path), checkpoint.offset, source.st_size))
+        ):
+            print(f"[*] Resuming {direction} of {os.path.basename(local_path)} at byte {checkpoint.offset}")
+            return checkpoint
+        return TransferCheckpoint(local_path, direction, remote_path, source.st_size, int(source.st_mtime))
+
+    def _partial_intact(self, checkpoint: TransferCheckpoint) -> bool:
+        """Check that the partial destination still holds the checkpointed prefix."""
+        if checkpoint.direction == "download":
+            return checkpoint.verify_prefix()
+        try:
+            with self.pool.channel() as sftp:
+                with sftp.open(checkpoint.remote_path, "rb") as f:
+                    if f.stat().st_size < checkpoint.offset:
+                        return False
+                    blocks = f.readv(hash_ranges(checkpoint.offset))
+                    remote_hash = digest_prefix(checkpoint.offset, blocks)
+            return remote_hash == checkpoint.prefix_hash
+        except (IOError, paramiko.SSHException):
             return False
+
+    def _confirm_resume(self, filename: str, offset: int, total: int) -> bool:
+        if self.ask_resume_callback:
+            return self.ask_resume_callback(filename, offset, total)
+        return True
+
+
+def _read_local_sample(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
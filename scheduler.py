@@ -0,0 +1,327 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from integrity import TransferResult
+from metrics import ProgressSnapshot, TransferProgress
+from remote_sftp import RemoteSFTP
+
+DEFAULT_WORKERS = 4
+DEFAULT_PER_HOST_LIMIT = 2
+# Minimum seconds between progress notifications for one job.
+PROGRESS_INTERVAL = 0.2
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class _TokenBucket:
+    """Shared byte budget refilled at ``rate`` bytes per second; ``consume`` sleeps when it runs dry."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class TransferJob:
+    """One queued upload or download and its live state."""
+
+    def __init__(self, job_id: int, kind: str, remote: RemoteSFTP, local_path: str, remote_path: str, priority: int):
+        self.id = job_id
+        self.kind = kind
+        self.remote = remote
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.priority = priority
+        self.host = f"{remote.host}:{remote.port}"
+        self.state = QUEUED
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.error: Optional[str] = None
+        self.result: Optional[TransferResult] = None
+        # Rates and time to first byte of the current run; replaced each time the job starts.
+        self.meter: Optional[TransferProgress] = None
+        self._cancel = threading.Event()
+        self._pause_requested = False
+        self._reported_at = 0.0
+        # Order number of the job's current queue entry; entries left from earlier enqueues are skipped.
+        self._queue_order = -1
+
+    def snapshot(self) -> Optional[ProgressSnapshot]:
+        return self.meter.snapshot() if self.meter else None
+
+    def as_dict(self) -> Dict[str, object]:
+        snapshot = self.snapshot()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "host": self.host,
+            "local_path": self.local_path,
+            "remote_path": self.remote_path,
+            "priority": self.priority,
+            "state": self.state,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "error": self.error,
+            "digest": self.result.digest if self.result else None,
+            "verified": self.result.verified if self.result else None,
+            "compressed": self.result.compression.compress if self.result and self.result.compression else None,
+            "rate": snapshot.rate if snapshot else None,
+            "average_rate": snapshot.average_rate if snapshot else None,
+            "first_byte": snapshot.first_byte if snapshot else None,
+            "eta": snapshot.eta if snapshot else None,
+        }
+
+
+class TransferScheduler:
+    """Runs transfer jobs on a bounded pool of worker threads.
+
+    Jobs run highest ``priority`` first, then in submission order, with at
+    most ``per_host_limit`` running against the same host at once. An
+    optional ``bandwidth_limit`` in bytes per second is shared by all jobs.
+    Pausing a running job stops it and puts it back in the queue paused;
+    resuming requeues it and it continues from its checkpoint. A queued or
+    paused job can be given a new priority with ``set_priority``. ``on_update``
+    is called from worker threads whenever a job changes state and, at most
+    every ``PROGRESS_INTERVAL`` seconds, while it makes progress.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+        bandwidth_limit: Optional[int] = None,
+        on_update: Optional[Callable[[TransferJob], None]] = None,
+    ):
+        self.per_host_limit = max(1, per_host_limit)
+        self.on_update = on_update
+        self._bucket = _TokenBucket(bandwidth_limit) if bandwidth_limit else None
+        self._jobs: Dict[int, TransferJob] = {}
+        self._queue: List[Tuple[int, int, TransferJob]] = []
+        self._running_per_host: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"sftp-scheduler-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit_upload(self, remote: RemoteSFTP, local_path: str, remote_filename: str, priority: int = 0) -> TransferJob:
+        """Queue an upload. ``remote_filename`` is resolved against the remote directory at submit time."""
+        return self._submit(UPLOAD, remote, local_path, remote._remote_path(remote_filename), priority)
+
+    def submit_download(self, remote: RemoteSFTP, remote_filename: str, local_path: str, priority: int = 0) -> TransferJob:
+        """Queue a download. ``remote_filename`` is resolved against the remote directory at submit time."""
+        return self._submit(DOWNLOAD, remote, local_path, remote._remote_path(remote_filename), priority)
+
+    def pause(self, job_id: int) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.state not in (QUEUED, RUNNING):
+                return False
+            if job.state == RUNNING:
+                job._pause_requested = True
+                job._cancel.set()
+                return True
+            job.state = PAUSED
+            self._cond.notify_all()
+        self._notify(job)
+        return True
+
+    def resume(self, job_id: int) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.state != PAUSED:
+                return False
+            self._enqueue(job)
+        self._notify(job)
+        return True
+
+    def cancel(self, job_id: int) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.state in (DONE, FAILED, CANCELLED):
+                return False
+            if job.state == RUNNING:
+                job._pause_requested = False
+                job._cancel.set()
+                return True
+            job.state = CANCELLED
+            self._cond.notify_all()
+        self._notify(job)
+        return True
+
+    def set_priority(self, job_id: int, priority: int) -> bool:
+        """Change the priority of a job that has not started; a queued one moves to its new place."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.state not in (QUEUED, PAUSED):
+                return False
+            job.priority = priority
+            if job.state == QUEUED:
+                self._enqueue(job)
+        self._notify(job)
+        return True
+
+    def jobs(self) -> List[Dict[str, object]]:
+        """Snapshot of every job the scheduler knows about, in submission order."""
+        with self._cond:
+            return [job.as_dict() for job in self._jobs.values()]
+
+    def counts(self) -> Dict[str, int]:
+        with self._cond:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return counts
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until no job is queued or running. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while any(job.state in (QUEUED, RUNNING) for job in self._jobs.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def shutdown(self, cancel_running: bool = False):
+        """Stop handing out jobs; optionally stop the ones already running."""
+        with self._cond:
+            self._shutdown = True
+            if cancel_running:
+                for job in self._jobs.values():
+                    if job.state == RUNNING:
+                        job._cancel.set()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _submit(self, kind: str, remote: RemoteSFTP, local_path: str, remote_path: str, priority: int) -> TransferJob:
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Scheduler is shut down")
+            job = TransferJob(next(self._ids), kind, remote, local_path, remote_path, priority)
+            self._jobs[job.id] = job
+            self._enqueue(job)
+        self._notify(job)
+        return job
+
+    def _enqueue(self, job: TransferJob):
+        job.state = QUEUED
+        job._cancel.clear()
+        job._pause_requested = False
+        job._queue_order = next(self._order)
+        heapq.heappush(self._queue, (-job.priority, job._queue_order, job))
+        # Workers and wait() share the condition, so wake everyone.
+        self._cond.notify_all()
+
+    def _next_job(self) -> Optional[TransferJob]:
+        """Pop the best runnable job, skipping ones whose host is at its limit. Caller holds the lock."""
+        skipped = []
+        found = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            if job.state != QUEUED or entry[1] != job._queue_order:
+                continue
+            if self._running_per_host.get(job.host, 0) >= self.per_host_limit:
+                skipped.append(entry)
+                continue
+            found = job
+            break
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return found
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._shutdown:
+                    job = self._next_job()
+                    if job:
+                        break
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                job.state = RUNNING
+                self._running_per_host[job.host] = self._running_per_host.get(job.host, 0) + 1
+            self._notify(job)
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running_per_host[job.host] -= 1
+                    self._cond.notify_all()
+            self._notify(job)
+
+    def _run(self, job: TransferJob):
+        last: List[Optional[int]] = [None]
+        lock = threading.Lock()
+        meter = job.meter = TransferProgress()
+
+        def progress(done: int, total: int):
+            meter(done, total)
+            with lock:
+                # The first report of a resumed job includes the bytes sent before; only bill what follows.
+                delta = 0 if last[0] is None else done - last[0]
+                last[0] = done
+                job.bytes_done, job.bytes_total = done, total
+            if self._bucket and delta > 0:
+                self._bucket.consume(delta)
+            now = time.monotonic()
+            if now - job._reported_at >= PROGRESS_INTERVAL:
+                job._reported_at = now
+                self._notify(job)
+
+        try:
+            if job.kind == UPLOAD:
+                result = job.remote.upload_file(job.local_path, job.remote_path, progress=progress, cancel=job._cancel)
+            else:
+                result = job.remote.download_file(job.remote_path, job.local_path, progress=progress, cancel=job._cancel)
+        except Exception as e:
+            result = TransferResult(False, error=str(e))
+        ok, error = bool(result), result.error or f"{job.kind} failed"
+
+        with self._cond:
+            job.result = result
+            if ok:
+                job.state = DONE
+            elif job._cancel.is_set():
+                job.state = PAUSED if job._pause_requested else CANCELLED
+            else:
+                job.state, job.error = FAILED, error
+
+    def _notify(self, job: TransferJob):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"[!] Transfer update callback failed: {e}")
@@ -0,0 +1,200 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import paramiko
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 300.0
+DEFAULT_HEALTH_CHECK_AFTER = 30.0
+DEFAULT_CHECKOUT_TIMEOUT = 30.0
+DEFAULT_HEALTH_CHECK_TIMEOUT = 10.0
+
+
+class PoolTimeout(Exception):
+    """Raised when no SFTP channel became free within the checkout timeout."""
+
+
+class SFTPChannelPool:
+    """Pool of SFTP channels spread over one or more SSH transports.
+
+    Channels are opened lazily up to ``size`` and handed out to one worker
+    at a time. Idle channels older than ``idle_timeout`` are closed, and a
+    channel that sat idle longer than ``health_check_after`` is probed,
+    outside the pool lock, before it is handed out again. Extra transports
+    are created through ``client_factory`` and channels are spread over
+    them round-robin.
+    """
+
+    def __init__(
+        self,
+        transport: paramiko.Transport,
+        size: int = DEFAULT_POOL_SIZE,
+        transports: int = 1,
+        client_factory: Optional[Callable[[], paramiko.SSHClient]] = None,
+        window_size: Optional[int] = None,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        health_check_after: float = DEFAULT_HEALTH_CHECK_AFTER,
+        checkout_timeout: float = DEFAULT_CHECKOUT_TIMEOUT,
+    ):
+        self.size = max(1, size)
+        self.transports = max(1, transports) if client_factory else 1
+        self.client_factory = client_factory
+        self.window_size = window_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+
+        self._transports: List[paramiko.Transport] = [transport]
+        self._clients: List[paramiko.SSHClient] = []
+        self._idle: List[Tuple[paramiko.SFTPClient, float]] = []
+        self._owner: Dict[int, paramiko.Transport] = {}
+        self._opened = 0
+        self._next_transport = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._transport_lock = threading.Lock()
+
+    @contextmanager
+    def channel(self, timeout: Optional[float] = None):
+        """Check out a channel for the duration of a ``with`` block.
+
+        A channel is discarded instead of returned if the block raises, since
+        it may still have requests in flight.
+        """
+        sftp = self.checkout(timeout)
+        try:
+            yield sftp
+        except BaseException:
+            self.checkin(sftp, broken=True)
+            raise
+        self.checkin(sftp)
+
+    def checkout(self, timeout: Optional[float] = None) -> paramiko.SFTPClient:
+        """Return an idle channel, opening a new one if the pool has room."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            stale = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise paramiko.SSHException("Channel pool is closed")
+                    self._evict_idle()
+                    if self._idle:
+                        sftp, since = self._idle.pop()
+                        if time.monotonic() - since < self.health_check_after:
+                            return sftp
+                        stale = sftp
+                        break
+                    if self._opened < self.size:
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No SFTP channel free after {timeout:.0f}s")
+                    self._cond.wait(remaining)
+            if stale is None:
+                break
+            # Probe outside the lock: it is a round trip, and other checkouts and checkins must not wait on it.
+            # The channel counts as checked out meanwhile.
+            if self._healthy(stale):
+                return stale
+            self.checkin(stale, broken=True)
+
+        # Open outside the lock: it costs round trips and may add a transport.
+        try:
+            return self._open()
+        except BaseException:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, sftp: paramiko.SFTPClient, broken: bool = False):
+        """Return a channel to the pool, or close it if it is broken or the pool is closed."""
+        with self._cond:
+            transport = self._owner.get(id(sftp))
+            if broken or self._closed or transport is None or not transport.is_active():
+                self._discard(sftp)
+            else:
+                self._idle.append((sftp, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "open": self._opened,
+                "idle": len(self._idle),
+                "in_use": self._opened - len(self._idle),
+                "transports": len(self._transports),
+            }
+
+    def close(self):
+        """Close idle channels and any extra transports; in-use channels close on checkin."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+            clients, self._clients = self._clients, []
+            self._transports = self._transports[:1]
+            self._cond.notify_all()
+        for client in clients:
+            client.close()
+
+    def _open(self) -> paramiko.SFTPClient:
+        transport = self._pick_transport()
+        sftp = paramiko.SFTPClient.from_transport(transport, window_size=self.window_size)
+        with self._cond:
+            self._owner[id(sftp)] = transport
+        return sftp
+
+    def _pick_transport(self) -> paramiko.Transport:
+        with self._cond:
+            self._transports = [t for t in self._transports if t.is_active()] or self._transports[:1]
+            index = self._next_transport % self.transports
+            self._next_transport += 1
+            if index < len(self._transports):
+                return self._transports[index]
+        with self._transport_lock:
+            with self._cond:
+                if index < len(self._transports):
+                    return self._transports[index]
+            client = self.client_factory()
+            with self._cond:
+                self._clients.append(client)
+                self._transports.append(client.get_transport())
+            return client.get_transport()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        keep = []
+        for sftp, since in self._idle:
+            if now - since > self.idle_timeout:
+                self._discard(sftp)
+            else:
+                keep.append((sftp, since))
+        self._idle = keep
+
+    def _discard(self, sftp: paramiko.SFTPClient):
+        if self._owner.pop(id(sftp), None) is not None:
+            self._opened -= 1
+        try:
+            sftp.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _healthy(sftp: paramiko.SFTPClient) -> bool:
+        try:
+            channel = sftp.get_channel()
+            if channel is None or channel.closed:
+                return False
+            channel.settimeout(DEFAULT_HEALTH_CHECK_TIMEOUT)
+            sftp.normalize(".")
+            channel.settimeout(None)
+            return True
+        except Exception:
+            # A probe that timed out may still get a late reply; the channel is discarded either way.
+            return False
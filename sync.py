@@ -0,0 +1,408 @@
+import hashlib
+import os
+import posixpath
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import paramiko
+
+from checkpoint import CHECKPOINT_SUFFIX
+from crawler import ErrorCallback
+from delta import DeltaUpload
+from integrity import StreamHasher
+from local_fs import LocalFileSystem
+from remote_sftp import RemoteSFTP
+from tar_batch import TarBatcher, BatchUnavailable, DEFAULT_BATCH_BYTES, DEFAULT_BATCH_FILES, DEFAULT_SMALL_FILE_LIMIT
+from transfer import ChunkedTransfer
+
+DEFAULT_SYNC_WORKERS = 8
+# Pushed updates at least this large send only their changed blocks; smaller ones are sent whole.
+DEFAULT_DELTA_THRESHOLD = 8 * 1024 * 1024
+HASH_BLOCK = 1024 * 1024
+
+PUSH = "push"
+PULL = "pull"
+
+
+class SyncAction(NamedTuple):
+    """One step of a sync plan. ``path`` is relative to both roots, with ``/`` separators.
+
+    ``kind`` is one of ``mkdir``, ``create``, ``update``, ``touch`` (same
+    content, only the mtime is copied), ``delete``, ``rmdir`` or ``conflict``
+    (a file on one side and a folder on the other, left alone).
+    """
+
+    kind: str
+    path: str
+    size: int = 0
+
+
+class SyncReport:
+    """What a sync run did, or would do for a dry run."""
+
+    def __init__(self, actions: List[SyncAction], dry_run: bool, unreadable: Optional[List[Tuple[str, str]]] = None):
+        self.actions = actions
+        self.dry_run = dry_run
+        self.done: List[SyncAction] = []
+        self.errors: List[Tuple[SyncAction, str]] = []
+        # (path, error) for everything either walk could not read; deletes are not planned when there is any.
+        self.unreadable = unreadable or []
+
+    @property
+    def bytes_planned(self) -> int:
+        return sum(a.size for a in self.actions if a.kind in ("create", "update"))
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for action in self.actions:
+            counts[action.kind] = counts.get(action.kind, 0) + 1
+        return counts
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{kind}: {n}" for kind, n in sorted(self.counts().items())) or "nothing to do"
+        prefix = "[dry run] " if self.dry_run else ""
+        line = f"{prefix}{counts}; {self.bytes_planned} bytes to transfer"
+        if self.errors:
+            line += f"; {len(self.errors)} failed"
+        if self.unreadable:
+            line += f"; {len(self.unreadable)} unreadable"
+        return line
+
+
+class SyncEngine:
+    """Mirrors a local tree to a remote one (``push``) or back (``pull``).
+
+    Both trees are walked once and compared by size and mtime. With
+    ``checksum`` set, files of equal size but different mtime are hashed on
+    both sides and only re-sent if the content differs. Entries missing from
+    the source are deleted from the destination only when ``delete`` is set,
+    and only when both walks read everything: a folder that could not be
+    listed would otherwise look empty and have its mirror deleted.
+    Files are copied by ``workers`` threads, each streaming one file over a
+    single pipelined channel, and the source mtime is copied across so the
+    next run sees them as unchanged.
+
+    Files up to ``small_file_limit`` bytes are sent in tar batches over an
+    exec channel instead (see ``TarBatcher``), falling back to SFTP when
+    the server will not run ``tar``. A limit of 0 turns batching off.
+
+    Pushed updates of files of ``delta_threshold`` bytes or more go through
+    ``DeltaUpload``, so only the blocks that changed are sent. A threshold
+    of 0 always sends whole files.
+
+    Every copy is hashed as it streams and checked against a digest from
+    the server, as ``RemoteSFTP.upload_file`` does; a tar batch is checked
+    with one digest run for all its files and is sent again file by file if
+    any of them differ.
+    """
+
+    def __init__(
+        self,
+        local_fs: LocalFileSystem,
+        remote: RemoteSFTP,
+        workers: int = DEFAULT_SYNC_WORKERS,
+        checksum: bool = False,
+        delete: bool = False,
+        small_file_limit: int = DEFAULT_SMALL_FILE_LIMIT,
+        batch_files: int = DEFAULT_BATCH_FILES,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        delta_threshold: int = DEFAULT_DELTA_THRESHOLD,
+    ):
+        self.local_fs = local_fs
+        self.remote = remote
+        self.workers = max(1, workers)
+        self.checksum = checksum
+        self.delete = delete
+        self.batcher = (
+            TarBatcher(remote.open_exec, small_file_limit, batch_files, batch_bytes) if small_file_limit > 0 else None
+        )
+        self._batching = True
+        self._batch_unverified_noted = False
+        self.delta_threshold = delta_threshold
+        self.unreadable: List[Tuple[str, str]] = []
+
+    def plan(self, local_root: str, remote_root: str, direction: str = PUSH) -> List[SyncAction]:
+        """Work out the minimal set of actions that makes the destination match the source.
+
+        Paths either walk could not read are left in ``unreadable``.
+        """
+        unreadable: List[Tuple[str, str]] = []
+
+        def skipped(path: str, error: Exception):
+            print(f"[!] Cannot read {path}: {error}")
+            unreadable.append((path, str(error)))
+
+        local = self._local_tree(local_root, skipped)
+        remote = self._remote_tree(remote_root, skipped)
+        self.unreadable = unreadable
+        src, dst = (local, remote) if direction == PUSH else (remote, local)
+
+        actions: List[SyncAction] = []
+        for rel in sorted(src):
+            src_st, dst_st = src[rel], dst.get(rel)
+            src_dir = stat.S_ISDIR(src_st.st_mode)
+            if dst_st is None:
+                actions.append(SyncAction("mkdir", rel) if src_dir else SyncAction("create", rel, src_st.st_size))
+            elif src_dir != stat.S_ISDIR(dst_st.st_mode):
+                actions.append(SyncAction("conflict", rel))
+            elif not src_dir:
+                kind = self._compare(rel, src_st, dst_st, local_root, remote_root, direction)
+                if kind:
+                    actions.append(SyncAction(kind, rel, src_st.st_size))
+
+        if self.delete and unreadable:
+            print(f"[!] Not deleting anything: {len(unreadable)} paths could not be read")
+        elif self.delete:
+            extra = [rel for rel in dst if rel not in src]
+            actions.extend(SyncAction("delete", rel) for rel in sorted(extra) if not stat.S_ISDIR(dst[rel].st_mode))
+            # Deepest folders first so each one is already empty when removed.
+            dirs = [rel for rel in extra if stat.S_ISDIR(dst[rel].st_mode)]
+            actions.extend(SyncAction("rmdir", rel) for rel in sorted(dirs, key=lambda r: r.count("/"), reverse=True))
+        return actions
+
+    def run(
+        self,
+        local_root: str,
+        remote_root: str,
+        direction: str = PUSH,
+        dry_run: bool = False,
+        on_action: Optional[Callable[[SyncAction, bool], None]] = None,
+    ) -> SyncReport:
+        """Plan and, unless ``dry_run``, execute a sync. ``on_action`` gets each action and whether it succeeded."""
+        if direction not in (PUSH, PULL):
+            raise ValueError(f"Unknown sync direction: {direction}")
+        # Planning and every action are repeated after a reconnect if the connection drops under them.
+        report = SyncReport(self.remote.retry(lambda: self.plan(local_root, remote_root, direction)), dry_run,
+                            self.unreadable)
+        if dry_run:
+            return report
+
+        lock = threading.Lock()
+
+        def record(action: SyncAction, error: Optional[str]):
+            with lock:
+                if error is None:
+                    report.done.append(action)
+                else:
+                    report.errors.append((action, error))
+                    print(f"[!] Sync {action.kind} {action.path} failed: {error}")
+            if on_action:
+                on_action(action, error is None)
+
+        def execute(action: SyncAction):
+            try:
+                self.remote.retry(lambda: self._execute(action, local_root, remote_root, direction))
+                error = None
+            except Exception as e:
+                error = str(e)
+            record(action, error)
+
+        def execute_batch(batch: List[SyncAction]):
+            if self._batching:
+                try:
+                    self._execute_batch([a.path for a in batch], local_root, remote_root, direction)
+                except BatchUnavailable as e:
+                    with lock:
+                        if self._batching:
+                            self._batching = False
+                            print(f"[*] Batching unavailable ({e}); using SFTP for small files")
+                except Exception as e:
+                    print(f"[*] Batch of {len(batch)} files failed ({e}); sending them one by one")
+                else:
+                    for action in batch:
+                        record(action, None)
+                    return
+            for action in batch:
+                execute(action)
+
+        def by_kind(*kinds: str) -> List[SyncAction]:
+            return [a for a in report.actions if a.kind in kinds]
+
+        self.remote.retry(lambda: self._ensure_root(local_root, remote_root, direction))
+        # Folders are created in path order so parents exist before their children.
+        for action in by_kind("mkdir"):
+            execute(action)
+        single, batches = self._split_batches(by_kind("create", "update", "touch", "delete"))
+        with ThreadPoolExecutor(max_workers=self._worker_count(), thread_name_prefix="sftp-sync") as executor:
+            futures = [executor.submit(execute_batch, batch) for batch in batches]
+            futures += [executor.submit(execute, action) for action in single]
+            for future in futures:
+                future.result()
+        for action in by_kind("rmdir"):
+            execute(action)
+        for action in by_kind("conflict"):
+            print(f"[!] Sync skipped {action.path}: file on one side, folder on the other")
+
+        self.remote.listings.clear()
+        print(f"[+] Sync {direction} finished: {report.summary()}")
+        return report
+
+    def _split_batches(self, actions: List[SyncAction]) -> Tuple[List[SyncAction], List[List[SyncAction]]]:
+        """Separate the small file copies that go in tar batches from the actions run one by one."""
+        if not self.batcher:
+            return actions, []
+        small = [a for a in actions if a.kind in ("create", "update") and a.size <= self.batcher.small_file_limit]
+        if len(small) < 2:
+            return actions, []
+        batched = set(small)
+        single = [a for a in actions if a not in batched]
+        return single, list(self.batcher.batches(small, lambda a: a.size))
+
+    def _execute_batch(self, paths: List[str], local_root: str, remote_root: str, direction: str):
+        algorithm = self.remote.digest_algorithm
+        if direction == PUSH:
+            stats = self.batcher.upload(local_root, remote_root, paths, algorithm)
+        else:
+            stats = self.batcher.download(remote_root, paths, local_root, algorithm)
+        mismatched = self.batcher.verify(remote_root, stats.digests, algorithm)
+        if mismatched is None:
+            if not self._batch_unverified_noted:
+                self._batch_unverified_noted = True
+                print(f"[*] Batched files are not verified: the server cannot compute {algorithm} digests")
+        elif mismatched:
+            raise IOError(f"{len(mismatched)} files did not verify, first {mismatched[0]}")
+
+    def _worker_count(self) -> int:
+        # One channel per worker; more workers than the pool would only queue on checkout.
+        return min(self.workers, self.remote.pool.size) if self.remote.pool else self.workers
+
+    def _transfer(self) -> ChunkedTransfer:
+        engine = self.remote.transfer
+        return ChunkedTransfer(
+            self.remote._open_channel,
+            chunk_size=engine.chunk_size,
+            request_size=engine.request_size,
+            queue_depth=engine.queue_depth,
+            channels=1,
+            metrics=self.remote.metrics,
+        )
+
+    def _delta(self) -> DeltaUpload:
+        return DeltaUpload(self._transfer(), self.remote._open_channel, self.remote.open_exec,
+                           block_size=self.remote.delta.block_size)
+
+    def _local_tree(self, root: str, on_error: ErrorCallback) -> Dict[str, os.stat_result]:
+        if not os.path.lexists(root):
+            # A pull creates it; like a missing remote root, that is an empty tree, not an unreadable one.
+            return {}
+        return {
+            rel: st for rel, st in self.local_fs.walk(root, on_error)
+            if not rel.rsplit("/", 1)[-1].endswith((CHECKPOINT_SUFFIX, CHECKPOINT_SUFFIX + ".tmp"))
+        }
+
+    def _remote_tree(self, root: str, on_error: ErrorCallback) -> Dict[str, paramiko.SFTPAttributes]:
+        try:
+            with self.remote.pool.channel() as sftp:
+                sftp.stat(root)
+        except FileNotFoundError:
+            return {}
+        return dict(self.remote.walk(root, on_error))
+
+    def _compare(self, rel: str, src_st, dst_st, local_root: str, remote_root: str, direction: str) -> Optional[str]:
+        if src_st.st_size != dst_st.st_size:
+            return "update"
+        if int(src_st.st_mtime) == int(dst_st.st_mtime):
+            return None
+        if not self.checksum:
+            return "update"
+        same = self._local_digest(os.path.join(local_root, rel)) == self._remote_digest(posixpath.join(remote_root, rel))
+        return "touch" if same else "update"
+
+    @staticmethod
+    def _local_digest(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _remote_digest(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with self.remote.pool.channel() as sftp:
+            with sftp.open(path, "rb") as f:
+                f.prefetch()
+                for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _ensure_root(self, local_root: str, remote_root: str, direction: str):
+        if direction == PULL:
+            os.makedirs(local_root, exist_ok=True)
+            return
+        with self.remote.pool.channel() as sftp:
+            try:
+                sftp.stat(remote_root)
+            except FileNotFoundError:
+                sftp.mkdir(remote_root)
+
+    def _execute(self, action: SyncAction, local_root: str, remote_root: str, direction: str):
+        local_path = os.path.join(local_root, *action.path.split("/"))
+        remote_path = posixpath.join(remote_root, action.path)
+        push = direction == PUSH
+
+        if action.kind == "mkdir":
+            if push:
+                with self.remote.pool.channel() as sftp:
+                    sftp.mkdir(remote_path)
+            else:
+                os.makedirs(local_path, exist_ok=True)
+        elif action.kind in ("create", "update"):
+            if push and action.kind == "update" and 0 < self.delta_threshold <= action.size:
+                self._push_delta(action.path, local_path, remote_path)
+            else:
+                self._copy(local_path, remote_path, push)
+            self._copy_mtime(local_path, remote_path, push)
+        elif action.kind == "touch":
+            self._copy_mtime(local_path, remote_path, push)
+        elif action.kind == "delete":
+            if push:
+                with self.remote.pool.channel() as sftp:
+                    sftp.remove(remote_path)
+            else:
+                os.remove(local_path)
+        elif action.kind == "rmdir":
+            if push:
+                with self.remote.pool.channel() as sftp:
+                    sftp.rmdir(remote_path)
+            else:
+                os.rmdir(local_path)
+
+    def _push_delta(self, rel: str, local_path: str, remote_path: str):
+        """Send the changed blocks of an update, or the whole file if the result does not verify.
+
+        The blocks are written in place; if the connection drops, ``retry`` runs this again and
+        the fresh remote signatures pick up where the interrupted update stopped.
+        """
+        hasher = StreamHasher(self.remote.digest_algorithm)
+        stats = self._delta().upload(local_path, remote_path, hasher=hasher)
+        result = self.remote._verify(remote_path, stats.total, hasher.hexdigest(stats.total))
+        if result:
+            print(f"[*] Sync sent {stats.sent} of {stats.total} bytes of {rel} "
+                  f"({stats.matched}/{stats.blocks} blocks unchanged)")
+            return
+        print(f"[*] Delta update of {rel} did not verify ({result.error}); sending it whole")
+        self._copy(local_path, remote_path, True)
+
+    def _copy(self, local_path: str, remote_path: str, push: bool):
+        """Send or fetch a whole file, hashing it on the way, and check it against the server's digest."""
+        hasher = StreamHasher(self.remote.digest_algorithm)
+        if push:
+            size = self._transfer().upload(local_path, remote_path, hasher=hasher)
+        else:
+            size = self._transfer().download(remote_path, local_path, hasher=hasher)
+            if os.path.getsize(local_path) != size:
+                raise IOError("verification failed: file sizes differ")
+        result = self.remote._verify(remote_path, size, hasher.hexdigest(size))
+        if not result:
+            raise IOError(f"verification failed: {result.error}")
+
+    def _copy_mtime(self, local_path: str, remote_path: str, push: bool):
+        with self.remote.pool.channel() as sftp:
+            if push:
+                st = os.stat(local_path)
+                sftp.utime(remote_path, (int(st.st_atime), int(st.st_mtime)))
+            else:
+                attrs = sftp.stat(remote_path)
+                os.utime(local_path, (attrs.st_atime, attrs.st_mtime))
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import posixpath
+import shlex
+import socket
+import tarfile
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, TypeVar
+
+import paramiko
+
+from integrity import ALGORITHMS, DEFAULT_DIGEST_TIMEOUT
+
+DEFAULT_SMALL_FILE_LIMIT = 64 * 1024
+DEFAULT_BATCH_FILES = 1000
+DEFAULT_BATCH_BYTES = 32 * 1024 * 1024
+# Exit status a POSIX shell gives for a command it cannot find.
+COMMAND_NOT_FOUND = 127
+
+ExecFactory = Callable[[str], paramiko.Channel]
+T = TypeVar("T")
+
+
+class BatchUnavailable(Exception):
+    """The server will not run ``tar`` for us; transfer the files one by one instead."""
+
+
+class BatchStats(NamedTuple):
+    files: int
+    bytes: int
+    # Relative path -> hex digest of the bytes sent or written, when an algorithm was given.
+    digests: Optional[Dict[str, str]] = None
+
+
+class _HashingReader:
+    """File wrapper that hashes what ``tarfile`` reads out of it."""
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+
+class TarBatcher:
+    """Moves many small files as one streamed tar archive over an exec channel.
+
+    Uploads pipe the archive into ``tar -x`` on the server and downloads read
+    the output of ``tar -c``, so a batch of a thousand files costs one
+    channel open instead of thousands of SFTP round trips. Nothing is staged
+    on disk on either side. Files keep their mtime and permission bits.
+
+    ``small_file_limit`` is the largest file worth batching, and a batch is
+    closed after ``batch_files`` files or ``batch_bytes`` bytes, whichever
+    comes first. ``BatchUnavailable`` is raised when exec is refused or the
+    server has no ``tar``.
+
+    Given a digest ``algorithm``, each member is hashed as it is packed or
+    unpacked, and ``verify`` checks the whole batch against the server with
+    one ``sha256sum`` or ``b2sum`` run.
+    """
+
+    def __init__(
+        self,
+        open_exec: ExecFactory,
+        small_file_limit: int = DEFAULT_SMALL_FILE_LIMIT,
+        batch_files: int = DEFAULT_BATCH_FILES,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+    ):
+        self.open_exec = open_exec
+        self.small_file_limit = small_file_limit
+        self.batch_files = max(1, batch_files)
+        self.batch_bytes = max(1, batch_bytes)
+
+    def batches(self, items: Sequence[T], size_of: Callable[[T], int]) -> Iterator[List[T]]:
+        """Split items into batches by count and by the total of ``size_of(item)``."""
+        batch: List[T] = []
+        size = 0
+        for item in items:
+            if batch and (len(batch) >= self.batch_files or size + size_of(item) > self.batch_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(item)
+            size += size_of(item)
+        if batch:
+            yield batch
+
+    def upload(
+        self, local_root: str, remote_root: str, paths: Sequence[str], algorithm: Optional[str] = None
+    ) -> BatchStats:
+        """Send ``paths`` (relative, ``/``-separated) from ``local_root`` into ``remote_root``."""
+        root = shlex.quote(remote_root)
+        channel = self._exec(f"mkdir -p -- {root} && tar -x -f - -C {root}")
+        total = 0
+        digests: Optional[Dict[str, str]] = {} if algorithm else None
+        try:
+            with channel.makefile("wb") as stdin:
+                with tarfile.open(fileobj=stdin, mode="w|") as tar:
+                    for rel in paths:
+                        local_path = os.path.join(local_root, *rel.split("/"))
+                        info = tar.gettarinfo(local_path, arcname=rel)
+                        info.uid = info.gid = 0
+                        info.uname = info.gname = ""
+                        with open(local_path, "rb") as f:
+                            if digests is None:
+                                tar.addfile(info, f)
+                            else:
+                                reader = _HashingReader(f, hashlib.new(algorithm))
+                                tar.addfile(info, reader)
+                                digests[rel] = reader.digest.hexdigest()
+                        total += info.size
+                stdin.flush()
+            channel.shutdown_write()
+            self._check(channel, "tar -x")
+        finally:
+            channel.close()
+        return BatchStats(len(paths), total, digests)
+
+    def download(
+        self, remote_root: str, paths: Sequence[str], local_root: str, algorithm: Optional[str] = None
+    ) -> BatchStats:
+        """Fetch ``paths`` (relative, ``/``-separated) from ``remote_root`` into ``local_root``."""
+        channel = self._exec(f"tar -c -f - -C {shlex.quote(remote_root)} --null -T -")
+        wanted = set(paths)
+        files = total = 0
+        digests: Optional[Dict[str, str]] = {} if algorithm else None
+        try:
+            channel.sendall(b"".join(p.encode("utf-8") + b"\0" for p in paths))
+            channel.shutdown_write()
+            try:
+                with channel.makefile("rb") as stdout:
+                    with tarfile.open(fileobj=stdout, mode="r|") as tar:
+                        for member in tar:
+                            name = posixpath.normpath(member.name)
+                            # Only regular files that were asked for; never trust names from the archive.
+                            if name not in wanted or not member.isfile():
+                                continue
+                            local_path = os.path.join(local_root, *name.split("/"))
+                            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                            digest = hashlib.new(algorithm) if algorithm else None
+                            with tar.extractfile(member) as src, open(local_path, "wb") as dst:
+                                for block in iter(lambda: src.read(1024 * 1024), b""):
+                                    dst.write(block)
+                                    if digest:
+                                        digest.update(block)
+                            if digest:
+                                digests[name] = digest.hexdigest()
+                            os.utime(local_path, (member.mtime, member.mtime))
+                            files += 1
+                            total += member.size
+            except tarfile.ReadError as e:
+                # An empty or cut-short archive; the exit status usually says why.
+                self._check(channel, "tar -c")
+                raise IOError(f"unreadable archive from tar -c: {e}") from e
+            self._check(channel, "tar -c")
+        finally:
+            channel.close()
+        if files != len(wanted):
+            raise IOError(f"tar returned {files} of {len(wanted)} files")
+        return BatchStats(files, total, digests)
+
+    def verify(self, remote_root: str, digests: Dict[str, str], algorithm: str) -> Optional[List[str]]:
+        """Return the paths whose remote digest differs from ``digests``.
+
+        Returns None when the server cannot compute digests or stops answering, so the batch is unverified.
+        """
+        paths = sorted(digests)
+        tool = ALGORITHMS[algorithm][1]
+        try:
+            channel = self.open_exec(f"cd -- {shlex.quote(remote_root)} && xargs -0 {tool} --")
+        except paramiko.SSHException:
+            return None
+        try:
+            channel.settimeout(DEFAULT_DIGEST_TIMEOUT)
+            channel.sendall(b"".join(p.encode("utf-8") + b"\0" for p in paths))
+            channel.shutdown_write()
+            with channel.makefile("rb") as stdout:
+                lines = stdout.read().decode("utf-8", "replace").splitlines()
+            if not channel.status_event.wait(DEFAULT_DIGEST_TIMEOUT):
+                return None
+            status = channel.recv_exit_status()
+        except socket.timeout:
+            return None
+        finally:
+            channel.close()
+        if status == COMMAND_NOT_FOUND or (status != 0 and not lines):
+            return None
+        # xargs keeps the input order, and names with newlines are escaped onto one line.
+        theirs = [line.split(None, 1)[0].lstrip("\\").lower() for line in lines if line.strip()]
+        if len(theirs) != len(paths):
+            return list(paths)
+        return [p for p, digest in zip(paths, theirs) if digest != digests[p]]
+
+    def _exec(self, command: str) -> paramiko.Channel:
+        try:
+            return self.open_exec(command)
+        except paramiko.SSHException as e:
+            raise BatchUnavailable(f"exec refused: {e}") from e
+
+    @staticmethod
+    def _check(channel: paramiko.Channel, what: str):
+        errors = channel.makefile_stderr("rb").read().decode("utf-8", "replace").strip()
+        status = channel.recv_exit_status()
+        if status == COMMAND_NOT_FOUND:
+            raise BatchUnavailable(f"{what} not available on the server")
+        if status != 0:
+            raise IOError(f"{what} exited with status {status}: {errors or 'no message'}")
@@ -0,0 +1,114 @@
+import os
+
+import checkpoint
+from checkpoint import HASH_WINDOW, TransferCheckpoint, hash_ranges, prefix_hash, sidecar_path
+
+
+def _write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_sidecar_is_hidden_next_to_the_file(tmp_path):
+    assert sidecar_path(str(tmp_path / "movie.mkv")) == str(tmp_path / ".movie.mkv.sftp-part")
+
+
+def test_hash_ranges_cover_both_ends_without_overlap():
+    assert hash_ranges(0) == []
+    assert hash_ranges(10) == [(0, 10)]
+    assert hash_ranges(HASH_WINDOW) == [(0, HASH_WINDOW)]
+    assert hash_ranges(HASH_WINDOW + 5) == [(0, HASH_WINDOW), (HASH_WINDOW, 5)]
+    assert hash_ranges(10 * HASH_WINDOW) == [(0, HASH_WINDOW), (9 * HASH_WINDOW, HASH_WINDOW)]
+
+
+def test_prefix_hash_depends_on_length_and_both_ends(tmp_path):
+    data = bytearray(os.urandom(4 * HASH_WINDOW))
+    path = _write(tmp_path / "f", bytes(data))
+    length = 3 * HASH_WINDOW
+    base = prefix_hash(path, length)
+    assert prefix_hash(path, length - 1) != base
+
+    data[length - 1] ^= 0xFF
+    _write(tmp_path / "f", bytes(data))
+    assert prefix_hash(path, length) != base
+
+    # The middle of a long prefix is deliberately not hashed.
+    data[length - 1] ^= 0xFF
+    data[HASH_WINDOW + 10] ^= 0xFF
+    _write(tmp_path / "f", bytes(data))
+    assert prefix_hash(path, length) == base
+
+
+def test_save_load_round_trip(tmp_path):
+    path = _write(tmp_path / "f", os.urandom(5000))
+    cp = TransferCheckpoint(path, "download", "/remote/f", 9000, 1700000000)
+    cp.update(4000)
+
+    loaded = TransferCheckpoint.load(path)
+    assert loaded is not None
+    assert (loaded.direction, loaded.remote_path, loaded.source_size, loaded.source_mtime, loaded.offset) == (
+        "download", "/remote/f", 9000, 1700000000, 4000
+    )
+    assert loaded.committed == 4000
+    assert loaded.verify_prefix()
+    assert not os.path.exists(cp.path + ".tmp")
+
+
+def test_load_rejects_missing_and_corrupt_sidecars(tmp_path):
+    path = str(tmp_path / "f")
+    assert TransferCheckpoint.load(path) is None
+    with open(sidecar_path(path), "w") as f:
+        f.write("{not json")
+    assert TransferCheckpoint.load(path) is None
+    with open(sidecar_path(path), "w") as f:
+        f.write('{"direction": "upload"}')
+    assert TransferCheckpoint.load(path) is None
+
+
+def test_matches_refuses_a_changed_source():
+    cp = TransferCheckpoint("/l", "upload", "/r", 100, 50, offset=40)
+    assert cp.matches("upload", "/r", 100, 50.9)
+    assert not cp.matches("download", "/r", 100, 50)
+    assert not cp.matches("upload", "/other", 100, 50)
+    assert not cp.matches("upload", "/r", 101, 50)
+    assert not cp.matches("upload", "/r", 100, 51)
+    # Nothing committed yet, or more committed than the source has, is not resumable.
+    assert not TransferCheckpoint("/l", "upload", "/r", 100, 50, offset=0).matches("upload", "/r", 100, 50)
+    assert not TransferCheckpoint("/l", "upload", "/r", 100, 50, offset=101).matches("upload", "/r", 100, 50)
+
+
+def test_verify_prefix_catches_changed_or_truncated_data(tmp_path):
+    path = _write(tmp_path / "f", os.urandom(4000))
+    cp = TransferCheckpoint(path, "download", "/r", 4000, 1)
+    cp.update(3000)
+    assert cp.verify_prefix()
+
+    with open(path, "r+b") as f:
+        f.write(b"\0" * 10)
+    assert not cp.verify_prefix()
+
+    _write(tmp_path / "f", os.urandom(2000))
+    assert not cp.verify_prefix()
+    os.remove(path)
+    assert not cp.verify_prefix()
+
+
+def test_commit_saves_at_most_every_interval_and_flush_saves_the_rest(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(checkpoint.time, "monotonic", lambda: now[0])
+    path = _write(tmp_path / "f", os.urandom(1000))
+    cp = TransferCheckpoint(path, "download", "/r", 1000, 1)
+
+    cp.commit(100)
+    assert TransferCheckpoint.load(path).offset == 100
+    now[0] += checkpoint.SAVE_INTERVAL / 2
+    cp.commit(200)
+    assert TransferCheckpoint.load(path).offset == 100
+    assert cp.committed == 200
+
+    cp.flush()
+    assert TransferCheckpoint.load(path).offset == 200
+
+    cp.remove()
+    assert TransferCheckpoint.load(path) is None
+    cp.remove()
@@ -0,0 +1,94 @@
+import errno
+import os
+
+import pytest
+from paramiko import SFTPServer
+
+from benchmarks import server
+from benchmarks.server import StandInServer
+from remote_sftp import RemoteSFTP
+
+# root/
+#   top.txt
+#   a/ x.log  b/ z.log  c/ deep.txt
+#   skip/ hidden.txt
+TREE = ["top.txt", "a/x.log", "a/b/z.log", "a/b/c/deep.txt", "skip/hidden.txt"]
+
+
+@pytest.fixture(scope="module")
+def root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tree")
+    for rel in TREE:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(rel)
+    return str(root)
+
+
+@pytest.fixture(scope="module")
+def remote(tmp_path_factory):
+    srv = StandInServer(latency=0.0)
+    known_hosts = tmp_path_factory.mktemp("ssh") / "known_hosts"
+    known_hosts.write_text(srv.known_hosts_line())
+    remote = RemoteSFTP(known_hosts_path=str(known_hosts))
+    assert remote.connect("127.0.0.1", srv.port, srv.username, srv.password)
+    yield remote
+    remote.disconnect()
+    srv.close()
+
+
+def _crawl(remote, root, **kwargs):
+    return [os.path.relpath(path, root) for path, _ in remote.crawl(root, **kwargs)]
+
+
+def test_crawl_yields_every_entry_with_folders_before_their_contents(remote, root):
+    rels = _crawl(remote, root)
+    assert sorted(rels) == sorted(TREE + ["a", "a/b", "a/b/c", "skip"])
+    for rel in rels:
+        parent = os.path.dirname(rel)
+        if parent:
+            assert rels.index(parent) < rels.index(rel)
+
+
+def test_max_depth_limits_how_far_down_the_crawl_goes(remote, root):
+    assert sorted(_crawl(remote, root, max_depth=1)) == ["a", "skip", "top.txt"]
+    assert sorted(_crawl(remote, root, max_depth=2)) == ["a", "a/b", "a/x.log", "skip", "skip/hidden.txt", "top.txt"]
+
+
+def test_exclude_prunes_whole_subtrees_by_name_or_relative_path(remote, root):
+    assert sorted(_crawl(remote, root, exclude=["skip", "b"])) == ["a", "a/x.log", "top.txt"]
+    assert sorted(_crawl(remote, root, exclude=["a/b/*"])) == sorted(
+        ["a", "a/b", "a/x.log", "skip", "skip/hidden.txt", "top.txt"])
+
+
+def test_include_filters_records_but_still_descends(remote, root):
+    assert sorted(_crawl(remote, root, include=["*.log"])) == ["a/b/z.log", "a/x.log"]
+    assert sorted(_crawl(remote, root, include=["*.txt"], exclude=["skip"])) == ["a/b/c/deep.txt", "top.txt"]
+
+
+@pytest.fixture
+def unreadable(monkeypatch, root):
+    """Make ``a/b`` fail to list; permissions do not stop root, so fail it in the server."""
+    blocked = os.path.join(root, "a", "b")
+    list_folder = server._FileSystem.list_folder
+
+    def guarded(self, path):
+        if os.path.normpath(path) == blocked:
+            return SFTPServer.convert_errno(errno.EACCES)
+        return list_folder(self, path)
+
+    monkeypatch.setattr(server._FileSystem, "list_folder", guarded)
+    return blocked
+
+
+def test_unreadable_folder_goes_to_on_error_and_the_crawl_goes_on(remote, root, unreadable):
+    errors = []
+    rels = _crawl(remote, root, on_error=lambda path, e: errors.append((path, e)))
+    assert sorted(rels) == ["a", "a/b", "a/x.log", "skip", "skip/hidden.txt", "top.txt"]
+    assert [path for path, _ in errors] == [unreadable]
+    assert isinstance(errors[0][1], PermissionError)
+
+
+def test_unreadable_folder_raises_without_on_error(remote, root, unreadable):
+    with pytest.raises(PermissionError):
+        _crawl(remote, root)
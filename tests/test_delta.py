@@ -0,0 +1,156 @@
+import hashlib
+import io
+import os
+import shlex
+import subprocess
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from delta import DeltaUpload, block_signature
+from integrity import StreamHasher
+
+BLOCK = 1024
+
+
+class _ExecChannel:
+    """Runs an exec command locally, the way the server would."""
+
+    def __init__(self, command: str):
+        done = subprocess.run(shlex.split(command), capture_output=True)
+        self.stdout = done.stdout.decode()
+        self.status = done.returncode
+
+    def makefile(self, mode):
+        return io.StringIO(self.stdout)
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        pass
+
+
+class _File(io.BytesIO):
+    def stat(self):
+        return SimpleNamespace(st_size=len(self.getvalue()))
+
+    def readv(self, chunks):
+        for offset, size in chunks:
+            yield self.getvalue()[offset:offset + size]
+
+
+class _SFTP:
+    def open(self, path, mode):
+        with open(path, "rb") as f:
+            return _File(f.read())
+
+
+@contextmanager
+def _channel():
+    yield _SFTP()
+
+
+class _Transfer:
+    def __init__(self):
+        self.calls = []
+
+    def upload_ranges(self, local_path, remote_path, ranges, progress=None, cancel=None):
+        self.calls.append((remote_path, ranges, cancel))
+        return sum(length for _, length in ranges)
+
+
+def _files(tmp_path, remote: bytes, local: bytes):
+    (tmp_path / "remote").write_bytes(remote)
+    (tmp_path / "local").write_bytes(local)
+    return str(tmp_path / "local"), str(tmp_path / "remote")
+
+
+def test_block_signature_pairs_adler32_with_sha256():
+    weak, strong = block_signature(b"abc")
+    assert weak == 0x024D0127
+    assert strong == hashlib.sha256(b"abc").hexdigest()
+
+
+def test_changed_ranges_are_block_aligned_and_coalesced(tmp_path):
+    remote = os.urandom(10 * BLOCK)
+    local = bytearray(remote)
+    local[1 * BLOCK + 5] ^= 1
+    local[2 * BLOCK] ^= 1
+    local[7 * BLOCK + 100] ^= 1
+    local += b"tail"
+    local_path, _ = _files(tmp_path, remote, bytes(local))
+    delta = DeltaUpload(_Transfer(), _channel, block_size=BLOCK)
+    signatures = [block_signature(remote[o:o + BLOCK]) for o in range(0, len(remote), BLOCK)]
+
+    ranges, blocks, matched = delta.changed_ranges(local_path, signatures)
+    assert ranges == [(1 * BLOCK, 2 * BLOCK), (7 * BLOCK, BLOCK), (10 * BLOCK, 4)]
+    assert (blocks, matched) == (11, 7)
+
+
+def test_shifted_content_is_resent_from_the_insert(tmp_path):
+    remote = os.urandom(4 * BLOCK)
+    local = remote[:BLOCK] + b"x" + remote[BLOCK:]
+    local_path, _ = _files(tmp_path, remote, local)
+    delta = DeltaUpload(_Transfer(), _channel, block_size=BLOCK)
+    signatures = [block_signature(remote[o:o + BLOCK]) for o in range(0, len(remote), BLOCK)]
+
+    ranges, _, matched = delta.changed_ranges(local_path, signatures)
+    assert matched == 1
+    assert ranges == [(BLOCK, len(local) - BLOCK)]
+
+
+def test_a_weak_checksum_collision_is_not_a_match(tmp_path):
+    local_path, _ = _files(tmp_path, b"", b"a" * BLOCK)
+    delta = DeltaUpload(_Transfer(), _channel, block_size=BLOCK)
+    weak, _ = block_signature(b"a" * BLOCK)
+    ranges, _, matched = delta.changed_ranges(local_path, [(weak, "0" * 64)])
+    assert (ranges, matched) == ([(0, BLOCK)], 0)
+
+
+def test_matching_pass_feeds_the_whole_local_file_to_the_hasher(tmp_path):
+    local = os.urandom(3 * BLOCK + 17)
+    local_path, _ = _files(tmp_path, local, local)
+    delta = DeltaUpload(_Transfer(), _channel, block_size=BLOCK)
+    hasher = StreamHasher()
+    delta.changed_ranges(local_path, [], hasher)
+    assert hasher.hexdigest(len(local)) == hashlib.sha256(local).hexdigest()
+
+
+def test_exec_and_read_signatures_agree(tmp_path):
+    _, remote_path = _files(tmp_path, os.urandom(5 * BLOCK + 3), b"")
+    by_exec = DeltaUpload(_Transfer(), _channel, _ExecChannel, block_size=BLOCK)
+    by_read = DeltaUpload(_Transfer(), _channel, block_size=BLOCK)
+
+    exec_signatures, method = by_exec.remote_signatures(remote_path)
+    assert method == "exec"
+    read_signatures, method = by_read.remote_signatures(remote_path)
+    assert method == "read"
+    assert exec_signatures == read_signatures
+    assert len(exec_signatures) == 6
+
+
+def test_failed_remote_signer_falls_back_to_reading(tmp_path):
+    _, remote_path = _files(tmp_path, os.urandom(2 * BLOCK), b"")
+    delta = DeltaUpload(_Transfer(), _channel, lambda command: _ExecChannel("false"), block_size=BLOCK)
+    signatures, method = delta.remote_signatures(remote_path)
+    assert method == "read"
+    assert len(signatures) == 2
+
+
+def test_upload_sends_only_changed_ranges_and_passes_cancel(tmp_path):
+    remote = os.urandom(4 * BLOCK)
+    local = remote[:2 * BLOCK] + os.urandom(BLOCK) + remote[3 * BLOCK:]
+    local_path, remote_path = _files(tmp_path, remote, local)
+    transfer = _Transfer()
+    cancel = object()
+
+    stats = DeltaUpload(transfer, _channel, block_size=BLOCK).upload(local_path, remote_path, cancel=cancel)
+    assert transfer.calls == [(remote_path, [(2 * BLOCK, BLOCK)], cancel)]
+    assert (stats.total, stats.sent, stats.blocks, stats.matched, stats.method) == (4 * BLOCK, BLOCK, 4, 3, "read")
+
+
+@pytest.mark.parametrize("block_size", [0, -5])
+def test_block_size_is_at_least_one(block_size):
+    assert DeltaUpload(_Transfer(), _channel, block_size=block_size).block_size == 1
@@ -0,0 +1,71 @@
+import dir_cache
+from dir_cache import DirectoryCache
+
+
+def _clock(monkeypatch, start: float = 1000.0):
+    now = [start]
+    monkeypatch.setattr(dir_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_returns_what_was_put():
+    cache = DirectoryCache()
+    assert cache.get("/a") is None
+    cache.put("/a", ["x"])
+    assert cache.get("/a") == ["x"]
+    cache.put("/a", ["y"])
+    assert cache.get("/a") == ["y"]
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = DirectoryCache(ttl=30.0)
+    cache.put("/a", 1)
+    now[0] += 30.0
+    assert cache.get("/a") == 1
+    now[0] += 0.1
+    assert cache.get("/a") is None
+    # An expired entry is dropped, not just hidden.
+    now[0] -= 10.0
+    assert cache.get("/a") is None
+
+
+def test_put_refreshes_the_ttl(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = DirectoryCache(ttl=10.0)
+    cache.put("/a", 1)
+    now[0] += 8.0
+    cache.put("/a", 2)
+    now[0] += 8.0
+    assert cache.get("/a") == 2
+
+
+def test_least_recently_used_path_is_evicted():
+    cache = DirectoryCache(max_entries=2)
+    cache.put("/a", 1)
+    cache.put("/b", 2)
+    assert cache.get("/a") == 1
+    cache.put("/c", 3)
+    assert cache.get("/b") is None
+    assert cache.get("/a") == 1
+    assert cache.get("/c") == 3
+
+
+def test_max_entries_is_at_least_one():
+    cache = DirectoryCache(max_entries=0)
+    cache.put("/a", 1)
+    assert cache.get("/a") == 1
+    cache.put("/b", 2)
+    assert cache.get("/a") is None
+
+
+def test_invalidate_and_clear():
+    cache = DirectoryCache()
+    cache.put("/a", 1)
+    cache.put("/b", 2)
+    cache.invalidate("/a")
+    cache.invalidate("/missing")
+    assert cache.get("/a") is None
+    assert cache.get("/b") == 2
+    cache.clear()
+    assert cache.get("/b") is None
@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import hmac
+import os
+import stat
+
+import paramiko
+import pytest
+
+from host_keys import KnownHostsStore, host_entry_name, known_hosts
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return [paramiko.ECDSAKey.generate() for _ in range(3)]
+
+
+def _line(names: str, key: paramiko.PKey) -> str:
+    return f"{names} {key.get_name()} {key.get_base64()}\n"
+
+
+def _hashed(name: str) -> str:
+    salt = os.urandom(20)
+    digest = hmac.new(salt, name.encode(), hashlib.sha1).digest()
+    return f"|1|{base64.b64encode(salt).decode()}|{base64.b64encode(digest).decode()}"
+
+
+def _fingerprints(found):
+    return [k.get_base64() for k in found]
+
+
+def test_entry_names_bracket_non_default_ports():
+    assert host_entry_name("example.org", 22) == "example.org"
+    assert host_entry_name("example.org", 2222) == "[example.org]:2222"
+
+
+def test_plain_entries_are_found_by_any_of_their_names(tmp_path, keys):
+    path = tmp_path / "known_hosts"
+    path.write_text(
+        "# comment\n"
+        + _line("a.example,10.0.0.1", keys[0])
+        + _line("[a.example]:2222", keys[1])
+        + "@cert-authority *.example " + keys[2].get_name() + " " + keys[2].get_base64() + "\n"
+        + "garbage\n"
+    )
+    store = KnownHostsStore(str(path))
+    assert _fingerprints(store.lookup("a.example")) == [keys[0].get_base64()]
+    assert _fingerprints(store.lookup("10.0.0.1")) == [keys[0].get_base64()]
+    assert _fingerprints(store.lookup("a.example", 2222)) == [keys[1].get_base64()]
+    assert store.lookup("b.example") == []
+    assert store.lookup("x.example") == []
+
+
+def test_hashed_entries_match_only_their_host(tmp_path, keys):
+    path = tmp_path / "known_hosts"
+    path.write_text(_line(_hashed("[h.example]:2200"), keys[0]) + _line("|1|broken", keys[1]))
+    store = KnownHostsStore(str(path))
+    assert _fingerprints(store.lookup("h.example", 2200)) == [keys[0].get_base64()]
+    assert store.lookup("h.example") == []
+
+
+def test_file_is_parsed_again_when_it_changes(tmp_path, keys):
+    path = tmp_path / "known_hosts"
+    path.write_text(_line("a.example", keys[0]))
+    store = KnownHostsStore(str(path))
+    assert store.lookup("b.example") == []
+    with open(path, "a") as f:
+        f.write(_line("b.example", keys[1]))
+    assert _fingerprints(store.lookup("b.example")) == [keys[1].get_base64()]
+
+
+def test_add_appends_once_and_keeps_the_file_mode(tmp_path, keys):
+    path = tmp_path / "known_hosts"
+    path.write_text(_line("a.example", keys[0]).rstrip("\n"))
+    os.chmod(path, 0o644)
+    store = KnownHostsStore(str(path))
+
+    assert store.add("b.example", 2222, keys[1])
+    assert not store.add("b.example", 2222, keys[1])
+    assert not store.add("a.example", 22, keys[0])
+    assert path.read_text() == _line("a.example", keys[0]) + _line("[b.example]:2222", keys[1])
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert _fingerprints(store.lookup("b.example", 2222)) == [keys[1].get_base64()]
+
+
+def test_add_creates_a_private_file(tmp_path, keys):
+    path = tmp_path / "ssh" / "known_hosts"
+    store = KnownHostsStore(str(path))
+    assert store.lookup("a.example") == []
+    assert store.add("a.example", 22, keys[0])
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert _fingerprints(KnownHostsStore(str(path)).lookup("a.example")) == [keys[0].get_base64()]
+
+
+def test_an_added_key_stays_trusted_when_the_file_cannot_be_written(tmp_path, keys, monkeypatch):
+    path = tmp_path / "known_hosts"
+    path.write_text(_line("a.example", keys[0]))
+    store = KnownHostsStore(str(path))
+
+    def fail(*args):
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(KnownHostsStore, "_write", staticmethod(fail))
+    with pytest.raises(PermissionError):
+        store.add("b.example", 22, keys[1])
+    assert _fingerprints(store.lookup("b.example")) == [keys[1].get_base64()]
+    # Still trusted after the file is parsed again.
+    with open(path, "a") as f:
+        f.write(_line("c.example", keys[2]))
+    assert _fingerprints(store.lookup("b.example")) == [keys[1].get_base64()]
+    assert path.read_text().count("b.example") == 0
+
+
+def test_known_hosts_shares_one_store_per_file(tmp_path):
+    path = str(tmp_path / "known_hosts")
+    assert known_hosts(path) is known_hosts(path)
+    assert known_hosts(path) is not known_hosts(str(tmp_path / "other"))
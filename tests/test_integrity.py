@@ -0,0 +1,189 @@
+import hashlib
+import io
+import os
+import socket
+import threading
+
+import paramiko
+import pytest
+
+from integrity import HasherAborted, StreamHasher, remote_digest
+
+TIMEOUT = 5.0
+
+
+def _pieces(data: bytes, size: int):
+    return [(o, data[o:o + size]) for o in range(0, len(data), size)]
+
+
+def test_pieces_in_any_order_give_the_front_to_back_digest():
+    data = os.urandom(10_000)
+    pieces = _pieces(data, 999)
+    hasher = StreamHasher()
+    for offset, piece in reversed(pieces):
+        hasher.update(offset, piece)
+    assert hasher.hexdigest(len(data)) == hashlib.sha256(data).hexdigest()
+
+
+def test_blake2b_is_supported_and_unknown_algorithms_are_not():
+    hasher = StreamHasher("blake2b")
+    hasher.update(0, b"abc")
+    assert hasher.hexdigest(3) == hashlib.blake2b(b"abc").hexdigest()
+    with pytest.raises(ValueError):
+        StreamHasher("md5")
+
+
+def test_digest_refuses_a_gap_or_wrong_length():
+    hasher = StreamHasher()
+    hasher.update(0, b"ab")
+    hasher.update(4, b"ef")
+    with pytest.raises(ValueError):
+        hasher.hexdigest(6)
+    hasher.update(2, b"cd")
+    with pytest.raises(ValueError):
+        hasher.hexdigest(7)
+    assert hasher.hexdigest(6) == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_held_pieces_are_copied_out_of_reused_buffers():
+    buffer = bytearray(b"later")
+    hasher = StreamHasher()
+    hasher.update(5, memoryview(buffer))
+    buffer[:] = b"XXXXX"
+    hasher.update(0, b"first")
+    assert hasher.hexdigest(10) == hashlib.sha256(b"firstlater").hexdigest()
+
+
+def test_feed_file_covers_the_skipped_prefix(tmp_path):
+    data = os.urandom(5000)
+    (tmp_path / "f").write_bytes(data)
+    hasher = StreamHasher()
+    hasher.feed_file(str(tmp_path / "f"), 3000)
+    hasher.update(3000, data[3000:])
+    assert hasher.hexdigest(5000) == hashlib.sha256(data).hexdigest()
+    with pytest.raises(EOFError):
+        StreamHasher().feed_file(str(tmp_path / "f"), 6000)
+
+
+def test_out_of_order_callers_wait_once_max_held_is_reached():
+    hasher = StreamHasher(max_held=4)
+    hasher.update(4, b"bbbb")
+    blocked = threading.Event()
+    finished = threading.Event()
+
+    def ahead():
+        blocked.set()
+        hasher.update(8, b"cccc")
+        finished.set()
+
+    worker = threading.Thread(target=ahead)
+    worker.start()
+    assert blocked.wait(TIMEOUT)
+    assert not finished.wait(0.2)
+    # The piece at the expected offset never waits, and filling the gap lets the other one in.
+    hasher.update(0, b"aaaa")
+    assert finished.wait(TIMEOUT)
+    worker.join(TIMEOUT)
+    assert hasher.hexdigest(12) == hashlib.sha256(b"aaaabbbbcccc").hexdigest()
+
+
+def test_abort_releases_waiters_and_refuses_later_updates():
+    hasher = StreamHasher(max_held=1)
+    hasher.update(10, b"x")
+    errors = []
+
+    def ahead():
+        try:
+            hasher.update(20, b"y")
+        except HasherAborted as e:
+            errors.append(str(e))
+
+    worker = threading.Thread(target=ahead)
+    worker.start()
+    worker.join(0.2)
+    assert worker.is_alive()
+    hasher.abort("transfer failed")
+    worker.join(TIMEOUT)
+    assert errors == ["transfer failed"]
+    with pytest.raises(HasherAborted):
+        hasher.update(0, b"z")
+
+
+class _File:
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def check(self, name):
+        if self.digest is None:
+            raise IOError("check-file not supported")
+        return self.digest
+
+
+class _SFTP:
+    def __init__(self, digest=None):
+        self.digest = digest
+
+    def open(self, path, mode):
+        return _File(self.digest)
+
+
+class _ExecChannel:
+    def __init__(self, output=b"", status=0, stall=False):
+        self.output = output
+        self.status = status
+        self.stall = stall
+        self.timeout = None
+        self.status_event = threading.Event()
+        if not stall:
+            self.status_event.set()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def makefile(self, mode):
+        if self.stall:
+            raise socket.timeout("timed out")
+        return io.BytesIO(self.output)
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        pass
+
+
+def test_remote_digest_prefers_the_check_file_extension():
+    assert remote_digest(_SFTP(bytes.fromhex("ab01")), None, "/f") == "ab01"
+
+
+def test_remote_digest_falls_back_to_the_exec_tool():
+    commands = []
+
+    def open_exec(command):
+        commands.append(command)
+        return _ExecChannel(b"\\ABCDEF  /odd\\nname\n")
+
+    assert remote_digest(_SFTP(), open_exec, "/odd\nname", "blake2b") == "abcdef"
+    assert commands[0].startswith("b2sum -- ")
+
+
+def test_remote_digest_is_none_when_nothing_can_compute_it():
+    assert remote_digest(_SFTP(), None, "/f") is None
+    assert remote_digest(_SFTP(), lambda c: _ExecChannel(b"", status=127), "/f") is None
+
+    def refused(command):
+        raise paramiko.SSHException("exec refused")
+
+    assert remote_digest(_SFTP(), refused, "/f") is None
+
+
+def test_remote_digest_gives_up_on_a_stalled_exec():
+    channel = _ExecChannel(stall=True)
+    assert remote_digest(_SFTP(), lambda c: channel, "/f", timeout=1.5) is None
+    assert channel.timeout == 1.5
@@ -0,0 +1,197 @@
+import os
+import stat
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import paramiko
+import pytest
+
+import remote_index
+from metrics import Metrics
+from remote_index import RemoteIndex
+
+OLD = int(time.time()) - 3600
+
+
+def _attr(name: str, size: int = 0, mtime: int = OLD, folder: bool = False) -> paramiko.SFTPAttributes:
+    attr = paramiko.SFTPAttributes()
+    attr.filename, attr.st_size, attr.st_mtime = name, size, mtime
+    attr.st_mode = (stat.S_IFDIR | 0o755) if folder else (stat.S_IFREG | 0o644)
+    return attr
+
+
+def _names(attrs):
+    return [a.filename for a in attrs]
+
+
+@pytest.fixture
+def index():
+    index = RemoteIndex("user@example.org:22", ":memory:")
+    yield index
+    index.close()
+
+
+def test_listing_round_trip(index):
+    assert index.listing("/data") is None
+    index.store("/data/", [_attr("b.txt", 5), _attr("a", folder=True)], mtime=OLD)
+    listing = index.listing("/data")
+    assert _names(listing) == ["a", "b.txt"]
+    assert listing[1].st_size == 5 and stat.S_ISDIR(listing[0].st_mode)
+    index.store("/empty", [])
+    assert index.listing("/empty") == []
+
+
+def test_store_drops_the_subtrees_of_vanished_folders(index):
+    index.store("/", [_attr("keep", folder=True), _attr("gone", folder=True)])
+    index.store("/keep", [_attr("k")])
+    index.store("/gone", [_attr("sub", folder=True)])
+    index.store("/gone/sub", [_attr("deep")])
+    index.store("/goner", [_attr("unrelated")])
+
+    index.store("/", [_attr("keep", folder=True), _attr("gonefile")])
+    assert index.listing("/gone") is None
+    assert index.listing("/gone/sub") is None
+    assert _names(index.listing("/keep")) == ["k"]
+    assert _names(index.listing("/goner")) == ["unrelated"]
+
+
+def test_search_filters(index):
+    index.store("/a", [_attr("x.log", 10, OLD), _attr("y.txt", 2000, OLD + 100), _attr("b", folder=True)])
+    index.store("/a/b", [_attr("z.log", 500, OLD + 200)])
+    index.store("/ab", [_attr("w.log", 1, OLD)])
+
+    def paths(**kwargs):
+        return [e.path for e in index.search(**kwargs)]
+
+    assert paths(name="*.log") == ["/a/x.log", "/a/b/z.log", "/ab/w.log"]
+    assert paths(name="*.log", under="/a") == ["/a/x.log", "/a/b/z.log"]
+    assert paths(under="/a/b") == ["/a/b/z.log"]
+    assert paths(min_size=100, max_size=1000) == ["/a/b/z.log"]
+    assert paths(newer_than=OLD + 50, older_than=OLD + 150) == ["/a/y.txt"]
+    assert paths(name="*.LOG") == []
+    assert len(index.search(limit=2)) == 2
+    assert [e.is_dir for e in index.search(name="b")] == [True]
+
+
+def test_hosts_share_a_database_without_seeing_each_other(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    first, second = RemoteIndex("one", path), RemoteIndex("two", path)
+    try:
+        first.store("/", [_attr("mine")])
+        assert second.listing("/") is None
+        assert second.search() == []
+        second.forget("/")
+        assert _names(first.listing("/")) == ["mine"]
+    finally:
+        first.close()
+        second.close()
+
+
+class _SFTP:
+    """Serves a local directory tree the way ``refresh`` reads a remote one."""
+
+    def __init__(self, unreadable):
+        self.unreadable = unreadable
+
+    def stat(self, path):
+        return SimpleNamespace(st_mtime=int(os.stat(path).st_mtime))
+
+    def pages(self, path):
+        if path in self.unreadable:
+            raise PermissionError(13, "Permission denied", path)
+        attrs = []
+        for entry in os.scandir(path):
+            st = entry.stat(follow_symlinks=False)
+            attrs.append(_attr(entry.name, st.st_size, int(st.st_mtime), entry.is_dir(follow_symlinks=False)))
+        yield attrs
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    root = tmp_path / "tree"
+    for folder in ("a", "a/deep", "b", "c"):
+        (root / folder).mkdir(parents=True)
+        (root / folder / "file").write_bytes(b"x" * 10)
+    for folder in ("a/deep", "a", "b", "c", ""):
+        os.utime(root / folder, (OLD, OLD))
+
+    sftp = _SFTP(set())
+
+    @contextmanager
+    def channel():
+        yield sftp
+
+    monkeypatch.setattr(remote_index, "iter_dir_pages", lambda sftp, path: sftp.pages(path))
+    remote = SimpleNamespace(pool=SimpleNamespace(size=4, channel=channel), metrics=Metrics())
+    return str(root), remote, sftp
+
+
+def test_refresh_lists_only_changed_folders(index, tree):
+    root, remote, _ = tree
+    first = index.refresh(remote, root)
+    assert (first.listed, first.unchanged, first.removed, first.failed) == (5, 0, 0, 0)
+    assert first.entries == 8
+    assert len(index.search(name="file", under=root)) == 4
+
+    again = index.refresh(remote, root)
+    assert (again.listed, again.unchanged) == (0, 5)
+
+    # Adding a file moves only its folder's mtime.
+    open(os.path.join(root, "a", "deep", "new"), "wb").close()
+    os.utime(os.path.join(root, "a", "deep"), (OLD + 10, OLD + 10))
+    changed = index.refresh(remote, root)
+    assert (changed.listed, changed.unchanged) == (1, 4)
+    assert "new" in _names(index.listing(os.path.join(root, "a", "deep")))
+
+    assert index.refresh(remote, root, full=True).listed == 5
+
+
+def test_refresh_relists_a_folder_changed_right_before_it_was_listed(index, tree):
+    root, remote, _ = tree
+    racy = os.path.join(root, "b")
+    os.utime(racy, None)
+    index.refresh(remote, root)
+    again = index.refresh(remote, root)
+    assert (again.listed, again.unchanged) == (1, 4)
+
+
+def test_refresh_forgets_folders_that_are_gone(index, tree):
+    root, remote, _ = tree
+    index.refresh(remote, root)
+    gone = os.path.join(root, "a")
+    for name in ("deep/file", "file"):
+        os.remove(os.path.join(gone, name))
+    os.rmdir(os.path.join(gone, "deep"))
+    os.rmdir(gone)
+    os.utime(root, (OLD + 10, OLD + 10))
+
+    stats = index.refresh(remote, root)
+    assert index.listing(gone) is None
+    assert index.listing(os.path.join(gone, "deep")) is None
+    assert index.search(under=gone) == []
+    assert stats.listed == 1
+
+
+def test_refresh_skips_unreadable_folders_and_reports_them(index, tree):
+    root, remote, sftp = tree
+    bad = os.path.join(root, "a")
+    sftp.unreadable.add(bad)
+    errors = []
+    stats = index.refresh(remote, root, on_error=lambda path, e: errors.append(path))
+    assert errors == [bad]
+    assert (stats.listed, stats.failed) == (3, 1)
+    assert "1 unreadable" in stats.summary()
+    assert index.listing(bad) is None
+    assert remote.metrics.errors() == {("listdir", "PermissionError"): 1}
+
+
+def test_refresh_lets_a_lost_connection_raise(index, tree):
+    root, remote, sftp = tree
+
+    def lost(path):
+        raise ConnectionResetError("connection lost")
+
+    sftp.pages = lost
+    with pytest.raises(ConnectionResetError):
+        index.refresh(remote, root)
@@ -0,0 +1,174 @@
+import threading
+
+import pytest
+
+from integrity import TransferResult
+from scheduler import CANCELLED, DONE, FAILED, PAUSED, QUEUED, RUNNING, TransferScheduler
+
+TIMEOUT = 5.0
+
+
+class _Remote:
+    """Stands in for RemoteSFTP; each transfer blocks until ``release`` is set or it is cancelled."""
+
+    def __init__(self, host="example.org", port=22):
+        self.host = host
+        self.port = port
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.ran = []
+        self.fail = set()
+
+    def _remote_path(self, name):
+        return "/home/" + name
+
+    def upload_file(self, local_path, remote_path, progress=None, cancel=None):
+        self.ran.append(local_path)
+        self.started.release()
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                return TransferResult(False, error="cancelled")
+        if local_path in self.fail:
+            return TransferResult(False, error="disk full")
+        progress(10, 10)
+        return TransferResult(True, 10)
+
+    def download_file(self, remote_path, local_path, progress=None, cancel=None):
+        return self.upload_file(local_path, remote_path, progress, cancel)
+
+
+@pytest.fixture
+def scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        s = TransferScheduler(**kwargs)
+        schedulers.append(s)
+        return s
+
+    yield make
+    for s in schedulers:
+        s.shutdown(cancel_running=True)
+
+
+def _started(remote):
+    assert remote.started.acquire(timeout=TIMEOUT)
+
+
+def test_jobs_run_by_priority_then_submission_order(scheduler):
+    remote = _Remote()
+    s = scheduler(workers=1)
+    blocker = s.submit_upload(remote, "blocker", "b")
+    _started(remote)
+    s.submit_upload(remote, "low", "x", priority=0)
+    s.submit_upload(remote, "high", "x", priority=5)
+    s.submit_upload(remote, "low2", "x", priority=0)
+    s.submit_upload(remote, "high2", "x", priority=5)
+    remote.release.set()
+    assert s.wait(TIMEOUT)
+    assert remote.ran == ["blocker", "high", "high2", "low", "low2"]
+    assert blocker.state == DONE
+    assert blocker.remote_path == "/home/b"
+
+
+def test_per_host_limit_lets_other_hosts_through(scheduler):
+    busy, other = _Remote("busy"), _Remote("other")
+    s = scheduler(workers=3, per_host_limit=1)
+    s.submit_upload(busy, "busy1", "x")
+    _started(busy)
+    queued = s.submit_upload(busy, "busy2", "x")
+    s.submit_upload(other, "other1", "x")
+    _started(other)
+    assert queued.state == QUEUED
+    busy.release.set()
+    other.release.set()
+    assert s.wait(TIMEOUT)
+    assert busy.ran == ["busy1", "busy2"]
+
+
+def test_cancel_queued_and_running_jobs(scheduler):
+    remote = _Remote()
+    s = scheduler(workers=1)
+    running = s.submit_upload(remote, "running", "x")
+    _started(remote)
+    queued = s.submit_upload(remote, "queued", "x")
+
+    assert s.cancel(queued.id)
+    assert queued.state == CANCELLED
+    assert s.cancel(running.id)
+    assert s.wait(TIMEOUT)
+    assert running.state == CANCELLED
+    assert remote.ran == ["running"]
+    assert not s.cancel(running.id)
+    assert not s.cancel(12345)
+
+
+def test_pause_and_resume(scheduler):
+    remote = _Remote()
+    s = scheduler(workers=1)
+    running = s.submit_upload(remote, "running", "x")
+    _started(remote)
+    queued = s.submit_upload(remote, "queued", "x")
+
+    assert s.pause(queued.id)
+    assert queued.state == PAUSED
+    assert s.pause(running.id)
+    assert s.wait(TIMEOUT)
+    assert running.state == PAUSED
+    assert not s.resume(12345)
+
+    remote.release.set()
+    assert s.resume(running.id)
+    assert s.resume(queued.id)
+    assert not s.resume(queued.id)
+    assert s.wait(TIMEOUT)
+    assert (running.state, queued.state) == (DONE, DONE)
+    assert remote.ran == ["running", "running", "queued"]
+
+
+def test_paused_and_resumed_job_runs_once(scheduler):
+    remote = _Remote()
+    s = scheduler(workers=1)
+    s.submit_upload(remote, "blocker", "x")
+    _started(remote)
+    job = s.submit_upload(remote, "job", "x")
+    s.pause(job.id)
+    s.resume(job.id)
+    remote.release.set()
+    assert s.wait(TIMEOUT)
+    assert remote.ran == ["blocker", "job"]
+
+
+def test_set_priority_moves_a_queued_job(scheduler):
+    remote = _Remote()
+    s = scheduler(workers=1)
+    running = s.submit_upload(remote, "blocker", "x")
+    _started(remote)
+    s.submit_upload(remote, "first", "x", priority=1)
+    last = s.submit_upload(remote, "last", "x")
+    assert s.set_priority(last.id, 2)
+    assert not s.set_priority(running.id, 9)
+    remote.release.set()
+    assert s.wait(TIMEOUT)
+    assert remote.ran == ["blocker", "last", "first"]
+
+
+def test_failed_job_keeps_its_error_and_updates_are_reported(scheduler):
+    remote = _Remote()
+    remote.fail.add("bad")
+    remote.release.set()
+    seen = []
+    s = scheduler(workers=1, on_update=lambda job: seen.append((job.local_path, job.state)))
+    job = s.submit_upload(remote, "bad", "x")
+    assert s.wait(TIMEOUT)
+    assert (job.state, job.error) == (FAILED, "disk full")
+    assert ("bad", QUEUED) in seen and ("bad", RUNNING) in seen and seen[-1] == ("bad", FAILED)
+    assert s.counts() == {FAILED: 1}
+    assert s.jobs()[0]["error"] == "disk full"
+
+
+def test_submit_after_shutdown_is_refused(scheduler):
+    s = scheduler(workers=1)
+    s.shutdown()
+    with pytest.raises(RuntimeError):
+        s.submit_upload(_Remote(), "late", "x")
@@ -0,0 +1,371 @@
+import errno
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager
+from typing import Callable, Deque, List, Optional, Tuple
+
+import paramiko
+from paramiko.message import Message
+from paramiko.sftp import CMD_DATA, CMD_READ, CMD_STATUS, CMD_WRITE, SFTPError, int64
+
+from integrity import StreamHasher
+from metrics import Metrics
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_REQUEST_SIZE = 32 * 1024
+DEFAULT_QUEUE_DEPTH = 128
+DEFAULT_CHANNELS = 4
+
+ChannelFactory = Callable[[], AbstractContextManager]
+ProgressCallback = Callable[[int, int], None]
+CommitCallback = Callable[[int], None]
+
+
+class TransferCancelled(Exception):
+    """Raised when a transfer is stopped through its cancel event."""
+
+
+class SourceChanged(IOError):
+    """Raised when a file being sent or fetched turns out shorter than its size said."""
+
+
+def _data_view(msg: Message) -> memoryview:
+    """The payload of a DATA reply as a view into the received packet, so it is not copied out."""
+    size = msg.get_int()
+    start = msg.packet.tell()
+    return memoryview(msg.asbytes())[start:start + size]
+
+
+def _write_at(f, data, offset: int):
+    """Write all of ``data`` at ``offset`` of the unbuffered file ``f``."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(f.fileno(), view, offset)
+        else:
+            f.seek(offset)
+            written = f.write(view)
+        view = view[written:]
+        offset += written
+
+
+def _preallocate(f, offset: int, length: int):
+    """Reserve disk blocks for ``length`` bytes at ``offset`` where the platform supports it.
+
+    Out-of-order writes then land in allocated space instead of growing a
+    sparse file piecemeal, and a full disk fails the download up front.
+    """
+    if length <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), offset, length)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        # Filesystems without fallocate keep the sparse file from truncate.
+
+
+class _ReadBuffer:
+    """One reusable buffer that file data is read into for each WRITE request.
+
+    paramiko copies the data into the request packet before ``_async_request``
+    returns, so the buffer can be refilled for the next request straight away.
+    """
+
+    def __init__(self, size: int):
+        self._view = memoryview(bytearray(size))
+
+    def read(self, f, size: int) -> memoryview:
+        """Read up to ``size`` bytes of the unbuffered file ``f``; returns a view of what arrived."""
+        n = f.readinto(self._view[:size])
+        return self._view[:n]
+
+
+class _CommitTracker:
+    """Tracks the offset below which every chunk has been fully transferred."""
+
+    def __init__(self, chunks: Deque[Tuple[int, int]], start: int):
+        self.chunks = list(chunks)
+        self.remaining = {offset: length for offset, length in self.chunks}
+        self.next_index = 0
+        self.committed = start
+
+    def complete(self, chunk_offset: int, nbytes: int) -> bool:
+        """Record ``nbytes`` done in a chunk. Returns True if the committed offset moved."""
+        self.remaining[chunk_offset] -= nbytes
+        moved = False
+        while self.next_index < len(self.chunks):
+            offset, length = self.chunks[self.next_index]
+            if self.remaining[offset] > 0:
+                break
+            self.committed = offset + length
+            self.next_index += 1
+            moved = True
+        return moved
+
+
+class ChunkedTransfer:
+    """Large-file transfer engine.
+
+    A file is split into ``chunk_size`` byte ranges that are handed out to up
+    to ``channels`` workers, each on its own SFTP channel. Every worker keeps
+    up to ``queue_depth`` read or write requests of ``request_size`` bytes in
+    flight and writes the data back at the right offset, so throughput is
+    bounded by bandwidth rather than round trips.
+
+    Transfers can start at a non-zero ``offset`` to resume a partial file;
+    ``on_commit`` is called whenever the offset below which all data has
+    arrived moves forward, which is what a checkpoint can safely record.
+
+    Opens, stats and the round trip of every read or write request are
+    timed into ``metrics``.
+
+    Each upload worker reads file data into one reusable buffer rather than
+    a new bytes object per request; downloads write views of the received
+    packets to a preallocated file.
+    """
+
+    def __init__(
+        self,
+        open_channel: ChannelFactory,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        request_size: int = DEFAULT_REQUEST_SIZE,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        channels: int = DEFAULT_CHANNELS,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.open_channel = open_channel
+        self.chunk_size = max(1, chunk_size)
+        self.request_size = max(1, request_size)
+        self.queue_depth = max(1, queue_depth)
+        self.channels = max(1, channels)
+        self.metrics = metrics or Metrics()
+
+    @property
+    def window_size(self) -> int:
+        """SSH channel window large enough to keep the whole queue in flight."""
+        return max(paramiko.common.DEFAULT_WINDOW_SIZE, 2 * self.queue_depth * self.request_size)
+
+    def upload(
+        self,
+        local_path: str,
+        remote_path: str,
+        offset: int = 0,
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+        on_commit: Optional[CommitCallback] = None,
+        hasher: Optional[StreamHasher] = None,
+    ) -> int:
+        """Upload ``local_path`` to ``remote_path`` from ``offset``. Returns the file size.
+
+        ``hasher`` is fed every byte read from ``offset`` on, as it is sent.
+        """
+        total = os.path.getsize(local_path)
+        with self.open_channel() as sftp:
+            if not offset:
+                # Create/truncate once; workers then open the file for positioned writes.
+                self._open_remote(sftp, remote_path, "wb").close()
+            elif self._stat_remote(sftp, remote_path).st_size > total:
+                sftp.truncate(remote_path, total)
+        self._run(self._upload_worker, local_path, remote_path, self._chunks(offset, total), offset, total,
+                  progress, cancel, on_commit, hasher)
+        return total
+
+    def upload_ranges(
+        self,
+        local_path: str,
+        remote_path: str,
+        ranges: List[Tuple[int, int]],
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> int:
+        """Write only the ``(offset, length)`` ranges of ``local_path`` into the existing ``remote_path``.
+
+        The remote file is first cut or extended to the local size. Returns the number of bytes sent.
+        """
+        total = os.path.getsize(local_path)
+        with self.open_channel() as sftp:
+            sftp.truncate(remote_path, total)
+        chunks = deque(
+            (offset, min(self.chunk_size, start + length - offset))
+            for start, length in ranges
+            for offset in range(start, start + length, self.chunk_size)
+        )
+        sent = sum(length for _, length in chunks)
+        self._run(self._upload_worker, local_path, remote_path, chunks, 0, sent, progress, cancel, None, None)
+        return sent
+
+    def download(
+        self,
+        remote_path: str,
+        local_path: str,
+        offset: int = 0,
+        progress: Optional[ProgressCallback] = None,
+        cancel: Optional[threading.Event] = None,
+        on_commit: Optional[CommitCallback] = None,
+        hasher: Optional[StreamHasher] = None,
+    ) -> int:
+        """Download ``remote_path`` to ``local_path`` from ``offset``. Returns the file size.
+
+        ``hasher`` is fed every byte received from ``offset`` on, as it arrives.
+        """
+        with self.open_channel() as sftp:
+            total = self._stat_remote(sftp, remote_path).st_size
+        with open(local_path, "r+b" if offset else "wb") as f:
+            f.truncate(total)
+            _preallocate(f, offset, total - offset)
+        self._run(self._download_worker, remote_path, local_path, self._chunks(offset, total), offset, total,
+                  progress, cancel, on_commit, hasher)
+        return total
+
+    def _open_remote(self, sftp: paramiko.SFTPClient, path: str, mode: str) -> paramiko.SFTPFile:
+        with self.metrics.timed("open"):
+            return sftp.open(path, mode)
+
+    def _stat_remote(self, sftp: paramiko.SFTPClient, path: str) -> paramiko.SFTPAttributes:
+        with self.metrics.timed("stat"):
+            return sftp.stat(path)
+
+    def _chunks(self, start: int, total: int) -> Deque[Tuple[int, int]]:
+        return deque(
+            (offset, min(self.chunk_size, total - offset))
+            for offset in range(start, total, self.chunk_size)
+        )
+
+    def _run(self, worker, src: str, dst: str, chunks: Deque[Tuple[int, int]], start: int, total: int,
+             progress: Optional[ProgressCallback], cancel: Optional[threading.Event],
+             on_commit: Optional[CommitCallback], hasher: Optional[StreamHasher]):
+        if not chunks:
+            if progress:
+                progress(total, total)
+            return
+        if progress:
+            # Report the starting point first so rates leave out bytes a resumed transfer already had.
+            progress(start, total)
+
+        stop = cancel or threading.Event()
+        lock = threading.Lock()
+        tracker = _CommitTracker(chunks, start)
+        done = [start]
+
+        def advance(chunk_offset: int, nbytes: int):
+            with lock:
+                done[0] += nbytes
+                current = done[0]
+                if tracker.complete(chunk_offset, nbytes) and on_commit:
+                    on_commit(tracker.committed)
+            if progress:
+                progress(current, total)
+
+        workers = min(self.channels, len(chunks))
+        failed = threading.Event()
+        errors: List[BaseException] = []
+
+        def run_worker():
+            try:
+                with self.open_channel() as sftp:
+                    worker(sftp, src, dst, chunks, advance, stop, failed, hasher)
+            except BaseException as e:
+                errors.append(e)
+                failed.set()
+                if hasher:
+                    # Workers waiting for this one to fill a gap in the digest would wait forever.
+                    hasher.abort(f"transfer failed: {e}")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sftp-transfer") as pool:
+            for _ in range(workers):
+                pool.submit(run_worker)
+
+        if errors:
+            raise errors[0]
+        if stop.is_set():
+            raise TransferCancelled("Transfer cancelled")
+
+    @staticmethod
+    def _next_chunk(chunks: Deque[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+        try:
+            return chunks.popleft()
+        except IndexError:
+            return None
+
+    def _upload_worker(self, sftp: paramiko.SFTPClient, local_path: str, remote_path: str,
+                       chunks, advance, stop: threading.Event, failed: threading.Event,
+                       hasher: Optional[StreamHasher]):
+        pending: Deque[Tuple[int, int, int, float]] = deque()
+        with open(local_path, "rb", buffering=0) as src, self._open_remote(sftp, remote_path, "r+b") as dst:
+            buffer = _ReadBuffer(self.request_size)
+            while not (stop.is_set() or failed.is_set()):
+                chunk = self._next_chunk(chunks)
+                if chunk is None:
+                    break
+                chunk_offset, length = chunk
+                offset, end = chunk_offset, chunk_offset + length
+                src.seek(offset)
+                while offset < end:
+                    data = buffer.read(src, min(self.request_size, end - offset))
+                    if not data:
+                        raise SourceChanged(f"{local_path} shrank during upload")
+                    if hasher:
+                        hasher.update(offset, data)
+                    num = sftp._async_request(type(None), CMD_WRITE, dst.handle, int64(offset), data)
+                    pending.append((num, chunk_offset, len(data), time.monotonic()))
+                    offset += len(data)
+                    if len(pending) >= self.queue_depth:
+                        self._finish_write(sftp, pending.popleft(), advance)
+            while pending:
+                self._finish_write(sftp, pending.popleft(), advance)
+
+    def _finish_write(self, sftp: paramiko.SFTPClient, request: Tuple[int, int, int, float], advance):
+        num, chunk_offset, size, sent_at = request
+        t, _ = sftp._read_response(num)
+        self.metrics.observe("write", time.monotonic() - sent_at)
+        if t != CMD_STATUS:
+            raise SFTPError("Expected status")
+        advance(chunk_offset, size)
+
+    def _download_worker(self, sftp: paramiko.SFTPClient, remote_path: str, local_path: str,
+                         chunks, advance, stop: threading.Event, failed: threading.Event,
+                         hasher: Optional[StreamHasher]):
+        pending: Deque[Tuple[int, int, int, int, float]] = deque()
+        with self._open_remote(sftp, remote_path, "rb") as src, open(local_path, "r+b", buffering=0) as dst:
+            while not (stop.is_set() or failed.is_set()):
+                chunk = self._next_chunk(chunks)
+                if chunk is None:
+                    break
+                chunk_offset, length = chunk
+                offset, end = chunk_offset, chunk_offset + length
+                while offset < end:
+                    size = min(self.request_size, end - offset)
+                    num = sftp._async_request(type(None), CMD_READ, src.handle, int64(offset), size)
+                    pending.append((num, chunk_offset, offset, size, time.monotonic()))
+                    offset += size
+                    if len(pending) >= self.queue_depth:
+                        self._finish_read(sftp, src, dst, pending.popleft(), advance, hasher)
+            while pending:
+                self._finish_read(sftp, src, dst, pending.popleft(), advance, hasher)
+
+    def _finish_read(self, sftp: paramiko.SFTPClient, src: paramiko.SFTPFile, dst,
+                     request: Tuple[int, int, int, int, float], advance, hasher: Optional[StreamHasher]):
+        num, chunk_offset, offset, size, sent_at = request
+        t, msg = sftp._read_response(num)
+        self.metrics.observe("read", time.monotonic() - sent_at)
+        if t != CMD_DATA:
+            raise SFTPError("Expected data")
+        data = _data_view(msg)
+        if hasher:
+            hasher.update(offset, data)
+        # ``dst`` is unbuffered, so a checkpoint never hashes bytes still held in memory.
+        _write_at(dst, data, offset)
+        if len(data) < size:
+            # Servers may cap the read length; fetch the remainder synchronously.
+            src.seek(offset + len(data))
+            rest = src.read(size - len(data))
+            if len(rest) < size - len(data):
+                raise SourceChanged("Remote file shrank during download")
+            if hasher:
+                hasher.update(offset + len(data), rest)
+            _write_at(dst, rest, offset + len(data))
+        advance(chunk_offset, size)
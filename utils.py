@@ -4,4 +4,22 @@ def log_to_widget(widget: ctk.CTkTextbox, msg: str):
     widget.configure(state="normal")
     widget.insert("end", msg + "\n")
     widget.see("end")
-    widget.configure(state="disabled")
\ No newline at end of file
+    widget.configure(state="disabled")
+
+def human_size(size_bytes: int) -> str:
+    if size_bytes == 0:
+        return "0 B"
+    units = ["B", "KB", "MB", "GB"]
+    i = 0
+    while size_bytes >= 1024 and i < len(units) - 1:
+        size_bytes /= 1024.0
+        i += 1
+    return f"{size_bytes:.1f} {units[i]}"
+
+def human_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"